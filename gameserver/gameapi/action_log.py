@@ -0,0 +1,231 @@
+"""
+Append-only binary log of game actions and deterministic replay
+
+Log file of a game is a header followed by fixed size move records::
+
+    header: b'DRKL' | version: u8 | seed: u128 | players count: u8 | players: 16 bytes each
+            | starting player index: u8
+    record: player index: u8 | action: u8 | card index: u8 (NO_CARD for actions without card)
+
+Game dealing is fully determined by seed and players, so replaying the records
+through ``Game.take_action_by_index`` restores the game at any move.
+"""
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+from django.conf import settings
+
+from gameapi.models import NUMBER_OF_CARDS, Game
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DRKL'
+# Version 2: decks are shuffled with per-game random.Random, version 1 logs do not replay
+VERSION = 2
+NO_CARD = 0xFF
+
+HEADER_START = struct.Struct('>4sB16sB')
+RECORD = struct.Struct('>BBB')
+
+ACTION_CODES: Dict[Game.Action, int] = {
+    Game.Action.PUT: 0,
+    Game.Action.TAKE: 1,
+    Game.Action.ENDTURN: 2,
+}
+ACTIONS: Dict[int, Game.Action] = {code: action for action, code in ACTION_CODES.items()}
+
+
+class CorruptedLog(Exception):
+    pass
+
+
+def encode_header(game: Game) -> bytes:
+    starting_player = game.active_player if game.number_of_moves == 0 else None
+    if starting_player is None:
+        raise ValueError('Action log has to be started before the first move')
+    return b''.join([
+        HEADER_START.pack(MAGIC, VERSION, game.seed.to_bytes(16, 'big'), len(game.players)),
+        b''.join(player.bytes for player in game.players),
+        bytes([game.players.index(starting_player)]),
+    ])
+
+
+class ActionLog(object):
+    """
+    Log of one game. ``append`` only buffers the record, ``flush`` writes
+    buffered records and fsyncs the file. The file is opened only for the time
+    of a flush, so idle and abandoned games do not hold file descriptors.
+
+    :param resume: continue existing log of a restored game instead of starting a new one
+    """
+
+    def __init__(self, path: str, game: Game, resume: bool = False):
+        self.path = path
+        self.players: List[UUID] = list(game.players)
+        self.closed = False
+        self._buffer = bytearray() if resume else bytearray(encode_header(game))
+        self._buffer_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        if not resume:
+            # A new log never continues an existing file, e.g. of another game with the same id
+            open(path, 'xb').close()
+
+    def append(self, player: UUID, action: Game.Action, card: int):
+        record = RECORD.pack(
+            self.players.index(player),
+            ACTION_CODES[action],
+            NO_CARD if card is None else card,
+        )
+        with self._buffer_lock:
+            self._buffer += record
+
+    @property
+    def dirty(self):
+        return bool(self._buffer)
+
+    def flush(self):
+        with self._file_lock:
+            with self._buffer_lock:
+                data, self._buffer = self._buffer, bytearray()
+            if not data or self.closed:
+                return
+            with open(self.path, 'ab') as log_file:
+                log_file.write(data)
+                log_file.flush()
+                os.fsync(log_file.fileno())
+
+    def close(self):
+        self.flush()
+        self.closed = True
+
+
+class ActionLogWriter(object):
+    """
+    Keeps action logs of running games and fsyncs them in batches from a background thread
+    """
+    _instance = None
+
+    def __init__(self, directory: str, flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.logs: Dict[UUID, ActionLog] = {}
+        self._lock = threading.Lock()
+        self._flusher: threading.Thread = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                getattr(settings, 'ACTION_LOG_DIR', None),
+                getattr(settings, 'ACTION_LOG_FLUSH_INTERVAL', 1.0),
+            )
+        return cls._instance
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def path_for(self, game_id: UUID) -> str:
+        return os.path.join(self.directory, '%s.log' % game_id)
+
+    def start_log(self, game_id: UUID, game: Game, resume: bool = False):
+        """
+        Start logging actions of **`game`**, must be called before the first move
+        unless **`resume`** continues the log of a restored game holding all its moves
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        log = ActionLog(self.path_for(game_id), game, resume)
+        with self._lock:
+            self.logs[game_id] = log
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name='action-log-flusher',
+                                                 daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush_all)
+
+        def log_action(game_: Game, token: UUID, action: Game.Action, card: int):
+            log.append(token, action, card)
+            if game_.is_over():
+                game_.unsubscribe(log_action)
+                self.finish_log(game_id)
+
+        game.subscribe(log_action)
+        return log
+
+    def finish_log(self, game_id: UUID):
+        with self._lock:
+            log = self.logs.pop(game_id, None)
+        if log is not None:
+            log.close()
+
+    def flush_all(self):
+        with self._lock:
+            logs = list(self.logs.values())
+        for log in logs:
+            if log.dirty:
+                log.flush()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_all()
+            except Exception:
+                logger.exception('Could not flush action logs')
+
+
+def read_log(path: str) -> Tuple[int, List[UUID], UUID, List[Tuple[UUID, Game.Action, int]]]:
+    """
+    :return: seed, players, starting player and list of ``(player, action, card)`` records
+    :raises CorruptedLog: if file is not an action log or its records are garbled
+    """
+    with open(path, 'rb') as log_file:
+        data = log_file.read()
+    if len(data) < HEADER_START.size:
+        raise CorruptedLog('Log %s is too short' % path)
+    magic, version, seed_bytes, number_of_players = HEADER_START.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise CorruptedLog('Log %s has unknown format %r version %d' % (path, magic, version))
+    offset = HEADER_START.size
+    if len(data) < offset + 16 * number_of_players + 1:
+        raise CorruptedLog('Log %s has truncated header' % path)
+    players = [UUID(bytes=data[offset + 16 * index:offset + 16 * (index + 1)]) for index in range(number_of_players)]
+    offset += 16 * number_of_players
+    if data[offset] >= number_of_players:
+        raise CorruptedLog('Log %s has unknown starting player %d' % (path, data[offset]))
+    starting_player = players[data[offset]]
+    offset += 1
+    records = []
+    # A torn last record after a crash is ignored
+    for index, (player, action, card) in enumerate(
+            RECORD.iter_unpack(data[offset:len(data) - (len(data) - offset) % RECORD.size])
+    ):
+        if player >= number_of_players or action not in ACTIONS or (card >= NUMBER_OF_CARDS and card != NO_CARD):
+            raise CorruptedLog('Log %s has garbled record %d' % (path, index))
+        records.append((players[player], ACTIONS[action], None if card == NO_CARD else card))
+    return int.from_bytes(seed_bytes, 'big'), players, starting_player, records
+
+
+def replay(path: str, number_of_moves: int = None) -> Game:
+    """
+    Restore game from action log at move **`number_of_moves`** (last logged move if None)
+
+    :raises CorruptedLog: if the log can not be read or holds a move the game does not accept
+    """
+    seed, players, starting_player, records = read_log(path)
+    game = Game().start(players, last_winners={starting_player}, seed=seed)
+    for index, (player, action, card) in enumerate(records[:number_of_moves]):
+        try:
+            game.take_action_by_index(player, action, card)
+        except (Game.ActionNotAllowed, Game.ActionInvalid) as error:
+            raise CorruptedLog('Log %s has move %d the game does not accept: %s' % (path, index, error))
+    return game
+
+
+action_log_writer = ActionLogWriter.get_instance()
@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
 
 
 class GameapiConfig(AppConfig):
     name = 'gameapi'
+
+    def ready(self):
+        from gameapi.models import Token
+        from gameapi.token_cache import invalidate_cached_token
+
+        post_save.connect(invalidate_cached_token, sender=Token, dispatch_uid='token_cache_post_save')
+        post_delete.connect(invalidate_cached_token, sender=Token, dispatch_uid='token_cache_post_delete')
+
+        # Test games are started on the first request, not on import, so commands and workers start clean
+        if getattr(settings, 'SEED_GAMES', 0):
+            from gameapi.games_manager import seed_games_on_first_request
+
+            request_started.connect(seed_games_on_first_request, dispatch_uid='seed_games_on_first_request')
@@ -0,0 +1,46 @@
+import logging
+from typing import Iterable, Optional, Tuple
+from uuid import UUID
+
+import ujson
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from gameapi.models import ArchivedGame, Game
+
+logger = logging.getLogger(__name__)
+
+
+class GameArchive(object):
+    """
+    Durable storage of finished games backed by ``ArchivedGame`` model
+    """
+
+    def save(self, games: Iterable[Tuple[UUID, Game]]):
+        records = [
+            ArchivedGame(
+                game_id=game_id,
+                data=ujson.dumps(game.to_dict()),
+                finished_at=None if game.finished_at is None else timezone.make_aware(game.finished_at, timezone.utc),
+            )
+            for game_id, game in games
+        ]
+        try:
+            with transaction.atomic():
+                ArchivedGame.objects.bulk_create(records)
+        except IntegrityError:
+            # Game archived already, e.g. by a process that crashed before dropping its snapshot:
+            # the game in memory is the latest one, and one conflict must not stop archiving others
+            logger.warning('Archived games conflict with stored ones, archiving one by one')
+            for record in records:
+                ArchivedGame.objects.update_or_create(
+                    game_id=record.game_id, defaults={'data': record.data, 'finished_at': record.finished_at},
+                )
+        logger.info('Archived %d games', len(records))
+
+    def load(self, game_id: UUID) -> Optional[Game]:
+        try:
+            record = ArchivedGame.objects.get(game_id=game_id)
+        except ArchivedGame.DoesNotExist:
+            return None
+        return Game.from_dict(ujson.loads(record.data))
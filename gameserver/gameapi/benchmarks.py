@@ -0,0 +1,263 @@
+"""
+Benchmarks of engine and API hot paths
+
+Every benchmark is a function taking a prepared ``BenchmarkContext`` and returning
+a runner: callable that performs the operation given number of times and returns
+elapsed seconds, excluding any per-call preparation. Results are plain dicts so
+they can be stored as JSON and compared against a baseline.
+"""
+import logging
+import platform
+import statistics
+import time
+import uuid
+from typing import Callable, Dict, List
+
+import ujson
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import Client
+
+import gameapi.views
+from gameapi.action_log import action_log_writer
+from gameapi.events import event_log
+from gameapi.games_manager import GameManager
+from gameapi.models import Card, Game, GameField, Token, iter_cards
+from gameapi.player_stats import PlayerStatsRegistry
+from gameapi.token_access_log import token_access_log
+
+logger = logging.getLogger(__name__)
+
+PLAYERS = (uuid.UUID(int=1), uuid.UUID(int=2))
+
+
+class BenchmarkContext(object):
+    """
+    Fixtures shared by benchmarks: tokens to register games for, a test client and
+    a private game manager serving the views, without snapshots and with its own player statistics
+    """
+
+    def __init__(self, tokens: List[Token]):
+        self.tokens = tokens
+        self.client = Client()
+        self.manager = GameManager(snapshots=None, stats=PlayerStatsRegistry())
+
+    def new_game(self, seed=0, players=PLAYERS) -> Game:
+        return Game().start(list(players), seed=seed)
+
+    def new_registered_game(self, seed=0):
+        game = self.new_game(seed, [token.token for token in self.tokens])
+        return game, self.manager.add_game(game)
+
+
+def first_legal_card(game: Game, token: uuid.UUID):
+    for card in iter_cards(game.field.player_cards[token]):
+        if game.is_action_valid(token, Game.Action.PUT, card):
+            return card
+    return None
+
+
+def timed(fn: Callable):
+    """
+    Make stateless **`fn`** a benchmark runner
+    """
+
+    def run(number: int):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return time.perf_counter() - started_at
+
+    return run
+
+
+def timed_with_setup(setup: Callable, fn: Callable):
+    """
+    Make benchmark runner calling ``fn(setup(i))``, only the calls of **`fn`** are timed
+    """
+
+    def run(number: int):
+        prepared = [setup(i) for i in range(number)]
+        started_at = time.perf_counter()
+        for item in prepared:
+            fn(item)
+        return time.perf_counter() - started_at
+
+    return run
+
+
+def put_first_legal_card(game: Game):
+    player = game.active_player
+    card = first_legal_card(game, player)
+    if card is None:
+        game.take_action_by_index(player, Game.Action.TAKE, None)
+    else:
+        game.take_action_by_index(player, Game.Action.PUT, card)
+
+
+def bench_randomize_game(context: BenchmarkContext):
+    players = set(PLAYERS)
+    return timed(lambda: GameField().randomize_game(players, seed=1))
+
+
+def bench_game_start(context: BenchmarkContext):
+    return timed(lambda: context.new_game(seed=1))
+
+
+def bench_take_action_put(context: BenchmarkContext):
+    return timed_with_setup(context.new_game, put_first_legal_card)
+
+
+def bench_take_action_take(context: BenchmarkContext):
+    def setup(seed):
+        game = context.new_game(seed)
+        put_first_legal_card(game)
+        return game
+
+    return timed_with_setup(setup, lambda game: game.take_action_by_index(game.active_player, Game.Action.TAKE, None))
+
+
+def bench_take_action_endturn(context: BenchmarkContext):
+    def setup(seed):
+        # Attack and defend until the table is covered
+        while True:
+            game = context.new_game(seed)
+            put_first_legal_card(game)
+            put_first_legal_card(game)
+            if game.field.table:
+                return game
+            seed += 1000000
+
+    return timed_with_setup(
+        setup,
+        lambda game: game.take_action_by_index(game.active_player, Game.Action.ENDTURN, None),
+    )
+
+
+def bench_get_state(context: BenchmarkContext):
+    game = context.new_game(seed=1)
+    player = game.active_player
+    return timed(lambda: ujson.dumps(game.get_state(player)))
+
+
+def bench_card_from_string(context: BenchmarkContext):
+    return timed(lambda: Card.from_string('10H'))
+
+
+def bench_view_get_state(context: BenchmarkContext):
+    game, game_id = context.new_registered_game(seed=1)
+    url = '/game/play/%s/get_state/' % game_id
+    data = {'token': str(game.active_player)}
+    return timed(lambda: context.client.get(url, data))
+
+
+def bench_view_take_action(context: BenchmarkContext):
+    def setup(seed):
+        game, game_id = context.new_registered_game(seed)
+        player = game.active_player
+        return '/game/play/%s/take_action/' % game_id, {
+            'token': str(player),
+            'action': 'put',
+            'card': Card.from_index(first_legal_card(game, player)).to_card_string(),
+        }
+
+    def run(request):
+        response = context.client.get(*request)
+        assert response.status_code == 200, response.content
+
+    return timed_with_setup(setup, run)
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    'GameField.randomize_game': bench_randomize_game,
+    'Game.start': bench_game_start,
+    'Game.take_action[put]': bench_take_action_put,
+    'Game.take_action[take]': bench_take_action_take,
+    'Game.take_action[endturn]': bench_take_action_endturn,
+    'Game.get_state+ujson.dumps': bench_get_state,
+    'Card.from_string': bench_card_from_string,
+    'view get_state': bench_view_get_state,
+    'view take_action': bench_view_take_action,
+}
+
+
+def measure(run: Callable, min_time: float, repeat: int):
+    """
+    Time benchmark runner in ``repeat`` rounds, each round lasting at least **`min_time`** seconds
+
+    :return: seconds per call for every round
+    """
+    number = 1
+    while True:
+        elapsed = run(number)
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed < min_time / 10 else max(2, int(min_time / elapsed) + 1)
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        rounds.append(run(number) / number)
+    return rounds
+
+
+def run_benchmarks(names: List[str] = None, min_time: float = 0.2, repeat: int = 5):
+    """
+    Run benchmarks against throwaway users and tokens, rolled back afterwards
+    """
+    results = {}
+    previously_disabled = logging.root.manager.disable
+    logging.disable(max(previously_disabled, logging.WARNING))
+    previous_event_level = event_log.level
+    event_log.level = max(previous_event_level, logging.WARNING)
+    # Throwaway tokens are rolled back, their access records could not be written
+    previous_max_pending = token_access_log.max_pending
+    token_access_log.max_pending = 0
+    # Action logs and snapshots are not covered by the rollback, benchmark games leave neither
+    previous_action_log_dir = action_log_writer.directory
+    action_log_writer.directory = ''
+    previous_game_manager = gameapi.views.game_manager
+    context = None
+    try:
+        with transaction.atomic():
+            tokens = [
+                Token.objects.create(owner=User.objects.create(username='benchmark-%s' % uuid.uuid4().hex))
+                for _ in PLAYERS
+            ]
+            context = BenchmarkContext(tokens)
+            gameapi.views.game_manager = context.manager
+            for name in names or BENCHMARKS:
+                rounds = measure(BENCHMARKS[name](context), min_time, repeat)
+                results[name] = {
+                    'min': min(rounds),
+                    'median': statistics.median(rounds),
+                    'rounds': rounds,
+                }
+            transaction.set_rollback(True)
+    finally:
+        logging.disable(previously_disabled)
+        event_log.level = previous_event_level
+        token_access_log.max_pending = previous_max_pending
+        action_log_writer.directory = previous_action_log_dir
+        gameapi.views.game_manager = previous_game_manager
+        if context is not None:
+            context.manager.close()
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'benchmarks': results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """
+    Compare medians of **`results`** against **`baseline`**
+
+    :return: list of ``(name, baseline_median, median, ratio, regressed)``
+    """
+    rows = []
+    for name, result in results['benchmarks'].items():
+        if name not in baseline.get('benchmarks', {}):
+            continue
+        baseline_median = baseline['benchmarks'][name]['median']
+        ratio = result['median'] / baseline_median if baseline_median else float('inf')
+        rows.append((name, baseline_median, result['median'], ratio, ratio > 1 + threshold))
+    return rows
@@ -0,0 +1,121 @@
+"""
+Structured event log
+
+Events are ``category``, ``event`` name and fields, written as one JSON line to
+the ``gameapi.events`` logger. Callers on hot paths check ``events.enabled`` first,
+so nothing is built for events below ``EVENT_LOG_LEVEL`` or dropped by sampling::
+
+    if events.enabled(events.MOVE, logging.DEBUG):
+        events.emit(events.MOVE, logging.DEBUG, 'move', game=..., action=...)
+
+``emit`` only puts a tuple into a bounded queue. Formatting and writing happen in a
+background thread, events not fitting into the queue are dropped and counted.
+"""
+import datetime
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Dict
+
+import ujson
+from django.conf import settings
+
+from gameapi import metrics
+
+logger = logging.getLogger(__name__)
+
+# Categories
+MOVE = 'move'
+ACTION_REJECTED = 'action_rejected'
+GAME = 'game'
+REQUEST = 'request'
+
+
+def parse_sampling(sampling: str) -> Dict[str, float]:
+    """
+    Parse ``category:rate`` comma separated list, e.g. ``move:0.01,request:0.1``
+    """
+    rates = {}
+    for item in filter(None, sampling.split(',')):
+        category, _, rate = item.partition(':')
+        rates[category.strip()] = float(rate)
+    return rates
+
+
+class EventLog(object):
+    _instance = None
+
+    def __init__(self, level: int = logging.INFO, sampling: Dict[str, float] = None, queue_size: int = 10000):
+        self.level = level
+        # category -> share of events written, categories not listed are written fully
+        self.sampling = sampling or {}
+        self.dropped = 0
+        self.output = logging.getLogger('gameapi.events')
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._writer: threading.Thread = None
+        self._writer_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                level=logging.getLevelName(getattr(settings, 'EVENT_LOG_LEVEL', 'INFO')),
+                sampling=parse_sampling(getattr(settings, 'EVENT_LOG_SAMPLING', '')),
+                queue_size=getattr(settings, 'EVENT_LOG_QUEUE_SIZE', 10000),
+            )
+        return cls._instance
+
+    def enabled(self, category: str, level: int) -> bool:
+        """
+        Whether an event should be emitted, includes the sampling decision
+        """
+        if level < self.level:
+            return False
+        rate = self.sampling.get(category)
+        return rate is None or random.random() < rate
+
+    def emit(self, category: str, level: int, event: str, **fields):
+        if self._writer is None:
+            self._start_writer()
+        try:
+            self._queue.put_nowait((datetime.datetime.utcnow(), category, level, event, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def _start_writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, name='event-log-writer', daemon=True)
+                self._writer.start()
+
+    def _write(self):
+        while True:
+            timestamp, category, level, event, fields = self._queue.get()
+            try:
+                record = {'time': timestamp.isoformat(), 'category': category, 'event': event}
+                record.update((key, str(value) if not isinstance(value, (int, float, str, bool, type(None)))
+                               else value) for key, value in fields.items())
+                self.output.log(level, ujson.dumps(record))
+            except Exception:
+                logger.exception('Could not write event %s', event)
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout: float = 1.0):
+        """
+        Wait until queued events are written (for tests and shutdown)
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+event_log = EventLog.get_instance()
+enabled = event_log.enabled
+emit = event_log.emit
+
+metrics.registry.register(metrics.CallbackCounter(
+    'durak_events_dropped_total', 'Events dropped because event log queue was full', lambda: event_log.dropped,
+))
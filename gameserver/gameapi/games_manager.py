@@ -1,9 +1,21 @@
+import datetime
 import logging
-from operator import itemgetter
-from typing import Dict, List, Iterable
-from uuid import uuid4, UUID
+import threading
+import time
+from typing import Dict, List, Iterable, Set, Tuple
+from uuid import UUID
 
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connection
+
+from gameapi import metrics
+from gameapi.action_log import action_log_writer
+from gameapi.archive import GameArchive
 from gameapi.models import Game, Token
+from gameapi.player_stats import PlayerStatsRegistry, player_stats
+from gameapi.sharding import shard_map
+from gameapi.snapshots import SnapshotStore, snapshot_store
 
 logger = logging.getLogger(__name__)
 
@@ -16,59 +28,305 @@ class GameManager(object):
     DoesNotExist = DoesNotExist
     _instance = None
 
-    def __init__(self):
+    ACTIVE = 'active'
+    FINISHED = 'finished'
+
+    def __init__(self, archive: GameArchive = None, grace_period: float = 300, max_resident_games: int = 10000,
+                 collect_interval: float = 10, lock_stripes: int = 64, snapshots: SnapshotStore = None,
+                 max_listed_finished_games: int = 100000, stats: PlayerStatsRegistry = None):
+        # Single dict reads and writes are atomic, compound updates of a game or of a player's
+        # index entry take one of the striped locks, so unrelated games never wait for each other
         self.games: Dict[UUID, Game] = {}
+        # player token -> ids of games the player takes part in
+        self.player_games: Dict[UUID, Set[UUID]] = {}
+        self.archive = archive if archive is not None else GameArchive()
+        # Statistics of players of the games, process-wide ones by default
+        self.stats = stats if stats is not None else player_stats
+        # Running games survive restarts in snapshots, finished ones are moved to the archive
+        self.snapshots = snapshots
+        # Finished games of the player index not in memory: indexed from snapshots or evicted to the archive.
+        # game_id -> players, oldest first. Beyond max_listed_finished_games the oldest ones are dropped
+        # from the index, they are still loaded from the archive by id.
+        self.stored_finished: Dict[UUID, Tuple[UUID, ...]] = {}
+        self.max_listed_finished_games = max_listed_finished_games
+        # Games in memory reloaded from the archive, evicted without archiving them again
+        self.archived: Set[UUID] = set()
+        self._index_restored = snapshots is None
+        self._index_lock = threading.Lock()
+        # Finished games stay in memory for grace_period seconds, then are archived and evicted
+        # by a background thread every collect_interval seconds, or sooner when there are
+        # more than max_resident_games in memory
+        self.grace_period = grace_period
+        self.max_resident_games = max_resident_games
+        self.collect_interval = collect_interval
+        self._collector: threading.Thread = None
+        self._collect_now = threading.Event()
+        self._closed = False
+        # Taken in this order: game stripe, then player stripe
+        self._game_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._player_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._collect_lock = threading.Lock()
 
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
-            cls._instance = cls()
+            cls._instance = cls(
+                grace_period=getattr(settings, 'FINISHED_GAME_GRACE_PERIOD', 300),
+                max_resident_games=getattr(settings, 'MAX_RESIDENT_GAMES', 10000),
+                max_listed_finished_games=getattr(settings, 'MAX_LISTED_FINISHED_GAMES', 100000),
+                snapshots=snapshot_store if snapshot_store.enabled else None,
+            )
         return cls._instance
 
-    def add_game(self, game: Game):
-        if not self.games:
-            game_id = UUID('1111-1111-1111-1111-1111-1111-1111-1111')
-        else:
-            game_id = uuid4()
-        self.games[game_id] = game
+    def restore_index(self):
+        """
+        Index games stored in snapshots by player, games themselves are loaded by ``get_game``.
+        Done once on first use of the index rather than on import.
+        """
+        with self._index_lock:
+            if self._index_restored:
+                return
+            self._index_restored = True
+            if self.snapshots is None:
+                return
+            self._restore_index()
+
+    def _restore_index(self):
+        started_at = time.monotonic()
+        index = self.snapshots.load_index()
+        for game_id, players, finished in index:
+            for player in players:
+                with self._stripe(self._player_locks, player):
+                    self.player_games.setdefault(player, set()).add(game_id)
+            if finished:
+                self.stored_finished[game_id] = tuple(players)
+        # Eviction prunes the index too
+        with self._collect_lock:
+            self._prune_stored_finished()
+        logger.info('Indexed %d stored games in %.3fs', len(index), time.monotonic() - started_at)
+
+    def add_game(self, game: Game, game_id: UUID = None):
+        """
+        Register new game, **`game_id`** has to be owned by this shard if given
+
+        :return: id of the game
+        """
+        if game_id is None:
+            game_id = shard_map.new_game_id()
+        self._register(game_id, game)
+        if action_log_writer.enabled and game.number_of_moves == 0:
+            action_log_writer.start_log(game_id, game)
+        if self.snapshots is not None and not game.is_over():
+            self.snapshots.track(game_id, game)
+        if not game.is_over():
+            self.stats.track(game)
+        if self._collector is None:
+            self._start_collector()
+        if len(self.games) > self.max_resident_games:
+            self._collect_now.set()
         return game_id
 
+    def _start_collector(self):
+        with self._collect_lock:
+            if self._collector is None and not self._closed:
+                self._collector = threading.Thread(target=self._collect_periodically, name='game-collector',
+                                                   daemon=True)
+                self._collector.start()
+
+    def _collect_periodically(self):
+        while not self._closed:
+            self._collect_now.wait(self.collect_interval)
+            self._collect_now.clear()
+            if self._closed:
+                return
+            try:
+                self.evict_finished_games()
+            except Exception:
+                logger.exception('Could not evict finished games')
+            finally:
+                # Do not keep the thread's connection open between collections
+                connection.close()
+
+    def close(self):
+        """
+        Stop background eviction, games stay in memory
+        """
+        self._closed = True
+        self._collect_now.set()
+
+    @staticmethod
+    def _stripe(locks: List[threading.Lock], key: UUID) -> threading.Lock:
+        return locks[key.int % len(locks)]
+
+    def _register(self, game_id: UUID, game: Game):
+        self.games[game_id] = game
+        for player in game.players:
+            with self._stripe(self._player_locks, player):
+                self.player_games.setdefault(player, set()).add(game_id)
+
+    def _unindex(self, game_id: UUID, players: Iterable[UUID]):
+        for player in players:
+            with self._stripe(self._player_locks, player):
+                player_games = self.player_games.get(player)
+                if player_games is None:
+                    continue
+                player_games.discard(game_id)
+                if not player_games:
+                    del self.player_games[player]
+
     def get_game(self, game_id: UUID) -> Game:
         """
         Get game from game manager
 
         :raises DoesNotExist: if game is not registered in game manager
         """
-        logger.info('Getting game with game_id = %s', game_id)
         try:
             return self.games[game_id]
         except KeyError:
-            logger.exception(
-                'Game "%s" doesnt exist. Existing games: %s',
-                game_id,
-                self.games.keys()
-            )
-            raise DoesNotExist('Game with id "%s" doesnt exist' % game_id)
+            pass
+        with self._stripe(self._game_locks, game_id):
+            # Concurrent requests for an archived game load it once
+            game = self.games.get(game_id)
+            if game is not None:
+                return game
+            if not self._index_restored:
+                self.restore_index()
+            game = None
+            if game_id in self.stored_finished:
+                # Finished game could be archived before its snapshot was dropped
+                game = self._load_archived(game_id)
+                if game is not None:
+                    if self.snapshots is not None:
+                        self.snapshots.forget([game_id])
+                    return game
+            if self.snapshots is not None:
+                game = self.snapshots.load(game_id)
+            if game is not None:
+                logger.info('Restored game %s from snapshot at move %d', game_id, game.number_of_moves)
+                self._register(game_id, game)
+                self.snapshots.track(game_id, game)
+                if not game.is_over():
+                    self.stats.track(game)
+                return game
+            game = self._load_archived(game_id)
+            if game is None:
+                logger.warning('Game "%s" doesnt exist. %d games in memory', game_id, len(self.games))
+                raise DoesNotExist('Game with id "%s" doesnt exist' % game_id)
+        return game
+
+    def _load_archived(self, game_id: UUID) -> Game:
+        game = self.archive.load(game_id)
+        if game is not None:
+            logger.info('Reloaded archived game %s', game_id)
+            self.archived.add(game_id)
+            self._register(game_id, game)
+        return game
+
+    def evict_finished_games(self):
+        """
+        Archive and drop from memory finished games older than grace period,
+        and the oldest finished games while there are more than ``max_resident_games``.
+        Does nothing if another thread is already collecting.
+        """
+        if not self._collect_lock.acquire(blocking=False):
+            return
+        try:
+            self._evict_finished_games()
+        finally:
+            self._collect_lock.release()
+
+    def _evict_finished_games(self):
+        finished = sorted(
+            ((game.finished_at, game_id) for game_id, game in list(self.games.items()) if game.is_over()),
+            # Games without finish time (e.g. from old snapshots) go first
+            key=lambda entry: (entry[0] is not None, entry[0] or datetime.datetime.min),
+        )
+        expired_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.grace_period)
+        over_limit = len(self.games) - self.max_resident_games
+        evicted = [
+            game_id for index, (finished_at, game_id) in enumerate(finished)
+            if index < over_limit or finished_at is None or finished_at <= expired_before
+        ]
+        if not evicted:
+            return
+        self.archive.save((game_id, self.games[game_id]) for game_id in evicted if game_id not in self.archived)
+        self.archived.difference_update(evicted)
+        if self.snapshots is not None:
+            self.snapshots.forget(evicted)
+        # Players keep listing evicted games, get_game reloads them from the archive
+        for game_id in evicted:
+            self.stored_finished[game_id] = tuple(self.games[game_id].players)
+            self.games.pop(game_id, None)
+        self._prune_stored_finished()
+        logger.info('Evicted %d finished games, %d games in memory', len(evicted), len(self.games))
+
+    def _prune_stored_finished(self):
+        while len(self.stored_finished) > self.max_listed_finished_games:
+            game_id = next(iter(self.stored_finished))
+            players = self.stored_finished.pop(game_id)
+            # Game reloaded from the archive stays listed, it is stored again on its next eviction
+            if game_id not in self.games:
+                self._unindex(game_id, players)
 
-    def list_games(self, user_id: UUID) -> Iterable[UUID]:
+    def list_games(self, user_id: UUID, status: str = None) -> Iterable[UUID]:
         """
         List games that user_id is in
+
+        :param status: ``ACTIVE`` or ``FINISHED`` to list only such games, all games if None
         """
-        return (game_id for game_id, game in self.games.items() if user_id in game.players)
+        if not self._index_restored:
+            self.restore_index()
+        with self._stripe(self._player_locks, user_id):
+            game_ids = list(self.player_games.get(user_id, ()))
+        if status is None:
+            return game_ids
+        finished = status == self.FINISHED
+        listed = []
+        for game_id in game_ids:
+            # Game can be evicted between the lookups, it is finished then
+            game = self.games.get(game_id)
+            if (game.is_over() if game is not None else game_id in self.stored_finished) == finished:
+                listed.append(game_id)
+        return listed
 
+    def count_games(self):
+        """
+        Number of games in memory by status
+        """
+        finished = sum(1 for game in list(self.games.values()) if game.is_over())
+        return {
+            (self.ACTIVE,): len(self.games) - finished,
+            (self.FINISHED,): finished,
+        }
 
-game_manager = GameManager.get_instance()
 
-try:
-    for i in range(3):
-        game_ = Game()
-        tokens = list(map(itemgetter('token'), Token.objects.filter(valid=True).values('token')[:2]))
-        players = set(tokens)
-        game_.start(players)
-        test_game_id = game_manager.add_game(game_)
-        logger.info('Here are game players: %s', game_.players)
-        logger.info('Test game id %s', test_game_id)
-        logger.info('Game state: %s', str(game_.field))
-
-except Exception:
-    logger.exception("OOPS")
+def seed_games(count: int = 3) -> List[UUID]:
+    """
+    Start **`count`** test games between the first two valid tokens
+    """
+    tokens = list(Token.objects.filter(valid=True).values_list('token', flat=True)[:2])
+    if len(tokens) < 2:
+        logger.warning('Need two valid tokens to seed test games, found %d', len(tokens))
+        return []
+    game_ids = [game_manager.add_game(Game().start(tokens)) for _ in range(count)]
+    logger.info('Seeded test games %s for players %s', game_ids, tokens)
+    return game_ids
+
+
+_seed_lock = threading.Lock()
+
+
+def seed_games_on_first_request(sender, **kwargs):
+    """
+    ``request_started`` receiver starting ``SEED_GAMES`` test games once, see ``GameapiConfig.ready``
+    """
+    with _seed_lock:
+        if not request_started.disconnect(dispatch_uid='seed_games_on_first_request'):
+            return
+    seed_games(getattr(settings, 'SEED_GAMES', 0))
+
+
+game_manager = GameManager.get_instance()
+metrics.registry.register(metrics.Gauge(
+    'durak_games', 'Games kept in memory', game_manager.count_games, ['status'],
+))
@@ -0,0 +1,101 @@
+"""
+Long polling of ``get_state?wait=...`` on the event loop
+
+Under ASGI a waiting request does not hold a thread of the pool serving HTTP requests:
+it waits on the event loop, woken by a game listener the same way game WebSockets are,
+and is passed to the ``get_state`` view without ``wait`` once there is news or the wait
+is over. Anything that can not wait (bad token, unknown game, game of another shard,
+malformed parameters) is passed to the view as is, so the view answers it.
+"""
+import asyncio
+import logging
+import re
+from urllib.parse import parse_qsl, urlencode
+from uuid import UUID
+
+from django.conf import settings
+
+from gameapi.games_manager import DoesNotExist, game_manager
+from gameapi.models import Game, Token
+from gameapi.sharding import shard_map
+from gameapi.views import check_token_exists, check_token_in_game
+
+logger = logging.getLogger(__name__)
+
+GET_STATE_PATH = re.compile(r'^/game/play/(?P<game_id>[0-9a-fA-F-]{36})/get_state/?$')
+
+
+def wants_to_wait(scope) -> bool:
+    return (
+        scope['type'] == 'http' and
+        scope.get('method') == 'GET' and
+        GET_STATE_PATH.match(scope['path']) is not None and
+        b'wait=' in scope.get('query_string', b'')
+    )
+
+
+class LongPoll(object):
+    def __init__(self, scope, receive, send, http_application):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.http_application = http_application
+        self.loop = asyncio.get_event_loop()
+        self.game_changed = asyncio.Event()
+        self.query = parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True)
+
+    async def run(self):
+        params = dict(self.query)
+        try:
+            wait = min(float(params['wait']), settings.LONG_POLL_MAX_WAIT)
+            since_move = int(params['since_move']) if 'since_move' in params else None
+        except (KeyError, ValueError):
+            # The view answers 400
+            return await self.http_application(self.scope, self.receive, self.send)
+        if wait > 0:
+            # Token lookup and game loading may hit the database, keep them off the event loop
+            found = await self.loop.run_in_executor(None, self.find_game, params.get('token'))
+            if found is not None:
+                game, token = found
+                await self.wait(game, token, game.number_of_moves if since_move is None else since_move, wait)
+        scope = dict(self.scope)
+        scope['query_string'] = urlencode([(key, value) for key, value in self.query if key != 'wait']).encode()
+        await self.http_application(scope, self.receive, self.send)
+
+    def find_game(self, token_str: str):
+        """
+        Subscribe to the game the request may wait for, subscribing takes the game lock
+
+        :return: (game, token), None to let the view answer
+        """
+        game_id = UUID(GET_STATE_PATH.match(self.scope['path']).group('game_id'))
+        if token_str is None or not shard_map.is_local(game_id):
+            return None
+        try:
+            token = check_token_exists(token_str)
+            game = game_manager.get_game(game_id)
+        except (Token.DoesNotExist, DoesNotExist):
+            return None
+        if token is None or not check_token_in_game(game, token.token):
+            return None
+        game.subscribe(self.on_game_changed)
+        return game, token.token
+
+    async def wait(self, game: Game, token: UUID, since_move: int, timeout: float):
+        deadline = self.loop.time() + timeout
+        try:
+            while not game.has_news_for(token, since_move):
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(self.game_changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return
+                self.game_changed.clear()
+        finally:
+            await self.loop.run_in_executor(None, game.unsubscribe, self.on_game_changed)
+
+    def on_game_changed(self, game: Game, token, action, card):
+        # Called from whichever thread performed the action
+        self.loop.call_soon_threadsafe(self.game_changed.set)
@@ -0,0 +1,47 @@
+import ujson
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gameapi.benchmarks import BENCHMARKS, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark engine and API hot paths, optionally comparing against a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', metavar='BENCHMARK',
+                            help='Benchmarks to run (default: all of %s)' % ', '.join(BENCHMARKS))
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--compare', metavar='BASELINE', help='JSON results to compare against')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='Allowed relative slowdown of median before reporting regression')
+        parser.add_argument('--min-time', type=float, default=0.2, help='Minimal duration of a round, seconds')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed rounds')
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+        results = run_benchmarks(options['names'], min_time=options['min_time'], repeat=options['repeat'])
+        for name, result in results['benchmarks'].items():
+            self.stdout.write('%-30s median %10.2f us   min %10.2f us' % (
+                name, result['median'] * 1e6, result['min'] * 1e6
+            ))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(ujson.dumps(results, indent=2))
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = ujson.loads(baseline_file.read())
+            regressions = []
+            self.stdout.write('')
+            for name, baseline_median, median, ratio, regressed in compare(results, baseline, options['threshold']):
+                self.stdout.write('%-30s %10.2f us -> %10.2f us  x%.2f%s' % (
+                    name, baseline_median * 1e6, median * 1e6, ratio, '  REGRESSION' if regressed else ''
+                ))
+                if regressed:
+                    regressions.append(name)
+            if regressions:
+                raise CommandError('Performance regressions: %s' % ', '.join(regressions))
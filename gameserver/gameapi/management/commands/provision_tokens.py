@@ -0,0 +1,43 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from gameapi.tokens import provision_players
+
+
+class Command(BaseCommand):
+    help = 'Create tournament players and issue their tokens in one transaction, prints login,password,token CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('logins', nargs='*', help='Player logins')
+        parser.add_argument('--file', help='File with one login per line')
+        parser.add_argument('--count', type=int, default=0, help='Also create COUNT players named PREFIX0001...')
+        parser.add_argument('--prefix', default='player', help='Login prefix for --count')
+        parser.add_argument('--with-passwords', action='store_true',
+                            help='Generate passwords for login/get-token (hashing takes a while for thousands '
+                                 'of players), otherwise players only get tokens')
+
+    def handle(self, *args, **options):
+        logins = list(options['logins'])
+        if options['file']:
+            with open(options['file']) as logins_file:
+                logins.extend(filter(None, (line.strip() for line in logins_file)))
+        width = max(4, len(str(options['count'])))
+        logins.extend('%s%0*d' % (options['prefix'], width, number) for number in range(1, options['count'] + 1))
+        if not logins:
+            raise CommandError('No logins given, pass them as arguments, --file or --count')
+        if len(set(logins)) != len(logins):
+            raise CommandError('Logins are not unique')
+
+        passwords = {
+            login: User.objects.make_random_password() if options['with_passwords'] else None
+            for login in logins
+        }
+        tokens, created = provision_players(passwords)
+        writer = csv.writer(self.stdout, lineterminator='\n')
+        writer.writerow(['login', 'password', 'token'])
+        for login in logins:
+            # Passwords of existing players are not changed
+            password = passwords[login] if login in created else None
+            writer.writerow([login, password or '', tokens[login].token])
@@ -0,0 +1,26 @@
+import ujson
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gameapi.action_log import CorruptedLog, read_log, replay
+
+
+class Command(BaseCommand):
+    help = 'Restore game from its action log and print the game state'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Action log file')
+        parser.add_argument('--move', type=int, default=None, help='Restore state after this number of moves')
+
+    def handle(self, *args, **options):
+        try:
+            seed, players, starting_player, records = read_log(options['path'])
+            game = replay(options['path'], options['move'])
+        except (OSError, CorruptedLog) as error:
+            raise CommandError(error)
+        self.stdout.write('Seed %d, %d moves logged, restored at move %d' % (
+            seed, len(records), game.number_of_moves
+        ))
+        self.stdout.write(str(game.field))
+        for player in players:
+            self.stdout.write('%s: %s' % (player, ujson.dumps(game.get_state(player))))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from gameapi.games_manager import seed_games
+
+
+class Command(BaseCommand):
+    help = 'Start test games between the first two valid tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=3, help='Number of games to start')
+
+    def handle(self, *args, **options):
+        for game_id in seed_games(options['count']):
+            self.stdout.write(str(game_id))
@@ -0,0 +1,41 @@
+import ujson
+
+from django.core.management.base import BaseCommand
+
+from gameapi.simulator import DRAW, POLICIES, UNFINISHED, simulate
+
+
+class Command(BaseCommand):
+    help = 'Play seeded games between bot policies without HTTP and report win rates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('policies', nargs=2, metavar='POLICY',
+                            help='Policy name (%s) or dotted path to a Policy subclass' % ', '.join(POLICIES))
+        parser.add_argument('--games', type=int, default=10000, help='Number of games to play')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the first game')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Worker processes (default: number of CPUs, 1 plays in this process)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Games per worker task')
+        parser.add_argument('--max-moves', type=int, default=1000,
+                            help='Moves after which a game is counted as unfinished')
+        parser.add_argument('--json', action='store_true', help='Print result as JSON')
+
+    def handle(self, *args, **options):
+        result = simulate(
+            options['games'],
+            options['policies'],
+            seed=options['seed'],
+            processes=options['processes'],
+            chunk_size=options['chunk_size'],
+            max_moves=options['max_moves'],
+        )
+        if options['json']:
+            self.stdout.write(ujson.dumps(result.as_dict()))
+            return
+        self.stdout.write('Played %d games in %.2fs (%.0f games/sec)' % (
+            result.number_of_games, result.elapsed, result.games_per_second
+        ))
+        for index, name in enumerate(result.policy_names):
+            self.stdout.write('  %d:%-20s wins %6.2f%%' % (index, name, 100 * result.win_rate(index)))
+        self.stdout.write('  %-22s %6.2f%%' % ('draws', 100 * result.win_rate(DRAW)))
+        self.stdout.write('  %-22s %6.2f%%' % ('unfinished', 100 * result.win_rate(UNFINISHED)))
@@ -0,0 +1,198 @@
+"""
+Matchmaking of waiting players into games
+
+Players are kept in buckets of ``bucket_width`` by their Elo rating, updated
+after every finished matchmaking game. Within a bucket players
+are paired in order of arrival, a player not finding an opponent in own bucket
+is paired with the nearest non-empty bucket up to ``max_bucket_distance`` away.
+Players have to keep pinging ``join`` to stay in the queue, otherwise they are
+dropped after ``timeout`` seconds. Matched players learn their game id from the next
+``join`` within ``timeout`` seconds, later it is only listed in my_games_list. Games of
+matched pairs are started on the shard owning them (see gameapi.placement) outside of
+the queue lock, a pair whose game could not be started goes back to the queue.
+"""
+import bisect
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from django.conf import settings
+
+from gameapi.placement import GamePlacement, PlacementFailed, game_placement
+
+logger = logging.getLogger(__name__)
+
+
+class Matchmaker(object):
+    _instance = None
+
+    INITIAL_RATING = 1500
+    # Largest rating change after one game
+    K_FACTOR = 32
+
+    def __init__(self, placement: GamePlacement, bucket_width: int = 100, max_bucket_distance: int = 1,
+                 timeout: float = 30):
+        self.placement = placement
+        self.bucket_width = bucket_width
+        self.max_bucket_distance = max_bucket_distance
+        self.timeout = timeout
+        self.ratings: Dict[UUID, float] = {}
+        # bucket -> waiting players in order of arrival with their deadlines
+        self.buckets: Dict[int, 'OrderedDict[UUID, float]'] = {}
+        # Sorted keys of non-empty buckets
+        self.bucket_keys: List[int] = []
+        self.waiting: Dict[UUID, int] = {}
+        self.deadlines: List[Tuple[float, UUID]] = []
+        # Games formed for players who have not pinged since with deadlines, game id is None
+        # while the game is being started
+        self.matched: Dict[UUID, Tuple[Optional[UUID], float]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                game_placement,
+                bucket_width=getattr(settings, 'MATCHMAKING_BUCKET_WIDTH', 100),
+                max_bucket_distance=getattr(settings, 'MATCHMAKING_MAX_BUCKET_DISTANCE', 1),
+                timeout=getattr(settings, 'MATCHMAKING_TIMEOUT', 30),
+            )
+        return cls._instance
+
+    def get_rating(self, token: UUID) -> float:
+        return self.ratings.get(token, self.INITIAL_RATING)
+
+    def join(self, token: UUID) -> Optional[UUID]:
+        """
+        Put player in the queue or refresh their place in it
+
+        :return: id of the game player was matched into, None while waiting
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if token in self.matched:
+                game_id = self.matched[token][0]
+                if game_id is not None:
+                    del self.matched[token]
+                return game_id
+            bucket = self.waiting.get(token)
+            if bucket is not None:
+                self._set_deadline(token, bucket, now)
+                return None
+            bucket = int(self.get_rating(token) // self.bucket_width)
+            opponent = self._pop_opponent(bucket)
+            if opponent is None:
+                self._enqueue(token, bucket, now)
+                return None
+            self._set_matched(opponent, None, now)
+            game_id = self.placement.new_game_id()
+        try:
+            self.placement.start_game([opponent, token], on_game_over=self.update_ratings, game_id=game_id)
+        except PlacementFailed:
+            logger.exception('Could not start game for %s and %s, both are back in the queue', opponent, token)
+            self.placement.forget(game_id)
+            now = time.monotonic()
+            with self._lock:
+                if self.matched.pop(opponent, None) is not None:
+                    self._enqueue(opponent, int(self.get_rating(opponent) // self.bucket_width), now)
+                if token not in self.waiting:
+                    self._enqueue(token, bucket, now)
+            return None
+        except Exception:
+            with self._lock:
+                self.matched.pop(opponent, None)
+            raise
+        with self._lock:
+            # Opponent could have left meanwhile
+            if opponent in self.matched:
+                self._set_matched(opponent, game_id, time.monotonic())
+        logger.info('Matched %s and %s into game %s', opponent, token, game_id)
+        return game_id
+
+    def leave(self, token: UUID):
+        with self._lock:
+            self.matched.pop(token, None)
+            bucket = self.waiting.pop(token, None)
+            if bucket is not None:
+                self._remove_from_bucket(token, bucket)
+
+    def update_ratings(self, game_id: UUID, players: List[UUID], winners: Optional[Set[UUID]]):
+        """
+        Elo update after game **`game_id`** between two players is over
+        """
+        first, second = players
+        winners = winners or set()
+        score = 0.5
+        if first in winners and second not in winners:
+            score = 1
+        elif second in winners and first not in winners:
+            score = 0
+        with self._lock:
+            first_rating, second_rating = self.get_rating(first), self.get_rating(second)
+            expected = 1 / (1 + 10 ** ((second_rating - first_rating) / 400))
+            change = self.K_FACTOR * (score - expected)
+            self.ratings[first] = first_rating + change
+            self.ratings[second] = second_rating - change
+        logger.info('Game %s changed ratings of %s and %s by %+.1f', game_id, first, second, change)
+
+    def _set_matched(self, token: UUID, game_id: Optional[UUID], now: float):
+        deadline = now + self.timeout
+        self.matched[token] = (game_id, deadline)
+        heapq.heappush(self.deadlines, (deadline, token))
+
+    def _enqueue(self, token: UUID, bucket: int, now: float):
+        if bucket not in self.buckets:
+            self.buckets[bucket] = OrderedDict()
+            bisect.insort(self.bucket_keys, bucket)
+        self.waiting[token] = bucket
+        self._set_deadline(token, bucket, now)
+
+    def _set_deadline(self, token: UUID, bucket: int, now: float):
+        deadline = now + self.timeout
+        self.buckets[bucket][token] = deadline
+        heapq.heappush(self.deadlines, (deadline, token))
+
+    def _remove_from_bucket(self, token: UUID, bucket: int):
+        queue = self.buckets[bucket]
+        del queue[token]
+        if not queue:
+            del self.buckets[bucket]
+            del self.bucket_keys[bisect.bisect_left(self.bucket_keys, bucket)]
+
+    def _pop_opponent(self, bucket: int) -> Optional[UUID]:
+        position = bisect.bisect_left(self.bucket_keys, bucket)
+        candidates = self.bucket_keys[max(0, position - 1):position + 1]
+        candidates = [key for key in candidates if abs(key - bucket) <= self.max_bucket_distance]
+        if not candidates:
+            return None
+        nearest = min(candidates, key=lambda key: abs(key - bucket))
+        opponent = next(iter(self.buckets[nearest]))
+        del self.waiting[opponent]
+        self._remove_from_bucket(opponent, nearest)
+        return opponent
+
+    def _expire(self, now: float):
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, token = heapq.heappop(self.deadlines)
+            matched = self.matched.get(token)
+            if matched is not None:
+                # Game being started is kept until it is known
+                if matched[0] is not None and matched[1] == deadline:
+                    logger.info('Player %s did not pick up game %s', token, matched[0])
+                    del self.matched[token]
+                continue
+            bucket = self.waiting.get(token)
+            # Heap keeps outdated deadlines of players who pinged again
+            if bucket is None or self.buckets[bucket][token] != deadline:
+                continue
+            logger.info('Player %s left matchmaking queue by timeout', token)
+            del self.waiting[token]
+            self._remove_from_bucket(token, bucket)
+
+
+matchmaker = Matchmaker.get_instance()
@@ -0,0 +1,244 @@
+"""
+Process metrics in Prometheus text exposition format
+
+Counters and histograms are sharded per thread: every thread increments its own
+cells without locking and a scrape sums the shards up. Gauges are read from
+callbacks at scrape time, so the hot path does not pay for them at all.
+"""
+import bisect
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Seconds, tuned for in-memory game requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+             for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.type)]
+        lines.extend(self.collect())
+        return '\n'.join(lines)
+
+
+class ThreadShardedMetric(Metric):
+    """
+    Keeps ``labels -> cells`` dict per thread, cells are created by ``new_cells``.
+    Shards of finished threads are folded into ``_retired`` when a new thread shows up.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Dict[tuple, list]]] = []
+        self._retired: Dict[tuple, list] = {}
+        # Taken once per thread and on scrape, never on increments
+        self._lock = threading.Lock()
+
+    def new_cells(self) -> list:
+        raise NotImplementedError
+
+    def _cells(self, label_values: tuple) -> list:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self._add_shard()
+        cells = shard.get(label_values)
+        if cells is None:
+            cells = shard[label_values] = self.new_cells()
+        return cells
+
+    def _add_shard(self) -> Dict[tuple, list]:
+        shard: Dict[tuple, list] = {}
+        with self._lock:
+            alive = []
+            for thread, old_shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, old_shard))
+                else:
+                    self._merge_into(self._retired, old_shard)
+            alive.append((threading.current_thread(), shard))
+            self._shards = alive
+        return shard
+
+    @staticmethod
+    def _merge_into(total: Dict[tuple, list], shard: Dict[tuple, list]):
+        for label_values, cells in list(shard.items()):
+            merged_cells = total.setdefault(label_values, [0] * len(cells))
+            for index, value in enumerate(cells):
+                merged_cells[index] += value
+
+    def merged(self) -> Dict[tuple, list]:
+        merged: Dict[tuple, list] = {}
+        with self._lock:
+            self._merge_into(merged, self._retired)
+            for _, shard in self._shards:
+                self._merge_into(merged, shard)
+        return merged
+
+
+class Counter(ThreadShardedMetric):
+    type = 'counter'
+
+    def new_cells(self):
+        return [0]
+
+    def inc(self, *label_values, amount: float = 1):
+        self._cells(label_values)[0] += amount
+
+    def value(self, *label_values) -> float:
+        return self.merged().get(label_values, [0])[0]
+
+    def collect(self):
+        return ['%s%s %s' % (self.name, format_labels(self.label_names, label_values), cells[0])
+                for label_values, cells in sorted(self.merged().items())]
+
+
+class Histogram(ThreadShardedMetric):
+    """
+    Cells are bucket counts (the last one is +Inf), sum and count of observations
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_cells(self):
+        return [0] * (len(self.buckets) + 3)
+
+    def observe(self, value: float, *label_values):
+        cells = self._cells(label_values)
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+
+    def time(self, *label_values):
+        return Timer(self, label_values)
+
+    def collect(self):
+        lines = []
+        for label_values, cells in sorted(self.merged().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), cells):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket%s %d' % (
+                    self.name, format_labels(self.label_names, label_values, 'le="%s"' % le), cumulative))
+            labels = format_labels(self.label_names, label_values)
+            lines.append('%s_sum%s %r' % (self.name, labels, cells[-2]))
+            lines.append('%s_count%s %d' % (self.name, labels, cells[-1]))
+        return lines
+
+
+class Timer(object):
+    __slots__ = ('histogram', 'label_values', 'started_at')
+
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started_at, *self.label_values)
+
+
+class Gauge(Metric):
+    """
+    Value read from **`callback`** at scrape time. Callback returns a number, or
+    a dict of label values tuple -> number for labelled gauges.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Callable, label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self.callback = callback
+
+    def collect(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return ['%s%s %s' % (self.name, format_labels(self.label_names, label_values), value)
+                for label_values, value in sorted(values.items())]
+
+
+class CallbackCounter(Gauge):
+    """
+    Counter kept elsewhere (e.g. cache hit counts) and read at scrape time
+    """
+    type = 'counter'
+
+
+class Registry(object):
+    _instance = None
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Register **`metric`**, metric registered with the same name is replaced
+        """
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+registry = Registry.get_instance()
+
+view_latency = registry.register(Histogram(
+    'durak_view_latency_seconds', 'Latency of API views', ['view'],
+))
+take_action_latency = registry.register(Histogram(
+    'durak_take_action_seconds', 'Time spent applying accepted moves in Game.take_action_by_index', ['action'],
+))
+actions_rejected = registry.register(Counter(
+    'durak_actions_rejected_total', 'Actions rejected by the game', ['action', 'reason'],
+))
+
+
+def timed_view(name: str):
+    """
+    Observe latency of decorated view in ``view_latency`` as **`name`**
+    """
+
+    def decorator(fn):
+        @wraps(fn)
+        def timed_view_wrapper(request, *args, **kwargs):
+            with view_latency.time(name):
+                return fn(request, *args, **kwargs)
+
+        return timed_view_wrapper
+
+    return decorator
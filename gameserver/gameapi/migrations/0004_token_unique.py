@@ -0,0 +1,19 @@
+# Generated by Django 2.2.18 on 2026-10-18 13:03
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameapi', '0003_archivedgame'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='token',
+            name='token',
+            field=models.UUIDField(default=uuid.uuid4, unique=True),
+        ),
+    ]
@@ -2,18 +2,24 @@
 import datetime
 import logging
 import random
+import threading
+import time
 import uuid
+from collections import deque
 from enum import Enum
-from typing import Dict, List, Set
+from typing import Callable, Dict, List, Set, Tuple
 
 from django.contrib.auth.models import User
 from django.db import models
 
+from gameapi import events, metrics
+from gameapi.player_stats import player_stats
+
 logger = logging.getLogger(__name__)
 
 
 class Token(models.Model):
-    token = models.UUIDField(default=uuid.uuid4)
+    token = models.UUIDField(default=uuid.uuid4, unique=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     issued_at = models.DateTimeField(auto_now_add=True)
     valid = models.BooleanField(default=True)
@@ -32,6 +38,19 @@ class TokenAccessLog(models.Model):
     access_time = models.DateTimeField()
 
 
+class ArchivedGame(models.Model):
+    """
+    Finished game evicted from ``GameManager`` memory, ``data`` is ``Game.to_dict`` as JSON
+    """
+    game_id = models.UUIDField(unique=True)
+    data = models.TextField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.game_id)
+
+
 class Card(object):
     class Suit(Enum):
         SPADES = 'S'
@@ -55,9 +74,20 @@ class Card(object):
         card_suit_str = card_str[-1]
         return cls(int(card_value_str), Card.Suit(card_suit_str))
 
+    @classmethod
+    def from_index(cls, index: int):
+        suit_index, rank = divmod(index, CARDS_PER_SUIT)
+        return cls(rank + MIN_CARD_VALUE, SUITS[suit_index])
+
     def to_card_string(self):
         return str(self.value) + str(self.suit.value)
 
+    def to_index(self) -> int:
+        """
+        Compact engine representation of the card: 0..35
+        """
+        return SUIT_INDEX[self.suit] * CARDS_PER_SUIT + self.value - MIN_CARD_VALUE
+
     def card_value_str(self):
         human_names = {
             11: 'Jack',
@@ -92,18 +122,73 @@ class Card(object):
         return hash((self.value, self.suit))
 
 
+# Engine representation of cards.
+# Card is a small int ``suit_index * 9 + (value - 6)``, sets of cards (hands, table, leftover)
+# are int bitmasks with bit ``1 << index`` set for every card in the set.
+
+MIN_CARD_VALUE = 6
+CARDS_PER_SUIT = 9
+SUITS: List[Card.Suit] = list(Card.Suit)
+SUIT_INDEX: Dict[Card.Suit, int] = {suit: index for index, suit in enumerate(SUITS)}
+NUMBER_OF_CARDS = CARDS_PER_SUIT * len(SUITS)
+HAND_SIZE = 6
+# Ordered deck every game is shuffled from
+DECK_TEMPLATE: Tuple[int, ...] = tuple(range(NUMBER_OF_CARDS))
+
+RANK_MASK = (1 << CARDS_PER_SUIT) - 1
+SUIT_MASKS: List[int] = [RANK_MASK << (suit_index * CARDS_PER_SUIT) for suit_index in range(len(SUITS))]
+# Multiplying a mask of ranks by it gives the mask of all cards of these ranks
+RANKS_TO_CARDS = sum(1 << (suit_index * CARDS_PER_SUIT) for suit_index in range(len(SUITS)))
+CARD_STRINGS: List[str] = [Card.from_index(index).to_card_string() for index in range(NUMBER_OF_CARDS)]
+CARD_SHORT_NAMES: List[str] = [str(Card.from_index(index)) for index in range(NUMBER_OF_CARDS)]
+
+
+def card_suit(index: int) -> int:
+    return index // CARDS_PER_SUIT
+
+
+def card_rank(index: int) -> int:
+    """
+    Card value relative to the lowest card: 0 for 6, 8 for Ace
+    """
+    return index % CARDS_PER_SUIT
+
+
+def iter_cards(mask: int):
+    """
+    Yield card indices set in **`mask`** in ascending order
+    """
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+def count_cards(mask: int) -> int:
+    return bin(mask).count('1')
+
+
+def card_strings(mask: int) -> List[str]:
+    return [CARD_STRINGS[index] for index in iter_cards(mask)]
+
+
 class GameField(object):
     def __init__(self):
-        self.player_cards: Dict[uuid.UUID, Set[Card]] = {}
-        self.deck: List[Card] = []
-        self.trump: Card = None
-        self.table: List[List[Card]] = []
-        self.leftover: Set[Card] = []
+        self.player_cards: Dict[uuid.UUID, int] = {}
+        self.deck: List[int] = []
+        self.trump: int = None
+        self.table: List[List[int]] = []
+        # Cards and card ranks currently on the table, kept in sync with self.table
+        self.table_mask: int = 0
+        self.table_ranks: int = 0
+        self.leftover: int = 0
         self.seed = None
 
-    def randomize_game(self, players: Set[uuid.UUID], seed=None):
+    def randomize_game(self, players: Set[uuid.UUID], seed=None, rng: random.Random = None):
         """
         Game initializer
+
+        :param rng: generator to shuffle with, new one seeded with **`seed`** if None
         """
         if not len(players) == 2:
             raise ValueError(
@@ -115,58 +200,99 @@ class GameField(object):
         if seed is None:
             seed = random.getrandbits(128)
         self.seed = seed
-        logger.debug('Seeding game field with %d', seed)
-        random.seed(seed)
-
-        all_cards: List[Card] = [Card(value, suit) for value in range(6, 15, 1) for suit in Card.Suit]
-        while all_cards:
-            card = random.choice(all_cards)
-            all_cards.remove(card)
-            self.deck.append(card)
+        if rng is None:
+            rng = random.Random(seed)
+
+        self.deck = list(DECK_TEMPLATE)
+        rng.shuffle(self.deck)
         for player in players:
-            player_cards: Set[Card] = set()
-            while len(player_cards) < 6:
-                player_cards.add(self.deck.pop())
+            player_cards = 0
+            for _ in range(HAND_SIZE):
+                player_cards |= 1 << self.deck.pop()
             self.player_cards[player] = player_cards
         # TODO: modify for 3+ users game
         self.trump = self.deck[0]
         return self
 
+    @property
+    def trump_suit(self) -> int:
+        return card_suit(self.trump)
+
     def flat_table(self):
         for pair in self.table:
             for card in pair:
                 yield card
 
+    def add_to_table(self, card: int):
+        self.table_mask |= 1 << card
+        self.table_ranks |= 1 << card_rank(card)
+
+    def clear_table(self) -> int:
+        """
+        Remove all cards from the table
+
+        :return: mask of removed cards
+        """
+        cards = self.table_mask
+        self.table.clear()
+        self.table_mask = 0
+        self.table_ranks = 0
+        return cards
+
     def get_state(self, token):
         return {
-            'cards': list(map(Card.to_card_string, self.player_cards[token])),
-            'field_cards': map(Card.to_card_string, self.flat_table()),
+            'cards': card_strings(self.player_cards[token]),
+            'field_cards': [CARD_STRINGS[card] for card in self.flat_table()],
             'deck_counter': len(self.deck),
-            'trump': self.trump.to_card_string(),
+            'trump': CARD_STRINGS[self.trump],
             'enemy_cards_counter': sum(
-                map(
-                    len,
-                    map(
-                        lambda k: self.player_cards[k],
-                        filter(
-                            lambda k: not k == token, self.player_cards.keys()
-                        )
-                    )
-                )
+                count_cards(cards) for player, cards in self.player_cards.items() if not player == token
             )
         }
 
+    def snapshot(self):
+        """
+        Cheap copy of what players see: hands, cards on the table and deck size
+        """
+        return dict(self.player_cards), tuple(self.flat_table()), len(self.deck)
+
+    def get_state_delta(self, token, snapshot):
+        """
+        Changes of ``get_state`` of **`token`** since **`snapshot`**
+        """
+        old_cards, old_table, _ = snapshot
+        cards = self.player_cards[token]
+        table = list(self.flat_table())
+        delta = {
+            'cards_added': card_strings(cards & ~old_cards[token]),
+            'cards_removed': card_strings(old_cards[token] & ~cards),
+            'deck_counter': len(self.deck),
+            'enemy_cards_counter': sum(
+                count_cards(cards) for player, cards in self.player_cards.items() if not player == token
+            ),
+        }
+        # Table only grows during a turn and is cleared at its end
+        if tuple(table[:len(old_table)]) == old_table:
+            delta['field_cards_added'] = [CARD_STRINGS[card] for card in table[len(old_table):]]
+        else:
+            delta['field_cleared'] = True
+            delta['field_cards_added'] = [CARD_STRINGS[card] for card in table]
+        return delta
+
     def __str__(self):
         return (
             self.__class__.__qualname__ + '[\n' +
             ',\n'.join(map(lambda s: '    ' + s, [
-                'deck: [' + ','.join(map(str, self.deck)) + ']',
-                'trump: ' + str(self.trump),
+                'deck: [' + ','.join(CARD_SHORT_NAMES[card] for card in self.deck) + ']',
+                'trump: ' + CARD_SHORT_NAMES[self.trump],
                 'player_cards: {' + '; '.join(
-                    [str(token) + ':' + ','.join(map(str, cards)) for token, cards in self.player_cards.items()]
+                    [
+                        str(token) + ':' + ','.join(CARD_SHORT_NAMES[card] for card in iter_cards(cards))
+                        for token, cards in self.player_cards.items()
+                    ]
                 ) + '}',
                 'table: [' + ', '.join(
-                    ['(' + ','.join(map(str, cards)) + ')' for cards in self.table]
+                    ['(' + ','.join(CARD_SHORT_NAMES[card] for card in cards) + ')' for cards in self.table]
                 ) + ']',
             ])) +
             '\n]'
@@ -179,27 +305,41 @@ class GameField(object):
             ']'
         )
 
-    def get_player_with_least_trump_suit(self):
-        trump = self.trump
-        trump_suit = trump.suit
-        players_trumps = {
-            player:
-                list(map(lambda card: card.value,
-                         filter(lambda card: card.suit == trump_suit, cards)
-                         )
-                     )
-            for player, cards in self.player_cards.items()
+    def to_dict(self):
+        return {
+            'player_cards': {str(player): cards for player, cards in self.player_cards.items()},
+            'deck': list(self.deck),
+            'trump': self.trump,
+            'table': [list(pair) for pair in self.table],
+            'leftover': self.leftover,
         }
+
+    @classmethod
+    def from_dict(cls, data):
+        field = cls()
+        field.player_cards = {uuid.UUID(player): cards for player, cards in data['player_cards'].items()}
+        field.deck = list(data['deck'])
+        field.trump = data['trump']
+        for pair in data['table']:
+            field.table.append(list(pair))
+            for card in pair:
+                field.add_to_table(card)
+        field.leftover = data['leftover']
+        return field
+
+    def get_player_with_least_trump_suit(self):
+        trump_suit_mask = SUIT_MASKS[self.trump_suit]
         global_minima = None
         minimal_trump_player = None
-        for player in players_trumps:
-            try:
-                min_ = min(players_trumps[player])
-                if global_minima is None or min_ < global_minima:
-                    global_minima = min_
-                    minimal_trump_player = player
-            except ValueError:
-                pass
+        for player, cards in self.player_cards.items():
+            trumps = cards & trump_suit_mask
+            if not trumps:
+                continue
+            # Lowest set bit is the lowest trump
+            min_ = (trumps & -trumps).bit_length()
+            if global_minima is None or min_ < global_minima:
+                global_minima = min_
+                minimal_trump_player = player
         return minimal_trump_player
 
 
@@ -218,6 +358,8 @@ class Game(object):
         TAKE = 'take'
         ENDTURN = 'endturn'
 
+    HISTORY_LENGTH = 32
+
     def __init__(self):
         self.number_of_moves: int = 0
         self.number_of_turns: int = 0
@@ -228,6 +370,19 @@ class Game(object):
         self.winners: Set[uuid.UUID] = None
         self.seed: int = None
         self.started_at = None
+        self.finished_at = None
+        # Serializes moves and reads of the game, reentrant so listeners may read the game
+        self.lock = threading.RLock()
+        self.state_changed = threading.Condition(self.lock)
+        self.listeners: List[Callable] = []
+        # (number_of_moves, field snapshot) of the latest moves, base for state deltas
+        self.history: deque = deque(maxlen=Game.HISTORY_LENGTH)
+        # (token, with legal cards) -> (number_of_moves, serialized get_state), see gameapi.state_cache
+        self.serialized_states: Dict[Tuple[uuid.UUID, bool], Tuple[int, bytes]] = {}
+        # token -> mask of cards the player may put, cleared on every move
+        self.legal_cards_cache: Dict[uuid.UUID, int] = {}
+        # token -> (action, card index) taken automatically when the player gets the turn, see take_actions
+        self.queued_actions: Dict[uuid.UUID, deque] = {}
 
     def __repr__(self):
         return self.__class__.__qualname__ + '[' + ', '.join(
@@ -238,68 +393,59 @@ class Game(object):
         attacking_actions = [Game.Action.PUT, Game.Action.ENDTURN]
         defending_actions = [Game.Action.PUT, Game.Action.TAKE]
         if not token == self.active_player:
-            logging.warning('Token %s is not active player (%s)', token, self.active_player)
             return False
         if self.is_attacking(token):
-            logging.info('Player is attacking')
             return action in attacking_actions
-        logging.info('Player is defending')
         return action in defending_actions
 
-    def is_action_valid(self, token: uuid.UUID, action: Action, card: Card):
+    def is_action_valid(self, token: uuid.UUID, action: Action, card: int):
         """
         Assumes that **`action`** is allowed
+
+        :param card: card index (see ``Card.to_index``) or None
         """
         if action == Game.Action.PUT:
             if card is None:
-                logger.warning('No card to put')
                 return False
-            if card not in self.field.player_cards[token]:
-                logger.warning('Card %s not in player\'s hands', card, )
-                return False
-            return self.can_put_card(token, card)
+            return bool(self.legal_cards(token) >> card & 1)
         elif action == Game.Action.ENDTURN:
             return self.can_end_turn(token)
         elif action == Game.Action.TAKE:
             return self.can_take(token)
         return False
 
-    def can_put_card(self, token: uuid.UUID, card: Card):
-        if self.is_attacking(token):
-            can_attack = self.can_attack_with(card)
-            logger.info('Can attack with %s %s', card, can_attack)
-            return can_attack
-        else:
-            can_defend = self.can_attack_with(card)
-            logger.info('Can attack with %s %s', card, can_defend)
-            return self.can_defend_with(card)
-
     def is_defending(self, token: uuid.UUID):
         return self.defending_player == token
 
     def is_attacking(self, token: uuid.UUID):
         return not self.is_defending(token)
 
-    def can_attack_with(self, card: Card):
-        cards_on_table = {card for pair in self.field.table for card in pair}
-
-        if not cards_on_table:
-            return True
-
-        set_of_card_values_on_table = {card.value for card in cards_on_table}
-        if card.value in set_of_card_values_on_table:
-            return True
-        return False
-
-    def can_defend_with(self, card: Card):
-        attacking_pair: List[Card] = next(filter(lambda pair: len(pair) == 1, self.field.table), None)
-        if attacking_pair is None:
-            raise Exception('Could not find attacking pair card: %s, game: %s' % (card, self))
-        attacking_card: Card = attacking_pair[0]
-
-        if attacking_card.suit == card.suit:
-            return attacking_card.value < card.value
-        return card.suit == self.field.trump.suit
+    def legal_cards(self, token: uuid.UUID) -> int:
+        """
+        Mask of cards **`token`** may put now, computed once per move
+        """
+        cards = self.legal_cards_cache.get(token)
+        if cards is None:
+            cards = self.legal_cards_cache[token] = self._find_legal_cards(token)
+        return cards
+
+    def _find_legal_cards(self, token: uuid.UUID) -> int:
+        if token != self.active_player:
+            return 0
+        hand = self.field.player_cards[token]
+        if self.is_attacking(token):
+            table_ranks = self.field.table_ranks
+            return hand & table_ranks * RANKS_TO_CARDS if table_ranks else hand
+        table = self.field.table
+        if not table or len(table[-1]) != 1:
+            return 0
+        attacking_card = table[-1][0]
+        suit = card_suit(attacking_card)
+        # Higher cards of the same suit, any trump beats a non-trump
+        beating = SUIT_MASKS[suit] & ~((2 << attacking_card) - 1)
+        if suit != self.field.trump_suit:
+            beating |= SUIT_MASKS[self.field.trump_suit]
+        return hand & beating
 
     def can_end_turn(self, token: uuid.UUID):
         return self.is_attacking(token)
@@ -308,74 +454,184 @@ class Game(object):
         return self.is_defending(token)
 
     def take_action(self, token: uuid.UUID, action: Action, card: Card):
-        logger.debug('Game.take_action')
-        if not self.is_action_allowed(token, action):
-            logger.info('Action is not allowed')
-            raise Game.ActionNotAllowed('Action not allowed %s %s' % (token, action))
-        if not self.is_action_valid(token, action, card):
-            logger.info('Action is not valid')
-            raise Game.ActionInvalid('Action invalid %s %s %s' % (token, action, card))
-        if action == Game.Action.PUT:
-            logger.debug('Performing PUT action')
-            self.put_card_on_table(token, card)
-            self.switch_actor()
-        elif action == Game.Action.TAKE:
-            logger.debug('Performing TAKE action')
-            self.take_table_cards(token)
-            self.equalize_players_cards()
-            self.switch_actor()
-            # TODO: modify switch_turns for 3+ users game
-        elif action == Game.Action.ENDTURN:
-            logger.debug('Performing ENDTURN action')
-            self.throw_cards()
-            self.equalize_players_cards()
-            self.switch_turns()
-        self.detect_gameover()
-        self.number_of_moves += 1
-
-    def put_card_on_table(self, token: uuid.UUID, card: Card):
-        active_card_pair = next(filter(lambda pair: len(pair) == 1, self.field.table), None)
-        if active_card_pair is None:
-            active_card_pair = []
-            self.field.table.append(active_card_pair)
-        self.field.player_cards[token].remove(card)
-        active_card_pair.append(card)
+        """
+        Player's own action, drops actions the player queued with ``take_actions``
+        """
+        self.take_actions(token, [(action, None if card is None else card.to_index())])
+
+    def take_actions(self, token: uuid.UUID, actions: List[Tuple[Action, int]]):
+        """
+        Take the first of ``(action, card_index)`` **`actions`** now and queue the rest: every
+        queued action is taken automatically when the player gets the turn again. Any move
+        passes the turn, so e.g. attacker's throw-in can only follow defender's answer.
+        The queue is dropped at the first queued action the game does not accept at its
+        turn and by the next ``take_action`` or ``take_actions`` of the player.
+
+        :raises ActionNotAllowed, ActionInvalid: if the first action is not accepted, nothing is queued then
+        """
+        action, card = actions[0]
+        with self.lock:
+            self.queued_actions.pop(token, None)
+            if len(actions) > 1:
+                # Queued before the move, opponent's queued answer may give the turn back at once
+                self.queued_actions[token] = deque(actions[1:])
+            try:
+                self.take_action_by_index(token, action, card)
+            except (Game.ActionNotAllowed, Game.ActionInvalid) as error:
+                self.queued_actions.pop(token, None)
+                metrics.actions_rejected.inc(action.value, error.__class__.__name__)
+                player_stats.record_rejected(token)
+                if events.enabled(events.ACTION_REJECTED, logging.WARNING):
+                    events.emit(events.ACTION_REJECTED, logging.WARNING, error.__class__.__name__,
+                                player=token, action=action.value,
+                                card=None if card is None else CARD_STRINGS[card], move=self.number_of_moves)
+                raise
+
+    def _take_queued_action(self):
+        """
+        Take the next action queued by the player whose turn it is now
+        """
+        token = self.active_player
+        queue = self.queued_actions.get(token)
+        if not queue:
+            return
+        action, card = queue.popleft()
+        if not queue:
+            del self.queued_actions[token]
+        try:
+            self.take_action_by_index(token, action, card)
+        except (Game.ActionNotAllowed, Game.ActionInvalid):
+            # The game went differently than the player planned, the player moves by hand from here
+            self.queued_actions.pop(token, None)
+
+    def take_action_by_index(self, token: uuid.UUID, action: Action, card: int):
+        """
+        Engine entry point, same as ``take_action`` with card given as index
+        """
+        with self.lock:
+            # Only the move itself: neither waiting for the lock nor listeners and queued moves
+            started_at = time.perf_counter()
+            if not self.is_action_allowed(token, action):
+                raise Game.ActionNotAllowed('Action not allowed %s %s' % (token, action))
+            if not self.is_action_valid(token, action, card):
+                raise Game.ActionInvalid('Action invalid %s %s %s' % (
+                    token, action, None if card is None else CARD_STRINGS[card]
+                ))
+            if action == Game.Action.PUT:
+                self.put_card_on_table(token, card)
+                self.switch_actor()
+            elif action == Game.Action.TAKE:
+                self.take_table_cards(token)
+                self.equalize_players_cards()
+                self.switch_actor()
+                # TODO: modify switch_turns for 3+ users game
+            elif action == Game.Action.ENDTURN:
+                self.throw_cards()
+                self.equalize_players_cards()
+                self.switch_turns()
+            self.detect_gameover()
+            self.number_of_moves += 1
+            self.serialized_states.clear()
+            self.legal_cards_cache.clear()
+            self.remember_state()
+            metrics.take_action_latency.observe(time.perf_counter() - started_at, action.value)
+            if events.enabled(events.MOVE, logging.DEBUG):
+                events.emit(events.MOVE, logging.DEBUG, 'move', player=token, action=action.value,
+                            card=None if card is None else CARD_STRINGS[card], move=self.number_of_moves)
+            if self.finished_at is not None and events.enabled(events.GAME, logging.INFO):
+                events.emit(events.GAME, logging.INFO, 'game_over', players=','.join(map(str, self.players)),
+                            winners=','.join(map(str, self.winners or ())), moves=self.number_of_moves)
+            try:
+                for listener in list(self.listeners):
+                    # The move is made already, a failing listener must not hide it from the others
+                    try:
+                        listener(self, token, action, card)
+                    except Exception:
+                        logger.exception('Listener %r failed on move %d', listener, self.number_of_moves)
+            finally:
+                self.state_changed.notify_all()
+            self._take_queued_action()
+
+    def clone(self):
+        """
+        Copy of the game state without listeners and queued actions
+        """
+        with self.lock:
+            return Game.from_dict(self.to_dict())
+
+    def subscribe(self, listener: Callable):
+        """
+        Register **`listener`** to be called as ``listener(game, token, action, card)``
+        after every accepted action, card is given as index or None. Listeners are
+        called synchronously from ``take_action`` with the game lock held, so they
+        should return quickly.
+        """
+        with self.lock:
+            self.listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable):
+        with self.lock:
+            try:
+                self.listeners.remove(listener)
+            except ValueError:
+                pass
+
+    def has_news_for(self, token: uuid.UUID, since_move: int):
+        return (
+            self.number_of_moves > since_move or
+            self.active_player == token or
+            self.is_over()
+        )
+
+    def wait_for_change(self, token: uuid.UUID, since_move: int, timeout: float):
+        """
+        Block until a move newer than **`since_move`** is made, **`token`** becomes
+        the active player or the game is over.
+
+        :return: False if **`timeout`** expired with nothing to report
+        """
+        with self.state_changed:
+            return self.state_changed.wait_for(
+                lambda: self.has_news_for(token, since_move),
+                timeout=timeout,
+            )
+
+    def put_card_on_table(self, token: uuid.UUID, card: int):
+        # Only the last pair on the table may be waiting for a defending card
+        table = self.field.table
+        if table and len(table[-1]) == 1:
+            table[-1].append(card)
+        else:
+            table.append([card])
+        self.field.player_cards[token] &= ~(1 << card)
+        self.field.add_to_table(card)
 
     def take_table_cards(self, token: uuid.UUID):
-        for pair in self.field.table:
-            for card in pair:
-                self.field.player_cards[token].add(card)
-        self.field.table.clear()
+        self.field.player_cards[token] |= self.field.clear_table()
 
     def throw_cards(self):
-        for pair in self.field.table:
-            for card in pair:
-                self.field.leftover.add(card)
-        self.field.table.clear()
+        self.field.leftover |= self.field.clear_table()
 
     def equalize_players_cards(self):
         # TODO: modify for 3+ users game
-        attacking_players = set(self.players) - {self.defending_player}
-        for token in attacking_players:
-            player = self.field.player_cards[token]
-            while len(player) < 6:
-                if len(self.field.deck) == 0:
-                    break
-                # TODO: take cards in coorect order (trump should be last)
-                player.add(self.field.deck.pop())
-        defending_player = self.field.player_cards[self.defending_player]
-        while len(defending_player) < 6:
-            if len(self.field.deck) == 0:
-                break
-            defending_player.add(self.field.deck.pop())
+        attacking_players = [player for player in self.players if not player == self.defending_player]
+        for token in attacking_players + [self.defending_player]:
+            self.fill_up_hand(token)
+
+    def fill_up_hand(self, token: uuid.UUID):
+        deck = self.field.deck
+        cards = self.field.player_cards[token]
+        missing = HAND_SIZE - count_cards(cards)
+        # TODO: take cards in coorect order (trump should be last)
+        while missing > 0 and deck:
+            cards |= 1 << deck.pop()
+            missing -= 1
+        self.field.player_cards[token] = cards
 
     def switch_actor(self):
-        logger.debug('switch_actor')
-        logger.info('Currently active player: %s', self.active_player)
         index = self.players.index(self.active_player)
         new_index = (index + 1) % len(self.players)
         self.active_player = self.players[new_index]
-        logger.info('Newly active player: %s', self.active_player)
 
     def switch_turns(self):
         index = self.players.index(self.defending_player)
@@ -386,22 +642,18 @@ class Game(object):
         self.number_of_turns += 1
 
     def detect_gameover(self):
-        if len(self.field.deck) == 0 and (
+        player_cards = self.field.player_cards
+        if not self.field.deck and (
             # TODO: modify for 3+ user games
             any(
-                map(
-                    lambda player, cards: len(cards) == 0,
-                    filter(
-                        lambda player, cards: not player == self.defending_player,
-                        self.field.player_cards.items()
-                    )
-                )
+                not cards for player, cards in player_cards.items() if not player == self.defending_player
             )
         ):
-            if len(self.field.player_cards[self.defending_player]) != 0:
-                self.winners = {player for player in self.players}
+            if player_cards[self.defending_player]:
+                self.winners = {player for player, cards in player_cards.items() if not cards}
             self.active_player = None
             self.defending_player = None
+            self.finished_at = datetime.datetime.utcnow()
             return True
         return False
 
@@ -422,48 +674,126 @@ class Game(object):
             return 'draw'
         return 'winner' if token in self.winners else 'looser'
 
-    def get_state(self, token: uuid.UUID):
-        return {
-            'game_field': self.field.get_state(token),
-            'actions_available': list(map(
-                lambda action: action.value,
-                filter(
-                    lambda action: self.is_action_allowed(token, action),
-                    (action for action in Game.Action)
-                )
-            )
-            ),
-            # ['put', 'endturn', 'take'],
-            'game_state': {
-                'status': 'gameover' if self.is_over() else 'play',
-                'number_of_turns': self.number_of_turns,
-                'number_of_moves': self.number_of_moves,
-                'result': self.get_result(token)
+    def remember_state(self):
+        self.history.append((self.number_of_moves, self.field.snapshot()))
+
+    def get_state_delta(self, token: uuid.UUID, since_move: int, with_legal_cards=False):
+        """
+        State of the game for **`token`** as changes since move **`since_move`**.
+        Falls back to full ``get_state`` (with ``delta: false``) if that move is too old.
+        """
+        with self.lock:
+            snapshot = next((snapshot for move, snapshot in self.history if move == since_move), None)
+            if snapshot is None:
+                state = self.get_state(token, with_legal_cards=with_legal_cards)
+                state['delta'] = False
+                return state
+            state = self.get_state(token, with_field=False, with_legal_cards=with_legal_cards)
+            state.update({
+                'delta': True,
+                'since_move': since_move,
+                'game_field_delta': self.field.get_state_delta(token, snapshot),
+            })
+            return state
+
+    def get_state(self, token: uuid.UUID, with_field=True, with_legal_cards=False):
+        """
+        :param with_legal_cards: add ``legal_cards``, cards the player may put now
+        """
+        with self.lock:
+            state = {
+                'actions_available': self.get_actions_available(token),
+                # ['put', 'endturn', 'take'],
+                'game_state': self.get_game_state(token),
             }
+            if with_field:
+                state['game_field'] = self.field.get_state(token)
+            if with_legal_cards:
+                state['legal_cards'] = card_strings(self.legal_cards(token))
+            return state
+
+    def get_actions_available(self, token: uuid.UUID):
+        return list(map(
+            lambda action: action.value,
+            filter(
+                lambda action: self.is_action_allowed(token, action),
+                (action for action in Game.Action)
+            )
+        ))
+
+    def get_game_state(self, token: uuid.UUID):
+        return {
+            'status': 'gameover' if self.is_over() else 'play',
+            'number_of_turns': self.number_of_turns,
+            'number_of_moves': self.number_of_moves,
+            'result': self.get_result(token)
         }
 
+    def to_dict(self):
+        """
+        Compact JSON-friendly representation of the game, cards are kept as indices and masks.
+        Hold ``lock`` while calling it for a game that is still played.
+        """
+        return {
+            'players': [str(player) for player in self.players],
+            'active_player': None if self.active_player is None else str(self.active_player),
+            'defending_player': None if self.defending_player is None else str(self.defending_player),
+            'winners': None if self.winners is None else [str(player) for player in self.winners],
+            'number_of_moves': self.number_of_moves,
+            'number_of_turns': self.number_of_turns,
+            # 128 bit seeds do not fit JSON integers of most parsers
+            'seed': None if self.seed is None else str(self.seed),
+            'started_at': None if self.started_at is None else self.started_at.isoformat(),
+            'finished_at': None if self.finished_at is None else self.finished_at.isoformat(),
+            'field': self.field.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        def parse_uuid(value):
+            return None if value is None else uuid.UUID(value)
+
+        def parse_datetime(value):
+            return None if value is None else datetime.datetime.fromisoformat(value)
+
+        game = cls()
+        game.players = [uuid.UUID(player) for player in data['players']]
+        game.active_player = parse_uuid(data['active_player'])
+        game.defending_player = parse_uuid(data['defending_player'])
+        game.winners = None if data['winners'] is None else {uuid.UUID(player) for player in data['winners']}
+        game.number_of_moves = data['number_of_moves']
+        game.number_of_turns = data['number_of_turns']
+        game.seed = None if data['seed'] is None else int(data['seed'])
+        game.started_at = parse_datetime(data['started_at'])
+        game.finished_at = parse_datetime(data['finished_at'])
+        game.field = GameField.from_dict(data['field'])
+        game.field.seed = game.seed
+        game.remember_state()
+        return game
+
     def start(self, players: Set[uuid.UUID], last_winners: Set[uuid.UUID] = None, seed=None):
         if seed is None:
             seed = random.getrandbits(128)
-        random.seed(seed)
-        logger.debug('Seeding whole game with %s', seed)
         self.seed = seed
+        # Dealing and choice of the starting player depend on the seed only
+        rng = random.Random(seed)
         if last_winners is None:
             last_winners = set()
-        self.field.randomize_game(set(players), seed=seed)
+        self.field.randomize_game(set(players), seed=seed, rng=rng)
         self.players = list(players)
-        self.active_player = self.select_starting_player(set(players), last_winners)
+        self.active_player = self.select_starting_player(set(players), last_winners, rng)
         self.defending_player = self.select_defending_player(self.active_player)
         self.started_at = datetime.datetime.utcnow()
+        self.remember_state()
         return self
 
-    def select_starting_player(self, players: Set[uuid.UUID], last_winners: Set[uuid.UUID]):
+    def select_starting_player(self, players: Set[uuid.UUID], last_winners: Set[uuid.UUID], rng: random.Random):
         choose_from = players & last_winners
         if choose_from:
-            return random.sample(choose_from, 1)[0]
+            return rng.choice(sorted(choose_from))
         starter = self.field.get_player_with_least_trump_suit()
         if starter is None:
-            starter = random.sample(players, 1)[0]
+            starter = rng.choice(sorted(players))
         return starter
 
     def select_defending_player(self, active_player):
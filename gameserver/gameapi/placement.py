@@ -0,0 +1,195 @@
+"""
+Starting games on the shard owning them
+
+Games formed by process-wide services of the coordinator (matchmaking, tournaments)
+are spread over all shards: a random game id picks the owner shard, the coordinator
+asks the owner to start the game and the owner reports the result back when the game
+is over. Shards authenticate each other with ``GAME_SHARD_SECRET``, without it every
+game is started on the coordinator itself. Starting a game is idempotent by its id, so a
+request that timed out is retried with the same id rather than starting the game elsewhere.
+"""
+import hmac
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+from uuid import UUID, uuid4
+
+import ujson
+from django.conf import settings
+
+from gameapi.games_manager import GameManager, game_manager
+from gameapi.models import Game
+from gameapi.sharding import SECRET_HEADER, ShardMap, shard_map
+
+logger = logging.getLogger(__name__)
+
+# game_id, players, winners (None for a draw)
+GameOverCallback = Callable[[UUID, List[UUID], Optional[Set[UUID]]], None]
+
+
+class PlacementFailed(Exception):
+    """
+    Owner shard did not confirm the game, it may still have started it
+    """
+
+
+class GamePlacement(object):
+    _instance = None
+
+    # Delays in seconds between attempts to start a game on its owner shard
+    START_RETRY_DELAYS = (0.5, 1)
+    # Delays in seconds between attempts to report a result to the coordinator
+    REPORT_RETRY_DELAYS = (1, 2, 4, 8, 16)
+
+    def __init__(self, manager: GameManager, shards: ShardMap, secret: str = '', timeout: float = 2.0):
+        self.manager = manager
+        self.shards = shards
+        self.secret = secret
+        self.timeout = timeout
+        # game_id -> callback and players of games started here and running on another shard
+        self.callbacks: Dict[UUID, Tuple[GameOverCallback, List[UUID]]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(game_manager, shard_map, getattr(settings, 'GAME_SHARD_SECRET', ''))
+        return cls._instance
+
+    @property
+    def remote_enabled(self):
+        return self.shards.enabled and bool(self.secret)
+
+    def is_authorized(self, secret: str) -> bool:
+        return bool(self.secret) and hmac.compare_digest(self.secret, secret or '')
+
+    def new_game_id(self) -> UUID:
+        """
+        Id of a new game, it decides the shard the game is started on
+        """
+        return uuid4() if self.remote_enabled else self.shards.new_game_id()
+
+    def start_game(self, players: List[UUID], last_winners: Set[UUID] = None,
+                   on_game_over: GameOverCallback = None, game_id: UUID = None) -> UUID:
+        """
+        Start game on its owner shard, **`on_game_over`** is called here when it is over.
+        Starting the same **`game_id`** again does nothing.
+
+        :raises PlacementFailed: if the owner shard did not confirm the game after retries
+        """
+        if game_id is None:
+            game_id = self.new_game_id()
+        if not self.remote_enabled or self.shards.is_local(game_id):
+            self.start_local_game(game_id, players, last_winners, on_game_over)
+            return game_id
+        if on_game_over is not None:
+            with self._lock:
+                self.callbacks[game_id] = (on_game_over, list(players))
+        data = {
+            'game_id': str(game_id),
+            'players': [str(player) for player in players],
+            'last_winners': [str(player) for player in last_winners or ()],
+            'report': on_game_over is not None,
+        }
+        url = self.shards.url_for(game_id, '/game/internal/games/start/')
+        for delay in self.START_RETRY_DELAYS + (None,):
+            try:
+                self._post(url, data)
+                return game_id
+            except (URLError, OSError, ValueError) as error:
+                shard = self.shards.shard_of(game_id)
+                logger.warning('Could not start game %s on shard %d: %s', game_id, shard, error)
+                if delay is None:
+                    raise PlacementFailed('Shard %d did not confirm game %s' % (shard, game_id))
+                time.sleep(delay)
+
+    def forget(self, game_id: UUID):
+        """
+        Do not call back about **`game_id`**, e.g. after ``PlacementFailed``
+        """
+        with self._lock:
+            self.callbacks.pop(game_id, None)
+
+    def start_local_game(self, game_id: UUID, players: List[UUID], last_winners: Set[UUID] = None,
+                         on_game_over: GameOverCallback = None) -> Game:
+        """
+        Start game on this shard unless it is started already
+        """
+        with self._lock:
+            # Retried starts come within seconds, the game is still in memory then
+            game = self.manager.games.get(game_id)
+            if game is None:
+                game = self._start_local_game(game_id, players, last_winners, on_game_over)
+            return game
+
+    def _start_local_game(self, game_id: UUID, players: List[UUID], last_winners: Set[UUID],
+                          on_game_over: Optional[GameOverCallback]) -> Game:
+        game = Game().start(list(players), last_winners=last_winners)
+        if on_game_over is not None:
+            def on_action(game_: Game, token, action, card):
+                if game_.is_over():
+                    game_.unsubscribe(on_action)
+                    on_game_over(game_id, list(game_.players), game_.winners)
+
+            game.subscribe(on_action)
+        self.manager.add_game(game, game_id)
+        return game
+
+    def start_requested_game(self, data: dict):
+        """
+        Start game the coordinator asked for, see ``start_game``
+        """
+        game_id = UUID(data['game_id'])
+        on_game_over = self.report_game_over if data.get('report') else None
+        self.start_local_game(
+            game_id,
+            [UUID(player) for player in data['players']],
+            {UUID(player) for player in data.get('last_winners', ())},
+            on_game_over,
+        )
+
+    def report_game_over(self, game_id: UUID, players: List[UUID], winners: Optional[Set[UUID]]):
+        """
+        Tell the coordinator the result, in the background: called with the game lock held
+        """
+        data = {'game_id': str(game_id), 'winners': None if winners is None else [str(player) for player in winners]}
+        threading.Thread(target=self._report, args=(data,), name='game-over-report', daemon=True).start()
+
+    def _report(self, data: dict):
+        for delay in self.REPORT_RETRY_DELAYS + (None,):
+            try:
+                self._post(self.shards.coordinator_url('/game/internal/games/over/'), data)
+                return
+            except (URLError, OSError, ValueError) as error:
+                if delay is None:
+                    logger.error('Could not report result of game %s to the coordinator: %s', data['game_id'], error)
+                    return
+                time.sleep(delay)
+
+    def game_over(self, game_id: UUID, winners: Optional[Iterable[UUID]]) -> bool:
+        """
+        Result of a game started on another shard, reported by its owner
+
+        :return: False if no game like that is expected
+        """
+        with self._lock:
+            entry = self.callbacks.pop(game_id, None)
+        if entry is None:
+            return False
+        callback, players = entry
+        callback(game_id, players, None if winners is None else set(winners))
+        return True
+
+    def _post(self, url: str, data: dict):
+        request = Request(url, data=ujson.dumps(data).encode(), method='POST', headers={
+            'Content-Type': 'application/json',
+            SECRET_HEADER: self.secret,
+        })
+        with urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+game_placement = GamePlacement.get_instance()
@@ -0,0 +1,116 @@
+"""
+Per-player profile aggregated while games are played
+
+Every counter is updated in O(1) when a move is accepted, an action is rejected
+or a game ends, so stats are available at any time without going through logs.
+Decision time is measured from the previous state change of the game (its start
+or the last accepted move) to the player's move.
+"""
+import threading
+import time
+from typing import Dict, List
+from uuid import UUID
+
+# Imported by gameapi.models, so models are not imported here
+
+
+class PlayerStats(object):
+    __slots__ = ('moves', 'decision_time', 'rejected', 'games', 'wins', 'losses', 'draws', 'finished_game_moves')
+
+    def __init__(self):
+        # Accepted moves and their total decision time in seconds
+        self.moves = 0
+        self.decision_time = 0.0
+        self.rejected = 0
+        self.games = 0
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        # Moves made in games counted in ``games``
+        self.finished_game_moves = 0
+
+    def as_dict(self):
+        actions = self.moves + self.rejected
+        return {
+            'games': self.games,
+            'wins': self.wins,
+            'losses': self.losses,
+            'draws': self.draws,
+            'moves': self.moves,
+            'moves_per_game': self.finished_game_moves / self.games if self.games else None,
+            'rejected_actions': self.rejected,
+            'rejected_rate': self.rejected / actions if actions else None,
+            'average_decision_time': self.decision_time / self.moves if self.moves else None,
+        }
+
+
+class PlayerStatsRegistry(object):
+    _instance = None
+
+    def __init__(self):
+        self.stats: Dict[UUID, PlayerStats] = {}
+        # Counters of one player are updated from threads of all the player's games
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def _stats(self, player: UUID) -> PlayerStats:
+        stats = self.stats.get(player)
+        if stats is None:
+            stats = self.stats.setdefault(player, PlayerStats())
+        return stats
+
+    def track(self, game):
+        """
+        Count moves and result of **`game`** from now on
+        """
+        changed_at = time.monotonic()
+        moves: Dict[UUID, int] = {player: 0 for player in game.players}
+
+        def on_action(game_, token, action, card):
+            nonlocal changed_at
+            now = time.monotonic()
+            moves[token] += 1
+            with self._lock:
+                stats = self._stats(token)
+                stats.moves += 1
+                stats.decision_time += now - changed_at
+            changed_at = now
+            if game_.is_over():
+                game_.unsubscribe(on_action)
+                self.game_over(game_.players, game_.winners, moves)
+
+        game.subscribe(on_action)
+
+    def record_rejected(self, player: UUID):
+        with self._lock:
+            self._stats(player).rejected += 1
+
+    def game_over(self, players: List[UUID], winners, moves: Dict[UUID, int]):
+        with self._lock:
+            for player in players:
+                stats = self._stats(player)
+                stats.games += 1
+                stats.finished_game_moves += moves.get(player, 0)
+                if not winners:
+                    stats.draws += 1
+                elif player in winners:
+                    stats.wins += 1
+                else:
+                    stats.losses += 1
+
+    def get(self, player: UUID) -> dict:
+        with self._lock:
+            stats = self.stats.get(player) or PlayerStats()
+            return stats.as_dict()
+
+    def get_all(self) -> Dict[UUID, dict]:
+        with self._lock:
+            return {player: stats.as_dict() for player, stats in self.stats.items()}
+
+
+player_stats = PlayerStatsRegistry.get_instance()
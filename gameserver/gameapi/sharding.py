@@ -0,0 +1,141 @@
+"""
+Sharding of games between server processes
+
+Every game is owned by one process (shard) chosen by its game_id. Processes are
+started with the same ``GAME_SHARDS`` list of base URLs and their own
+``GAME_SHARD_INDEX``. Requests for a game landing on a wrong process are
+redirected to the owner, so any load balancer in front of the processes works.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+from uuid import UUID, uuid4
+
+import ujson
+from django.conf import settings
+from django.http import HttpResponseRedirect
+
+logger = logging.getLogger(__name__)
+
+# Header carrying GAME_SHARD_SECRET in requests between shards
+SECRET_HEADER = 'X-Shard-Secret'
+
+
+class ShardMap(object):
+    _instance = None
+
+    def __init__(self, shards: List[str], index: int = 0):
+        if shards and not 0 <= index < len(shards):
+            raise ValueError('Shard index %d is out of range of %d shards' % (index, len(shards)))
+        self.shards = [shard.rstrip('/') for shard in shards]
+        self.index = index
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                getattr(settings, 'GAME_SHARDS', []),
+                getattr(settings, 'GAME_SHARD_INDEX', 0),
+            )
+        return cls._instance
+
+    @property
+    def enabled(self):
+        return len(self.shards) > 1
+
+    def shard_of(self, game_id: UUID) -> int:
+        if not self.enabled:
+            return self.index
+        return game_id.int % len(self.shards)
+
+    def is_local(self, game_id: UUID) -> bool:
+        return self.shard_of(game_id) == self.index
+
+    def new_game_id(self) -> UUID:
+        """
+        Random game id owned by this shard
+        """
+        while True:
+            game_id = uuid4()
+            if self.is_local(game_id):
+                return game_id
+
+    def url_for(self, game_id: UUID, full_path: str) -> str:
+        return self.shards[self.shard_of(game_id)] + full_path
+
+    @property
+    def is_coordinator(self):
+        return not self.enabled or self.index == 0
+
+    def coordinator_url(self, full_path: str) -> str:
+        return self.shards[0] + full_path
+
+    def peers(self) -> List[str]:
+        return [shard for index, shard in enumerate(self.shards) if index != self.index]
+
+
+class ShardRoutingMiddleware(object):
+    """
+    Redirect requests of views taking ``game_id`` to the shard owning the game
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'coordinator_only', False) and not shard_map.is_coordinator:
+            return self.redirect(shard_map.coordinator_url(request.get_full_path()))
+        game_id = view_kwargs.get('game_id')
+        if game_id is None or shard_map.is_local(game_id):
+            return None
+        return self.redirect(shard_map.url_for(game_id, request.get_full_path()))
+
+    @staticmethod
+    def redirect(url: str):
+        response = HttpResponseRedirect(url)
+        # 307 keeps method and body of the request
+        response.status_code = 307
+        return response
+
+
+def coordinator_only(fn):
+    """
+    Mark view serving process-wide state (e.g. matchmaking queue) kept on the first shard only
+    """
+    fn.coordinator_only = True
+    return fn
+
+
+def fetch_remote_games(player: str, status: str = None, secret: str = '', timeout: float = 2.0) -> List[str]:
+    """
+    Ask every other shard for ids of games of **`player`**, unreachable shards are skipped.
+    Shards answer only requests carrying their common **`secret`**.
+    """
+
+    def fetch(shard):
+        request = Request(
+            shard + '/game/internal/games/list/',
+            data=ujson.dumps({'player': player, 'status': status}).encode(),
+            method='POST',
+            headers={'Content-Type': 'application/json', SECRET_HEADER: secret},
+        )
+        try:
+            with urlopen(request, timeout=timeout) as response:
+                return ujson.loads(response.read())
+        except (URLError, OSError, ValueError) as error:
+            logger.warning('Could not list games on shard %s: %s', shard, error)
+            return []
+
+    peers = shard_map.peers()
+    if not peers:
+        return []
+    with ThreadPoolExecutor(max_workers=len(peers)) as executor:
+        return [game_id for games in executor.map(fetch, peers) for game_id in games]
+
+
+shard_map = ShardMap.get_instance()
@@ -0,0 +1,195 @@
+"""
+Headless game simulator
+
+Plays games between bot policies directly against the game engine
+(``Game.start`` / ``Game.take_action_by_index``), without views, HTTP or database.
+"""
+import logging
+import multiprocessing
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+import django
+from django.utils.module_loading import import_string
+
+from gameapi.events import event_log
+from gameapi.models import Game, card_rank, card_suit, iter_cards
+
+logger = logging.getLogger(__name__)
+
+PLAYERS = (uuid.UUID(int=1), uuid.UUID(int=2))
+
+# Outcome keys of a single simulated game
+DRAW = 'draw'
+UNFINISHED = 'unfinished'
+
+
+def legal_cards(game: Game, token: uuid.UUID) -> List[int]:
+    return list(iter_cards(game.legal_cards(token)))
+
+
+class Policy(object):
+    """
+    Bot strategy. ``choose`` is called only for the active player and must
+    return an allowed ``(action, card_index)`` pair.
+    """
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+    def choose(self, game: Game, token: uuid.UUID) -> Tuple[Game.Action, int]:
+        raise NotImplementedError()
+
+
+class RandomPolicy(Policy):
+    """
+    Uniformly random legal move
+    """
+
+    def choose(self, game: Game, token: uuid.UUID):
+        moves = [(Game.Action.PUT, card) for card in legal_cards(game, token)]
+        if game.is_defending(token):
+            moves.append((Game.Action.TAKE, None))
+        elif game.field.table:
+            moves.append((Game.Action.ENDTURN, None))
+        return self.rng.choice(moves)
+
+
+class GreedyPolicy(Policy):
+    """
+    Always plays the cheapest legal card (non-trumps first), takes or ends turn otherwise
+    """
+
+    def choose(self, game: Game, token: uuid.UUID):
+        trump_suit = game.field.trump_suit
+        cards = legal_cards(game, token)
+        if cards:
+            card = min(cards, key=lambda card: (card_suit(card) == trump_suit, card_rank(card)))
+            # Keep trumps while the deck lasts unless we have to defend or open the turn
+            if (
+                    game.is_defending(token) or not game.field.table or
+                    card_suit(card) != trump_suit or not game.field.deck
+            ):
+                return Game.Action.PUT, card
+        if game.is_defending(token):
+            return Game.Action.TAKE, None
+        return Game.Action.ENDTURN, None
+
+
+POLICIES: Dict[str, type] = {
+    'random': RandomPolicy,
+    'greedy': GreedyPolicy,
+}
+
+
+def get_policy_class(name: str) -> type:
+    """
+    Resolve policy by short name or by dotted path to a ``Policy`` subclass
+    """
+    if name in POLICIES:
+        return POLICIES[name]
+    return import_string(name)
+
+
+def play_game(seed: int, policy_classes: Sequence[type], max_moves: int = 1000):
+    """
+    Play one game, seat of the first policy alternates with seed parity
+
+    :return: index of the winning policy, ``DRAW`` or ``UNFINISHED``
+    """
+    seats = list(policy_classes) if seed % 2 == 0 else list(reversed(policy_classes))
+    rng = random.Random(seed)
+    policies = {player: seat(rng) for player, seat in zip(PLAYERS, seats)}
+    game = Game().start(list(PLAYERS), seed=seed)
+    while not game.is_over():
+        if game.number_of_moves >= max_moves:
+            return UNFINISHED
+        player = game.active_player
+        action, card = policies[player].choose(game, player)
+        game.take_action_by_index(player, action, card)
+    if not game.winners:
+        return DRAW
+    winner_seat = PLAYERS.index(next(iter(game.winners)))
+    return winner_seat if seed % 2 == 0 else 1 - winner_seat
+
+
+def play_games(first_seed: int, number_of_games: int, policy_names: Sequence[str], max_moves: int):
+    policy_classes = [get_policy_class(name) for name in policy_names]
+    outcomes = Counter()
+    # Move and game over events of simulated games would flood the event log
+    previous_level = event_log.level
+    event_log.level = max(previous_level, logging.WARNING)
+    try:
+        for seed in range(first_seed, first_seed + number_of_games):
+            outcomes[play_game(seed, policy_classes, max_moves)] += 1
+    finally:
+        event_log.level = previous_level
+    return outcomes
+
+
+class SimulationResult(object):
+    def __init__(self, policy_names: Sequence[str], outcomes: Counter, elapsed: float):
+        self.policy_names = list(policy_names)
+        self.outcomes = outcomes
+        self.elapsed = elapsed
+
+    @property
+    def number_of_games(self):
+        return sum(self.outcomes.values())
+
+    @property
+    def games_per_second(self):
+        return self.number_of_games / self.elapsed if self.elapsed else float('inf')
+
+    def win_rate(self, outcome):
+        return self.outcomes[outcome] / self.number_of_games if self.number_of_games else 0.0
+
+    def as_dict(self):
+        return {
+            'games': self.number_of_games,
+            'elapsed': self.elapsed,
+            'games_per_second': self.games_per_second,
+            'wins': {
+                '%d:%s' % (index, name): self.outcomes[index] for index, name in enumerate(self.policy_names)
+            },
+            'draws': self.outcomes[DRAW],
+            'unfinished': self.outcomes[UNFINISHED],
+        }
+
+
+def simulate(
+        number_of_games: int,
+        policy_names: Sequence[str],
+        seed: int = 0,
+        processes: int = None,
+        chunk_size: int = 1000,
+        max_moves: int = 1000,
+) -> SimulationResult:
+    """
+    Play **`number_of_games`** games with seeds ``seed .. seed + number_of_games - 1``
+    split in chunks over a pool of **`processes`** worker processes
+    """
+    if len(policy_names) != 2:
+        raise ValueError('Exactly two policies are required, got %s' % (policy_names,))
+    for name in policy_names:
+        get_policy_class(name)
+
+    chunks = [
+        (first_seed, min(chunk_size, seed + number_of_games - first_seed), list(policy_names), max_moves)
+        for first_seed in range(seed, seed + number_of_games, chunk_size)
+    ]
+    outcomes = Counter()
+    started_at = time.perf_counter()
+    if processes == 1:
+        for chunk in chunks:
+            outcomes.update(play_games(*chunk))
+    else:
+        # Workers may be spawned rather than forked, so they set up Django before importing models
+        with multiprocessing.Pool(processes, initializer=django.setup) as pool:
+            for chunk_outcomes in pool.starmap(play_games, chunks):
+                outcomes.update(chunk_outcomes)
+    elapsed = time.perf_counter() - started_at
+    return SimulationResult(policy_names, outcomes, elapsed)
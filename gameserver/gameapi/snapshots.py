@@ -0,0 +1,196 @@
+"""
+Snapshots of running games in a local SQLite file, so restarts do not lose them
+
+Every move marks its game dirty, a background thread writes dirty games as
+``Game.to_dict`` JSON in one ``INSERT OR REPLACE`` batch every ``interval`` seconds.
+After a restart only ``game_id -> players`` index is read, games themselves are
+loaded on first access. Moves made after the last snapshot are recovered from the
+game's action log when there is one.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+import ujson
+from django.conf import settings
+
+from gameapi.action_log import CorruptedLog, action_log_writer, read_log
+from gameapi.models import Game
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS game_snapshot (
+    game_id TEXT PRIMARY KEY,
+    players TEXT NOT NULL,
+    number_of_moves INTEGER NOT NULL,
+    finished INTEGER NOT NULL,
+    data TEXT NOT NULL
+)
+'''
+
+
+class SnapshotStore(object):
+    _instance = None
+
+    def __init__(self, path: str, interval: float = 5.0):
+        self.path = path
+        self.interval = interval
+        # game_id -> game changed since its last snapshot, None to delete the snapshot
+        self._dirty: Dict[UUID, Optional[Game]] = {}
+        self._dirty_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer: threading.Thread = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                getattr(settings, 'GAME_SNAPSHOT_DB', None),
+                getattr(settings, 'GAME_SNAPSHOT_INTERVAL', 5.0),
+            )
+        return cls._instance
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread, the store file is created on first use
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with connection:
+                connection.execute(SCHEMA)
+        return connection
+
+    def track(self, game_id: UUID, game: Game):
+        """
+        Snapshot **`game`** now and after each of its moves
+        """
+        self.mark_dirty(game_id, game)
+
+        def on_action(game_: Game, token, action, card):
+            self.mark_dirty(game_id, game_)
+            if game_.is_over():
+                game_.unsubscribe(on_action)
+
+        game.subscribe(on_action)
+
+    def mark_dirty(self, game_id: UUID, game: Optional[Game]):
+        with self._dirty_lock:
+            self._dirty[game_id] = game
+        if self._writer is None:
+            self._start_writer()
+
+    def forget(self, game_ids: Iterable[UUID]):
+        """
+        Drop snapshots of games stored elsewhere from now on (e.g. archived)
+        """
+        for game_id in game_ids:
+            self.mark_dirty(game_id, None)
+
+    def _start_writer(self):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_periodically, name='game-snapshot-writer',
+                                                daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _write_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write game snapshots')
+
+    def flush(self):
+        with self._write_lock:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+            rows = []
+            deleted = []
+            for game_id, game in dirty.items():
+                if game is None:
+                    deleted.append((str(game_id),))
+                    continue
+                with game.lock:
+                    data = game.to_dict()
+                rows.append((
+                    str(game_id), ','.join(data['players']), data['number_of_moves'],
+                    data['finished_at'] is not None, ujson.dumps(data),
+                ))
+            connection = self._connection()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO game_snapshot VALUES (?, ?, ?, ?, ?)', rows)
+                connection.executemany('DELETE FROM game_snapshot WHERE game_id = ?', deleted)
+            logger.debug('Wrote %d game snapshots, dropped %d', len(rows), len(deleted))
+
+    def load_index(self) -> List[Tuple[UUID, List[UUID], bool]]:
+        """
+        Ids, players and whether the game is over for all stored games, without loading the games
+        """
+        rows = self._connection().execute('SELECT game_id, players, finished FROM game_snapshot').fetchall()
+        return [
+            (UUID(game_id), [UUID(player) for player in players.split(',')], bool(finished))
+            for game_id, players, finished in rows
+        ]
+
+    def load(self, game_id: UUID) -> Optional[Game]:
+        """
+        Restore game from its snapshot and moves logged after it
+        """
+        row = self._connection().execute(
+            'SELECT data FROM game_snapshot WHERE game_id = ?', (str(game_id),),
+        ).fetchone()
+        if row is None:
+            return None
+        game = Game.from_dict(ujson.loads(row[0]))
+        self._replay_log_tail(game_id, game)
+        return game
+
+    @staticmethod
+    def _replay_log_tail(game_id: UUID, game: Game):
+        """
+        Apply moves logged after the snapshot and keep logging the game if the log is complete
+        """
+        if not action_log_writer.enabled:
+            return
+        try:
+            _, _, _, records = read_log(action_log_writer.path_for(game_id))
+        except (OSError, CorruptedLog):
+            return
+        for player, action, card in records[game.number_of_moves:]:
+            try:
+                game.take_action_by_index(player, action, card)
+            except (Game.ActionNotAllowed, Game.ActionInvalid):
+                logger.warning('Action log of game %s does not match its snapshot at move %d, not logging it further',
+                               game_id, game.number_of_moves)
+                return
+        if game.is_over():
+            return
+        if len(records) == game.number_of_moves:
+            action_log_writer.start_log(game_id, game, resume=True)
+        else:
+            logger.warning('Action log of game %s misses moves after %d, not logging it further',
+                           game_id, len(records))
+
+
+snapshot_store = SnapshotStore.get_instance()
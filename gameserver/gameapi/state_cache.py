@@ -0,0 +1,65 @@
+import logging
+import ujson
+from uuid import UUID
+
+from gameapi import metrics
+from gameapi.models import Game
+
+logger = logging.getLogger(__name__)
+
+
+class StateCache(object):
+    """
+    Serialized ``Game.get_state`` of every player of a game, valid until the next move.
+
+    Entries live on the game itself (``Game.serialized_states``) keyed by player and
+    whether legal cards are included, tagged with ``number_of_moves`` they were made at, so they go away together with
+    the game and a move invalidates them. Repeated polls between moves get the
+    same pre-encoded bytes.
+    """
+    _instance = None
+
+    def __init__(self):
+        # Sharded per thread, polls of different games do not contend on it
+        self.requests = metrics.Counter(
+            'durak_state_cache_requests_total', 'Serialized state requests by state cache result', ['result'],
+        )
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def get(self, game: Game, token: UUID, with_legal_cards=False) -> bytes:
+        key = (token, with_legal_cards)
+        entry = game.serialized_states.get(key)
+        if entry is not None and entry[0] == game.number_of_moves:
+            self.requests.inc('hit')
+            return entry[1]
+        self.requests.inc('miss')
+        with game.lock:
+            serialized = ujson.dumps(game.get_state(token, with_legal_cards=with_legal_cards)).encode()
+            game.serialized_states[key] = (game.number_of_moves, serialized)
+        return serialized
+
+    @property
+    def hits(self):
+        return self.requests.value('hit')
+
+    @property
+    def misses(self):
+        return self.requests.value('miss')
+
+    def stats(self):
+        requests = self.requests.merged()
+        hits, misses = requests.get(('hit',), [0])[0], requests.get(('miss',), [0])[0]
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+
+state_cache = StateCache.get_instance()
+metrics.registry.register(state_cache.requests)
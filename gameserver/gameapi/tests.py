@@ -1,3 +1,1431 @@
-# from django.test import TestCase
+import asyncio
+import io
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import ujson
+from unittest import mock
+from urllib.error import URLError
+from urllib.parse import urlencode, urlparse
+from uuid import UUID
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+
+from gameapi import metrics
+from gameapi.action_log import CorruptedLog, ActionLogWriter, action_log_writer, read_log, replay
+from gameapi.benchmarks import BenchmarkContext, compare
+from gameapi.events import EventLog, event_log, parse_sampling
+from gameapi.games_manager import GameManager
+from gameapi.matchmaking import Matchmaker
+from gameapi.models import (
+    CARD_STRINGS, NUMBER_OF_CARDS, ArchivedGame, Card, Game, GameField, Token, TokenAccessLog, card_rank, card_suit,
+    iter_cards,
+)
+from gameapi.placement import SECRET_HEADER, GamePlacement, PlacementFailed, game_placement
+from gameapi.player_stats import PlayerStatsRegistry, player_stats
+from gameapi.sharding import ShardMap
+from gameapi.simulator import DRAW, UNFINISHED, RandomPolicy, play_game, simulate
+from gameapi.snapshots import SnapshotStore
+from gameapi.state_cache import StateCache
+from gameapi.token_access_log import TokenAccessLogWriter, token_access_log
+from gameapi.token_cache import TokenCache, token_cache
+from gameapi.tokens import invalidate_tokens, issue_token
+from gameapi.tournament import Tournament
+from gameapi.websocket import GameSocketApplication
+
+PLAYERS = [UUID(int=1), UUID(int=2)]
+THREADS = 16
+
+
+def run_threads(target, count=THREADS):
+    errors = []
+
+    def run(index):
+        try:
+            target(index)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def play(game: Game, moves: int = None, seed=0):
+    """
+    Make **`moves`** random legal moves, play to the end by default
+    """
+    policy = RandomPolicy(random.Random(seed))
+    while not game.is_over() and (moves is None or moves > 0):
+        game.take_action_by_index(game.active_player, *policy.choose(game, game.active_player))
+        if moves is not None:
+            moves -= 1
+
+
+def card_mask(cards) -> int:
+    return sum(1 << CARD_STRINGS.index(card) for card in cards)
+
+
+def rigged_game(attacker_cards, defender_cards, table=(), trump='6S', deck=('7D', '8D'), players=PLAYERS) -> Game:
+    """
+    Game in progress: the first of **`players`** attacks, the second defends, trump lies at the bottom of **`deck`**
+    """
+    game = Game().start(players, seed=0)
+    game.field = GameField.from_dict({
+        'player_cards': {str(players[0]): card_mask(attacker_cards), str(players[1]): card_mask(defender_cards)},
+        'deck': [CARD_STRINGS.index(card) for card in deck],
+        'trump': CARD_STRINGS.index(trump),
+        'table': [[CARD_STRINGS.index(card) for card in pair] for pair in table],
+        'leftover': 0,
+    })
+    game.defending_player = players[1]
+    game.active_player = players[1] if table and len(table[-1]) == 1 else players[0]
+    game.legal_cards_cache.clear()
+    return game
+
+
+class ConcurrentTestCase(SimpleTestCase):
+    def setUp(self):
+        # Switch threads as often as possible to make interleavings likely
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, switch_interval)
+        # Rejected moves are expected here
+        patcher = mock.patch.object(event_log, 'level', logging.ERROR)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ConcurrentGameTest(ConcurrentTestCase):
+    def assert_cards_conserved(self, game: Game):
+        field = game.field
+        sets = list(field.player_cards.values()) + [field.table_mask, field.leftover]
+        sets += [1 << card for card in field.deck]
+        seen = 0
+        for cards in sets:
+            self.assertEqual(seen & cards, 0, 'card is in two places at once')
+            seen |= cards
+        self.assertEqual(seen, (1 << NUMBER_OF_CARDS) - 1)
+
+    def test_moves_from_many_threads(self):
+        """
+        Threads race to move in the same games, accepted moves have to form a game
+        that replays exactly from its seed
+        """
+        for seed in range(5):
+            game = Game().start(PLAYERS, seed=seed)
+            accepted = []
+            violations = []
+
+            def record(game_, token, action, card):
+                accepted.append((token, action, card))
+                try:
+                    self.assert_cards_conserved(game_)
+                except AssertionError as error:
+                    violations.append(error)
+
+            game.subscribe(record)
+            cache = StateCache()
+
+            def play(index):
+                rng = random.Random(seed * THREADS + index)
+                policy = RandomPolicy(rng)
+                while not game.is_over():
+                    if index % 4 == 0:
+                        token = rng.choice(PLAYERS)
+                        cache.get(game, token)
+                        game.get_state_delta(token, max(0, game.number_of_moves - 2))
+                        continue
+                    with game.lock:
+                        token = game.active_player
+                        if token is None:
+                            return
+                        action, card = policy.choose(game, token)
+                    # Another thread may move in between, making this move stale
+                    try:
+                        game.take_action_by_index(token, action, card)
+                    except (Game.ActionNotAllowed, Game.ActionInvalid):
+                        pass
+
+            self.assertEqual(run_threads(play), [])
+            self.assertEqual(violations, [])
+            self.assertEqual(game.number_of_moves, len(accepted))
+
+            replayed = Game().start(PLAYERS, seed=seed)
+            for token, action, card in accepted:
+                replayed.take_action_by_index(token, action, card)
+            self.assertEqual(replayed.field.to_dict(), game.field.to_dict())
+            self.assertEqual(replayed.winners, game.winners)
+            for token in PLAYERS:
+                self.assertEqual(cache.get(game, token), cache.get(replayed, token))
+
+    def test_failing_listener_does_not_stop_other_listeners(self):
+        game = Game().start(PLAYERS, seed=1)
+        calls = []
+
+        def failing(game_, token, action, card):
+            raise OSError('disk full')
+
+        game.subscribe(failing)
+        game.subscribe(lambda game_, token, action, card: calls.append(action))
+        token = game.active_player
+        with mock.patch('gameapi.models.logger'):
+            game.take_action_by_index(token, Game.Action.PUT, next(iter_cards(game.legal_cards(token))))
+        self.assertEqual(calls, [Game.Action.PUT])
+        self.assertEqual(game.number_of_moves, 1)
+
+    def test_queued_actions_under_contention(self):
+        game = Game().start(PLAYERS, seed=7)
+        accepted = []
+        game.subscribe(lambda game_, token, action, card: accepted.append((token, action, card)))
+
+        def play(index):
+            rng = random.Random(index)
+            while not game.is_over():
+                with game.lock:
+                    token = game.active_player
+                    if token is None:
+                        return
+                    cards = list(iter_cards(game.field.player_cards[token]))
+                # Attacker may be left without cards until the turn ends
+                actions = [(Game.Action.PUT, rng.choice(cards)) for _ in range(rng.randint(1, 3)) if cards]
+                actions.append((Game.Action.TAKE if game.is_defending(token) else Game.Action.ENDTURN, None))
+                try:
+                    game.take_actions(token, actions[rng.randint(0, len(actions) - 1):])
+                except (Game.ActionNotAllowed, Game.ActionInvalid):
+                    pass
+                self.assert_cards_conserved(game.clone())
+
+        self.assertEqual(run_threads(play), [])
+        self.assert_cards_conserved(game)
+        # Queued actions are ordinary moves, the game replays from its seed
+        replayed = Game().start(PLAYERS, seed=7)
+        for token, action, card in accepted:
+            replayed.take_action_by_index(token, action, card)
+        self.assertEqual(replayed.field.to_dict(), game.field.to_dict())
+
+
+class QueuedActionsTest(SimpleTestCase):
+    def start_game(self):
+        """
+        Game where defender can beat attacker's first legal card
+        """
+        for seed in range(100):
+            game = Game().start(PLAYERS, seed=seed)
+            attacker = game.active_player
+            card = next(iter_cards(game.legal_cards(attacker)))
+            trial = game.clone()
+            trial.take_action_by_index(attacker, Game.Action.PUT, card)
+            if trial.legal_cards(trial.active_player):
+                return game, attacker, card
+        self.fail('No game where the first attack can be beaten')
+
+    def defend(self, game: Game):
+        defender = game.active_player
+        game.take_action_by_index(defender, Game.Action.PUT, next(iter_cards(game.legal_cards(defender))))
+
+    def test_queued_action_is_taken_when_player_gets_the_turn(self):
+        game, attacker, card = self.start_game()
+        game.take_actions(attacker, [(Game.Action.PUT, card), (Game.Action.ENDTURN, None)])
+        self.assertEqual(list(game.queued_actions[attacker]), [(Game.Action.ENDTURN, None)])
+        self.defend(game)
+        self.assertEqual(game.number_of_moves, 3)
+        self.assertEqual(game.number_of_turns, 1)
+        self.assertNotIn(attacker, game.queued_actions)
+
+    def test_every_move_is_timed_without_listeners(self):
+        game, attacker, card = self.start_game()
+        game.subscribe(lambda game_, token, action, card_: time.sleep(0.05))
+        with mock.patch.object(metrics.take_action_latency, 'observe') as observe:
+            game.take_actions(attacker, [(Game.Action.PUT, card), (Game.Action.ENDTURN, None)])
+            self.defend(game)
+        self.assertEqual([call[0][1] for call in observe.call_args_list], ['put', 'put', 'endturn'])
+        self.assertLess(max(call[0][0] for call in observe.call_args_list), 0.05)
+
+    def test_queue_is_dropped_when_queued_action_is_not_accepted(self):
+        game, attacker, card = self.start_game()
+        game.take_actions(attacker, [(Game.Action.PUT, card), (Game.Action.PUT, card), (Game.Action.ENDTURN, None)])
+        self.defend(game)
+        self.assertEqual(game.number_of_moves, 2)
+        self.assertEqual(game.active_player, attacker)
+        self.assertNotIn(attacker, game.queued_actions)
+
+    def test_rejected_first_action_queues_nothing(self):
+        game, attacker, card = self.start_game()
+        defender = next(player for player in PLAYERS if player != attacker)
+        with mock.patch.object(event_log, 'level', logging.ERROR), self.assertRaises(Game.ActionNotAllowed):
+            game.take_actions(defender, [(Game.Action.TAKE, None), (Game.Action.TAKE, None)])
+        self.assertEqual(game.queued_actions, {})
+
+
+class SeededGameTest(SimpleTestCase):
+    def test_same_seed_deals_the_same_game(self):
+        for last_winners in (None, set(PLAYERS)):
+            state = random.getstate()
+            first, second = (Game().start(PLAYERS, last_winners, seed=12345) for _ in range(2))
+            # Seeded games do not touch the module-level generator
+            self.assertEqual(random.getstate(), state)
+            self.assertEqual(first.field.to_dict(), second.field.to_dict())
+            self.assertEqual(first.field.trump, second.field.trump)
+            self.assertEqual((first.active_player, first.defending_player),
+                             (second.active_player, second.defending_player))
+
+    def test_different_seeds_deal_different_games(self):
+        decks = {tuple(Game().start(PLAYERS, seed=seed).field.deck) for seed in range(5)}
+        self.assertEqual(len(decks), 5)
+
+
+class GameRulesTest(SimpleTestCase):
+    def assert_valid_puts(self, game: Game, cards, valid):
+        for card in cards:
+            self.assertEqual(game.is_action_valid(game.active_player, Game.Action.PUT, CARD_STRINGS.index(card)),
+                             card in valid, card)
+
+    def test_cards_round_trip_through_indices_and_strings(self):
+        self.assertEqual(len(set(CARD_STRINGS)), NUMBER_OF_CARDS)
+        self.assertEqual([CARD_STRINGS[index] for index in (0, 8, 9, 35)], ['6S', '14S', '6C', '14H'])
+        for index, card_str in enumerate(CARD_STRINGS):
+            card = Card.from_index(index)
+            self.assertEqual(card.to_index(), index)
+            self.assertEqual(card.to_card_string(), card_str)
+            self.assertEqual(Card.from_string(card_str), card)
+            self.assertEqual(list(Card.Suit)[card_suit(index)], card.suit)
+            self.assertEqual(card_rank(index), card.value - 6)
+
+    def test_any_card_opens_attack(self):
+        game = rigged_game(['6C', '9H', '14S'], ['7C'])
+        self.assert_valid_puts(game, ['6C', '9H', '14S'], {'6C', '9H', '14S'})
+
+    def test_attack_must_match_rank_on_table(self):
+        game = rigged_game(['7H', '8D', '9S', '14C'], ['12C'], table=[['7C', '8C']])
+        self.assert_valid_puts(game, ['7H', '8D', '9S', '14C'], {'7H', '8D'})
+        with self.assertRaises(Game.ActionInvalid):
+            game.take_action_by_index(PLAYERS[0], Game.Action.PUT, CARD_STRINGS.index('9S'))
+
+    def test_defence_needs_higher_card_of_the_suit_or_trump(self):
+        game = rigged_game(['6H'], ['10C', '8C', '9H', '6S', '14D'], table=[['9C']])
+        self.assert_valid_puts(game, ['10C', '8C', '9H', '6S', '14D'], {'10C', '6S'})
+
+    def test_trump_is_beaten_only_by_higher_trump(self):
+        game = rigged_game(['6H'], ['9S', '11S', '14H', '14C'], table=[['10S']])
+        self.assert_valid_puts(game, ['9S', '11S', '14H', '14C'], {'11S'})
+
+    def test_player_emptying_hand_after_deck_wins(self):
+        game = rigged_game(['7C'], ['8C', '9D'], deck=())
+        game.take_action_by_index(PLAYERS[0], Game.Action.PUT, CARD_STRINGS.index('7C'))
+        self.assertTrue(game.is_over())
+        self.assertEqual(game.winners, {PLAYERS[0]})
+        self.assertEqual((game.get_result(PLAYERS[0]), game.get_result(PLAYERS[1])), ('winner', 'looser'))
+
+    def test_both_hands_emptied_at_once_is_a_draw(self):
+        game = rigged_game(['7C', '7H'], ['8C'], deck=())
+        game.take_action_by_index(PLAYERS[0], Game.Action.PUT, CARD_STRINGS.index('7C'))
+        game.take_action_by_index(PLAYERS[1], Game.Action.PUT, CARD_STRINGS.index('8C'))
+        self.assertFalse(game.is_over())
+        game.take_action_by_index(PLAYERS[0], Game.Action.PUT, CARD_STRINGS.index('7H'))
+        self.assertTrue(game.is_over())
+        self.assertIsNone(game.winners)
+        self.assertEqual(game.get_result(PLAYERS[0]), 'draw')
+
+    def test_game_goes_on_while_deck_lasts(self):
+        game = rigged_game(['7C'], ['8C'], deck=('6S', '9D'))
+        game.take_action_by_index(PLAYERS[0], Game.Action.PUT, CARD_STRINGS.index('7C'))
+        self.assertFalse(game.is_over())
+
+
+class LegalCardsTest(SimpleTestCase):
+    def test_attacker_may_add_cards_of_ranks_on_table(self):
+        game = rigged_game(['7H', '8D', '9S', '14C', '8S'], ['12C'], table=[['7C', '8C']])
+        self.assertEqual(game.legal_cards(PLAYERS[0]), card_mask(['7H', '8D', '8S']))
+        self.assertEqual(game.legal_cards(PLAYERS[1]), 0)
+        self.assertEqual(game.get_state(PLAYERS[0], with_legal_cards=True)['legal_cards'], ['8S', '8D', '7H'])
+        self.assertNotIn('legal_cards', game.get_state(PLAYERS[0]))
+
+    def test_defender_may_beat_with_higher_card_or_trump(self):
+        game = rigged_game(['6H'], ['10C', '8C', '9H', '6S', '7S', '14D'], table=[['9C']])
+        self.assertEqual(game.legal_cards(PLAYERS[1]), card_mask(['10C', '6S', '7S']))
+        self.assertEqual(game.legal_cards(PLAYERS[0]), 0)
+
+    def test_legal_cards_follow_moves(self):
+        game = rigged_game(['9C', '10H'], ['10C', '6S'])
+        self.assertEqual(game.legal_cards(PLAYERS[0]), card_mask(['9C', '10H']))
+        game.take_action_by_index(PLAYERS[0], Game.Action.PUT, CARD_STRINGS.index('9C'))
+        self.assertEqual(game.legal_cards(PLAYERS[1]), card_mask(['10C', '6S']))
+        game.take_action_by_index(PLAYERS[1], Game.Action.PUT, CARD_STRINGS.index('10C'))
+        self.assertEqual(game.legal_cards(PLAYERS[0]), card_mask(['10H']))
+
+
+class ConcurrentGameManagerTest(ConcurrentTestCase):
+    def test_add_and_list_games_from_many_threads(self):
+        manager = GameManager(collect_interval=3600)
+        per_thread = 50
+        added = []
+
+        def add(index):
+            players = [UUID(int=index + 1), UUID(int=THREADS + 1)]
+            for seed in range(per_thread):
+                added.append(manager.add_game(Game().start(players, seed=seed)))
+                manager.list_games(players[0])
+
+        with mock.patch.object(action_log_writer, 'directory', ''):
+            self.assertEqual(run_threads(add), [])
+
+        self.assertEqual(len(set(added)), THREADS * per_thread)
+        self.assertEqual(len(manager.games), THREADS * per_thread)
+        self.assertEqual(len(manager.list_games(UUID(int=THREADS + 1))), THREADS * per_thread)
+        for index in range(THREADS):
+            self.assertEqual(len(manager.list_games(UUID(int=index + 1))), per_thread)
+
+
+STARTUP_SCRIPT = """
+import time
+started_at = time.perf_counter()
+import django
+from django.db import connection
+django.setup()
+connection.force_debug_cursor = True
+import gameapi.urls
+import gameapi.websocket
+print(time.perf_counter() - started_at, len(connection.queries))
+"""
+
+
+class EventLogTest(SimpleTestCase):
+    def test_events_below_level_are_not_built(self):
+        game = Game().start(PLAYERS, seed=3)
+        with mock.patch.object(event_log, 'level', logging.INFO), mock.patch('gameapi.events.emit') as emit:
+            play(game, 2)
+            emit.assert_not_called()
+            with mock.patch.object(event_log, 'level', logging.DEBUG):
+                play(game, 1)
+        self.assertEqual([call[0][:3] for call in emit.call_args_list], [('move', logging.DEBUG, 'move')])
+
+    def test_categories_are_sampled_separately(self):
+        self.assertEqual(parse_sampling('move:0.01, request:0.1,'), {'move': 0.01, 'request': 0.1})
+        log = EventLog(sampling={'move': 0.25})
+        with mock.patch('gameapi.events.random.random', side_effect=[0.1, 0.3]) as random_:
+            self.assertEqual([log.enabled('move', logging.INFO) for _ in range(2)], [True, False])
+            self.assertTrue(log.enabled('game', logging.INFO))
+            self.assertFalse(log.enabled('game', logging.DEBUG))
+        self.assertEqual(random_.call_count, 2)
+
+    def test_events_over_queue_size_are_dropped_and_counted(self):
+        log = EventLog(queue_size=2)
+        log.output = mock.Mock()
+        # No writer drains the queue until the events are emitted
+        with mock.patch.object(log, '_start_writer'):
+            for index in range(3):
+                log.emit('game', logging.INFO, 'game_over', index=index)
+        self.assertEqual(log.dropped, 1)
+
+        log._start_writer()
+        log.flush()
+        written = [ujson.loads(call[0][1])['index'] for call in log.output.log.call_args_list]
+        self.assertEqual(written, [0, 1])
+
+
+class SimulatorTest(SimpleTestCase):
+    def test_seeded_games_are_played_to_the_end(self):
+        result = simulate(6, ['random', 'greedy'], seed=10, processes=1, chunk_size=4)
+        self.assertEqual(result.number_of_games, 6)
+        self.assertEqual(result.outcomes[UNFINISHED], 0)
+        self.assertEqual(set(result.outcomes) - {0, 1, DRAW}, set())
+        self.assertEqual(simulate(6, ['random', 'greedy'], seed=10, processes=1).outcomes, result.outcomes)
+        self.assertEqual(play_game(10, [RandomPolicy, RandomPolicy], max_moves=5), UNFINISHED)
+
+
+class BenchmarkTest(SimpleTestCase):
+    BASELINE = {'benchmarks': {'get_state': {'median': 1e-5}, 'game_start': {'median': 2e-5}}}
+
+    def results(self, **medians):
+        return {'benchmarks': {name: {'median': median, 'min': median} for name, median in medians.items()}}
+
+    def test_slowdown_over_threshold_is_a_regression(self):
+        rows = compare(self.results(get_state=1.25e-5, game_start=2.1e-5, new=1e-5), self.BASELINE, 0.1)
+        self.assertEqual([(name, regressed) for name, _, _, _, regressed in rows],
+                         [('get_state', True), ('game_start', False)])
+
+    def test_benchmark_games_do_not_count_in_player_stats(self):
+        tokens = [Token(token=UUID(int=index)) for index in (101, 102)]
+        context = BenchmarkContext(tokens)
+        self.addCleanup(context.manager.close)
+        with mock.patch.object(action_log_writer, 'directory', ''), \
+                mock.patch.object(event_log, 'level', logging.ERROR):
+            game, _ = context.new_registered_game()
+            play(game)
+        self.assertEqual(context.manager.stats.get(tokens[0].token)['games'], 1)
+        self.assertNotIn(tokens[0].token, player_stats.stats)
+
+    def test_command_fails_on_regression_only(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = os.path.join(directory.name, 'baseline.json')
+        with open(baseline, 'w') as baseline_file:
+            baseline_file.write(ujson.dumps(self.BASELINE))
+        output = io.StringIO()
+        with mock.patch('gameapi.management.commands.benchmark.run_benchmarks',
+                        return_value=self.results(get_state=1.05e-5)):
+            call_command('benchmark', compare=baseline, threshold=0.1, stdout=output)
+        with mock.patch('gameapi.management.commands.benchmark.run_benchmarks',
+                        return_value=self.results(get_state=1.5e-5)):
+            with self.assertRaisesMessage(CommandError, 'get_state'):
+                call_command('benchmark', compare=baseline, threshold=0.1, stdout=output)
+        self.assertIn('REGRESSION', output.getvalue())
+
+
+class StartupTest(SimpleTestCase):
+    # Generous bound for slow CI machines, a clean start takes well under a second
+    MAX_STARTUP_TIME = 5.0
+
+    def test_import_is_fast_and_does_not_touch_database(self):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, check=True, stdout=subprocess.PIPE,
+            env={'DJANGO_SETTINGS_MODULE': 'gameserver.settings', 'SEED_GAMES': '3', 'PATH': ''},
+        ).stdout.decode().split()
+        startup_time, queries = float(output[-2]), int(output[-1])
+        self.assertEqual(queries, 0)
+        self.assertLess(startup_time, self.MAX_STARTUP_TIME)
+
+
+class GetTokenTest(TransactionTestCase):
+    """
+    Cached tokens are invalidated on commit, so transactions are really committed here
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('player', password='secret')
+        self.addCleanup(token_cache.clear)
+        # Access log is written from its own thread, which cannot see the test transaction
+        patcher = mock.patch.object(token_access_log, 'max_pending', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_token(self, password='secret'):
+        return self.client.get('/login/get-token/', {'login': 'player', 'password': password})
+
+    def test_new_token_invalidates_previous_one(self):
+        first = ujson.loads(self.get_token().content)['token']
+        self.assertEqual(self.client.get('/game/my_games_list/', {'token': first}).status_code, 200)
+        second = ujson.loads(self.get_token().content)['token']
+        self.assertEqual(self.client.get('/game/my_games_list/', {'token': first}).status_code, 400)
+        self.assertEqual(self.client.get('/game/my_games_list/', {'token': second}).status_code, 200)
+        self.assertEqual(Token.objects.filter(valid=True).count(), 1)
+
+    def test_wrong_password(self):
+        self.assertEqual(self.get_token('wrong').status_code, 403)
+        self.assertFalse(Token.objects.exists())
+
+    def test_token_cached_again_before_commit_is_dropped(self):
+        token = issue_token(self.user)
+        with transaction.atomic():
+            invalidate_tokens([self.user.pk])
+            # Concurrent request still sees the committed valid row
+            token_cache.put(token)
+            self.assertTrue(token_cache.get(token.token).valid)
+        self.assertFalse(token_cache.get(token.token).valid)
+
+
+class TokenCacheTest(TransactionTestCase):
+    def setUp(self):
+        self.token = Token.objects.create(owner=User.objects.create_user('player'))
+        self.addCleanup(token_cache.clear)
+        self.now = 0
+        patcher = mock.patch('gameapi.token_cache.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_saved_token_is_reloaded(self):
+        self.assertTrue(token_cache.get(self.token.token).valid)
+        token = Token.objects.get(pk=self.token.pk)
+        token.valid = False
+        token.save()
+        self.assertFalse(token_cache.get(self.token.token).valid)
+
+    def test_deleted_token_is_not_resolved(self):
+        token_cache.get(self.token.token)
+        Token.objects.get(pk=self.token.pk).delete()
+        with self.assertRaises(Token.DoesNotExist):
+            token_cache.get(self.token.token)
+
+    def test_tokens_expire_after_ttl(self):
+        cache = TokenCache(ttl=10)
+        cache.get(self.token.token)
+        # Queryset update sends no signals, only TTL bounds staleness
+        Token.objects.filter(pk=self.token.pk).update(valid=False)
+        self.now = 9
+        self.assertTrue(cache.get(self.token.token).valid)
+        self.now = 10
+        self.assertFalse(cache.get(self.token.token).valid)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_least_recently_used_tokens_are_evicted(self):
+        cache = TokenCache(max_size=1)
+        other = Token.objects.create(owner=self.token.owner)
+        cache.get(self.token.token)
+        cache.get(other.token)
+        cache.get(other.token)
+        self.assertEqual(cache.stats(), {'size': 1, 'hits': 1, 'misses': 2, 'evictions': 1})
+
+
+class TokenAccessLogTest(TestCase):
+    def test_records_are_written_in_batches_and_dropped_when_buffer_is_full(self):
+        token = Token.objects.create(owner=User.objects.create_user('player'))
+        writer = TokenAccessLogWriter(batch_size=2, max_pending=3)
+        with mock.patch.object(writer, '_start_writer'):
+            for _ in range(5):
+                writer.record(token)
+        self.assertEqual((writer.pending, writer.dropped), (3, 2))
+        writer.flush()
+        self.assertEqual((writer.pending, writer.written), (0, 3))
+        self.assertEqual(TokenAccessLog.objects.filter(token=token).count(), 3)
+
+
+class PlayerStatsTest(SimpleTestCase):
+    def test_game_is_counted_for_both_players(self):
+        stats = PlayerStatsRegistry()
+        game = Game().start(PLAYERS, seed=3)
+        stats.track(game)
+        policy = RandomPolicy(random.Random(3))
+        moves = {player: 0 for player in PLAYERS}
+        with mock.patch('gameapi.models.player_stats', stats), mock.patch.object(event_log, 'level', logging.ERROR):
+            waiting = next(player for player in PLAYERS if player != game.active_player)
+            with self.assertRaises(Game.ActionNotAllowed):
+                game.take_action(waiting, Game.Action.TAKE, None)
+            while not game.is_over():
+                token = game.active_player
+                game.take_action_by_index(token, *policy.choose(game, token))
+                moves[token] += 1
+
+        for player in PLAYERS:
+            profile = stats.get(player)
+            self.assertEqual(profile['games'], 1)
+            self.assertEqual(profile['moves'], moves[player])
+            self.assertEqual(profile['moves_per_game'], moves[player])
+            self.assertIsNotNone(profile['average_decision_time'])
+        self.assertEqual(stats.get(waiting)['rejected_actions'], 1)
+        results = [(stats.get(player)['wins'], stats.get(player)['losses'], stats.get(player)['draws'])
+                   for player in PLAYERS]
+        self.assertIn(sorted(results), ([(0, 0, 1), (0, 0, 1)], [(0, 1, 0), (1, 0, 0)]))
+
+
+class ApiTestCase(TestCase):
+    """
+    Two players with tokens and a private game manager without action logs and snapshots
+    """
+
+    def setUp(self):
+        self.tokens = [Token.objects.create(owner=User.objects.create_user('player%d' % index)) for index in range(2)]
+        self.players = [token.token for token in self.tokens]
+        self.manager = GameManager(collect_interval=3600)
+        for patcher in (
+                # Access log is written from its own thread, which cannot see the test transaction
+                mock.patch.object(token_access_log, 'max_pending', 0),
+                mock.patch.object(action_log_writer, 'directory', ''),
+                mock.patch('gameapi.views.game_manager', self.manager),
+                mock.patch.object(event_log, 'level', logging.ERROR),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start_game(self, seed=0):
+        game = Game().start(self.players, seed=seed)
+        return self.manager.add_game(game), game
+
+    def get(self, path, token, client=None, **params):
+        return (client or self.client).get(path, dict(params, token=str(token)))
+
+
+class LongPollTest(ApiTestCase):
+    def test_polls_beyond_limit_are_rejected_and_do_not_block_moves(self):
+        game_id, game = self.start_game()
+        waiting = next(player for player in self.players if player != game.active_player)
+        url = '/game/play/%s/get_state/' % game_id
+        # Resolve the token here, the polling thread can not see the test transaction
+        self.assertEqual(self.get(url, waiting).status_code, 200)
+        responses = []
+
+        def poll():
+            responses.append(self.get(url, waiting, Client(), wait=10, since_move=game.number_of_moves))
+
+        slots = threading.BoundedSemaphore(1)
+        with mock.patch('gameapi.views.long_poll_slots', slots):
+            poller = threading.Thread(target=poll)
+            poller.start()
+            deadline = time.monotonic() + 5
+            while slots._value and time.monotonic() < deadline:
+                time.sleep(0.01)
+            rejected = self.get(url, waiting, wait=10, since_move=game.number_of_moves)
+            self.assertEqual(rejected.status_code, 429)
+
+            started_at = time.monotonic()
+            card = next(iter_cards(game.legal_cards(game.active_player)))
+            game.take_action_by_index(game.active_player, Game.Action.PUT, card)
+            poller.join(5)
+        self.assertLess(time.monotonic() - started_at, 5)
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(ujson.loads(responses[0].content)['game_state']['number_of_moves'], 1)
+
+    def test_asgi_polls_wait_on_event_loop(self):
+        game_id, game = self.start_game()
+        waiting = next(player for player in self.players if player != game.active_player)
+        url = '/game/play/%s/get_state/' % game_id
+        # Resolve the token here, executor threads can not see the test transaction
+        self.assertEqual(self.get(url, waiting).status_code, 200)
+        listeners = list(game.listeners)
+        forwarded = []
+
+        async def http_application(scope, receive, send):
+            forwarded.append(scope['query_string'])
+
+        application = GameSocketApplication(http_application=http_application)
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': url,
+            'query_string': urlencode({'token': waiting, 'wait': 10, 'since_move': 0}).encode(),
+        }
+
+        async def poll_and_move():
+            poll = asyncio.ensure_future(application(scope, None, None))
+            while len(game.listeners) == len(listeners):
+                await asyncio.sleep(0.01)
+            self.assertEqual(forwarded, [])
+            card = next(iter_cards(game.legal_cards(game.active_player)))
+            await asyncio.get_event_loop().run_in_executor(
+                None, game.take_action_by_index, game.active_player, Game.Action.PUT, card,
+            )
+            await asyncio.wait_for(poll, 5)
+
+        with mock.patch('gameapi.long_poll.game_manager', self.manager):
+            asyncio.run(poll_and_move())
+        # The view answers without waiting again
+        self.assertEqual(forwarded, [urlencode({'token': waiting, 'since_move': 0}).encode()])
+        self.assertEqual(game.listeners, listeners)
+
+
+class GameSocketTest(ApiTestCase):
+    def test_state_is_read_off_event_loop(self):
+        game_id, game = self.start_game()
+        # Resolve the token here, executor threads can not see the test transaction
+        self.assertEqual(self.get('/game/play/%s/get_state/' % game_id, self.players[0]).status_code, 200)
+        application = GameSocketApplication()
+        scope = {
+            'type': 'websocket', 'path': '/game/play/%s/ws/' % game_id,
+            'query_string': urlencode({'token': self.players[0]}).encode(),
+        }
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with game.lock:
+                locked.set()
+                release.wait(5)
+
+        async def connect_during_move():
+            inbox, outbox = asyncio.Queue(), asyncio.Queue()
+            socket = asyncio.ensure_future(application(scope, inbox.get, outbox.put))
+            await inbox.put({'type': 'websocket.connect'})
+            self.assertEqual((await asyncio.wait_for(outbox.get(), 5))['type'], 'websocket.accept')
+            started_at = time.monotonic()
+            # The loop keeps running while the game lock is held
+            await asyncio.sleep(0.1)
+            self.assertLess(time.monotonic() - started_at, 2)
+            self.assertTrue(outbox.empty())
+            release.set()
+            state = ujson.loads((await asyncio.wait_for(outbox.get(), 5))['text'])
+            self.assertEqual(state['game_state']['number_of_moves'], 0)
+            await inbox.put({'type': 'websocket.disconnect'})
+            await asyncio.wait_for(socket, 5)
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        locked.wait(5)
+        try:
+            with mock.patch('gameapi.websocket.game_manager', self.manager):
+                asyncio.run(connect_during_move())
+        finally:
+            release.set()
+            holder.join()
+
+
+class ActionLogTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.writer = ActionLogWriter(directory.name, flush_interval=3600)
+        self.game_id = UUID(int=100)
+
+    def test_log_of_another_game_with_the_same_id_is_not_appended_to(self):
+        self.writer.start_log(self.game_id, Game().start(PLAYERS, seed=1))
+        self.writer.finish_log(self.game_id)
+        with self.assertRaises(FileExistsError):
+            self.writer.start_log(self.game_id, Game().start(PLAYERS, seed=2))
+        self.assertEqual(read_log(self.writer.path_for(self.game_id))[0], 1)
+
+    def write_log(self, moves=10):
+        game = Game().start(PLAYERS, seed=5)
+        self.writer.start_log(self.game_id, game)
+        policy = RandomPolicy(random.Random(5))
+        for _ in range(moves):
+            game.take_action_by_index(game.active_player, *policy.choose(game, game.active_player))
+        self.writer.finish_log(self.game_id)
+        return self.writer.path_for(self.game_id)
+
+    def test_replay_restores_every_logged_move(self):
+        game = Game().start(PLAYERS, seed=7)
+        self.writer.start_log(self.game_id, game)
+        accepted = []
+        fields = [game.field.to_dict()]
+
+        def record(game_, token, action, card):
+            accepted.append((token, action, card))
+            fields.append(game_.field.to_dict())
+
+        game.subscribe(record)
+        while not game.is_over():
+            play(game, 5, seed=game.number_of_moves)
+            # Records are appended by several flushes
+            self.writer.flush_all()
+        self.writer.finish_log(self.game_id)
+        path = self.writer.path_for(self.game_id)
+
+        seed, players, starting_player, records = read_log(path)
+        self.assertEqual((seed, players, records), (7, PLAYERS, accepted))
+        replayed = replay(path)
+        self.assertEqual(
+            (replayed.field.to_dict(), replayed.winners, replayed.number_of_moves, replayed.active_player),
+            (game.field.to_dict(), game.winners, game.number_of_moves, game.active_player),
+        )
+        for moves in (0, 1, len(accepted) // 2):
+            self.assertEqual(replay(path, moves).field.to_dict(), fields[moves])
+
+    def test_garbled_log_raises_corrupted_log(self):
+        path = self.write_log()
+        with open(path, 'rb') as log_file:
+            data = log_file.read()
+        header_size = len(data) - 10 * 3
+        for garbled in (
+                data[:header_size - 5],
+                data + data,
+                data[:header_size] + bytes([7, 0, 0]) + data[header_size + 3:],
+                data[:header_size] + bytes([0, 9, 0]) + data[header_size + 3:],
+                data[:header_size] + bytes([0, 0, 200]) + data[header_size + 3:],
+        ):
+            with open(path, 'wb') as log_file:
+                log_file.write(garbled)
+            with self.assertRaises(CorruptedLog):
+                replay(path)
+
+
+class SnapshotRestoreTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name + '/snapshots.sqlite3'
+        self.writer = ActionLogWriter(directory.name, flush_interval=3600)
+        self.stores = []
+        for patcher in (
+                mock.patch('gameapi.games_manager.action_log_writer', self.writer),
+                mock.patch('gameapi.snapshots.action_log_writer', self.writer),
+                mock.patch.object(event_log, 'level', logging.ERROR),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Write everything before the directory is removed, so nothing is left for exit
+        self.addCleanup(self.flush)
+
+    def flush(self):
+        for store in self.stores:
+            store.flush()
+        self.writer.flush_all()
+        self.writer.logs.clear()
+
+    def restart(self) -> GameManager:
+        self.flush()
+        self.stores.append(SnapshotStore(self.path, interval=3600))
+        return GameManager(collect_interval=3600, grace_period=0, snapshots=self.stores[-1])
+
+    def test_games_survive_restart_with_moves_after_the_snapshot(self):
+        manager = self.restart()
+        game_ids = [manager.add_game(Game().start(PLAYERS, seed=seed)) for seed in range(3)]
+        for game_id in game_ids:
+            play(manager.get_game(game_id), 5)
+        manager.snapshots.flush()
+        # Moves after the last snapshot are only in the action log
+        play(manager.get_game(game_ids[0]), 3, seed=1)
+        states = {game_id: manager.get_game(game_id).field.to_dict() for game_id in game_ids}
+
+        restarted = self.restart()
+        self.assertEqual(sorted(restarted.list_games(PLAYERS[0])), sorted(game_ids))
+        new_game_id = restarted.add_game(Game().start(PLAYERS, seed=10))
+        self.assertNotIn(new_game_id, game_ids)
+        for game_id in game_ids:
+            self.assertEqual(restarted.get_game(game_id).field.to_dict(), states[game_id])
+
+    def test_finished_game_archived_before_its_snapshot_was_dropped(self):
+        manager = self.restart()
+        game_id = manager.add_game(Game().start(PLAYERS, seed=1))
+        game = manager.get_game(game_id)
+        play(game, 1000)
+        self.assertTrue(game.is_over())
+        manager.snapshots.flush()
+        manager.archive.save([(game_id, game)])
+
+        restarted = self.restart()
+        self.assertEqual(restarted.list_games(PLAYERS[0], GameManager.FINISHED), [game_id])
+        self.assertEqual(restarted.get_game(game_id).field.to_dict(), game.field.to_dict())
+        restarted.evict_finished_games()
+        self.assertNotIn(game_id, restarted.games)
+        self.assertEqual(restarted.get_game(game_id).field.to_dict(), game.field.to_dict())
+
+
+class GameEvictionTest(TestCase):
+    def setUp(self):
+        for patcher in (
+                mock.patch.object(action_log_writer, 'directory', ''),
+                mock.patch.object(event_log, 'level', logging.ERROR),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_evicted_games_are_still_listed_and_reloaded(self):
+        manager = GameManager(collect_interval=3600, grace_period=0)
+        finished_id, running_id = manager.add_game(Game().start(PLAYERS)), manager.add_game(Game().start(PLAYERS))
+        play(manager.get_game(finished_id))
+        manager.evict_finished_games()
+        self.assertEqual(set(manager.games), {running_id})
+
+        self.assertEqual(set(manager.list_games(PLAYERS[0])), {finished_id, running_id})
+        self.assertEqual(manager.list_games(PLAYERS[0], manager.FINISHED), [finished_id])
+        self.assertEqual(manager.list_games(PLAYERS[1], manager.ACTIVE), [running_id])
+        self.assertTrue(manager.get_game(finished_id).is_over())
+
+    def test_games_over_limit_are_evicted_in_background(self):
+        archived = []
+        archive = mock.Mock()
+        archive.save.side_effect = archived.extend
+        manager = GameManager(archive=archive, collect_interval=3600, max_resident_games=1)
+        self.addCleanup(manager.close)
+        finished = Game().start(PLAYERS)
+        play(finished)
+        finished_id = manager.add_game(finished)
+        running_id = manager.add_game(Game().start(PLAYERS))
+        for _ in range(500):
+            if finished_id not in manager.games:
+                break
+            time.sleep(0.01)
+        self.assertEqual(set(manager.games), {running_id})
+        self.assertEqual(archived, [(finished_id, finished)])
+
+    def test_games_are_listed_by_status(self):
+        manager = GameManager(collect_interval=3600)
+        finished_id, running_id = manager.add_game(Game().start(PLAYERS)), manager.add_game(Game().start(PLAYERS))
+        play(manager.get_game(finished_id))
+        other_id = manager.add_game(Game().start([PLAYERS[1], UUID(int=3)]))
+
+        self.assertEqual(manager.list_games(PLAYERS[0], manager.ACTIVE), [running_id])
+        self.assertEqual(manager.list_games(PLAYERS[0], manager.FINISHED), [finished_id])
+        self.assertEqual(set(manager.list_games(PLAYERS[1], manager.ACTIVE)), {running_id, other_id})
+        self.assertEqual(manager.list_games(UUID(int=4), manager.ACTIVE), [])
+
+    def test_oldest_evicted_games_are_listed_no_more(self):
+        manager = GameManager(collect_interval=3600, grace_period=0, max_listed_finished_games=2)
+        game_ids = []
+        for seed in range(3):
+            game_ids.append(manager.add_game(Game().start(PLAYERS, seed=seed)))
+            play(manager.get_game(game_ids[-1]))
+            manager.evict_finished_games()
+        self.assertEqual(list(manager.stored_finished), game_ids[1:])
+        self.assertEqual(set(manager.list_games(PLAYERS[0])), set(game_ids[1:]))
+        # Still loaded by id
+        self.assertTrue(manager.get_game(game_ids[0]).is_over())
+
+    def test_games_without_finish_time_are_evicted(self):
+        manager = GameManager(collect_interval=3600, grace_period=0)
+        game_ids = [manager.add_game(Game().start(PLAYERS, seed=seed)) for seed in range(2)]
+        for game_id in game_ids:
+            play(manager.get_game(game_id))
+        manager.get_game(game_ids[0]).finished_at = None
+        manager.evict_finished_games()
+        self.assertEqual(manager.games, {})
+
+    def test_conflicting_archived_game_does_not_stop_eviction(self):
+        manager = GameManager(collect_interval=3600, grace_period=0)
+        game_ids = [manager.add_game(Game().start(PLAYERS, seed=seed)) for seed in range(2)]
+        for game_id in game_ids:
+            play(manager.get_game(game_id))
+        ArchivedGame.objects.create(game_id=game_ids[0], data='{}')
+        with mock.patch('gameapi.archive.logger'):
+            manager.evict_finished_games()
+        self.assertEqual(manager.games, {})
+        self.assertEqual(ArchivedGame.objects.count(), 2)
+        self.assertTrue(manager.get_game(game_ids[0]).is_over())
+
+
+class StateCacheTest(ApiTestCase):
+    def test_polls_between_moves_reuse_serialized_state(self):
+        game_id, game = self.start_game()
+        cache = StateCache()
+        player = game.active_player
+        first = cache.get(game, player)
+        self.assertIs(cache.get(game, player), first)
+        self.assertIsNot(cache.get(game, player, with_legal_cards=True), first)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        play(game, 1)
+        second = cache.get(game, player)
+        self.assertNotEqual(second, first)
+        self.assertEqual(ujson.loads(second), game.get_state(player))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_view_serves_state_after_the_latest_move(self):
+        game_id, game = self.start_game()
+        url = '/game/play/%s/get_state/' % game_id
+        for _ in range(3):
+            for player in self.players:
+                for _ in range(2):
+                    self.assertEqual(ujson.loads(self.get(url, player).content), game.get_state(player))
+            play(game, 1)
+
+
+class StateDeltaTest(ApiTestCase):
+    @staticmethod
+    def apply(state: dict, delta: dict) -> dict:
+        field, changes = dict(state['game_field']), delta['game_field_delta']
+        field['cards'] = sorted(
+            set(field['cards']) - set(changes['cards_removed']) | set(changes['cards_added']),
+            key=CARD_STRINGS.index,
+        )
+        if changes.get('field_cleared'):
+            field['field_cards'] = []
+        field['field_cards'] = field['field_cards'] + changes['field_cards_added']
+        field['deck_counter'] = changes['deck_counter']
+        field['enemy_cards_counter'] = changes['enemy_cards_counter']
+        return {
+            'actions_available': delta['actions_available'],
+            'game_state': delta['game_state'],
+            'game_field': field,
+        }
+
+    def test_deltas_rebuild_full_state(self):
+        for seed in range(3):
+            game = Game().start(self.players, seed=seed)
+            states = [{player: game.get_state(player) for player in self.players}]
+            rng = random.Random(seed)
+            while not game.is_over():
+                play(game, 1, seed=game.number_of_moves)
+                states.append({player: game.get_state(player) for player in self.players})
+                since_move = max(0, game.number_of_moves - rng.randint(0, Game.HISTORY_LENGTH - 1))
+                for player in self.players:
+                    delta = game.get_state_delta(player, since_move)
+                    self.assertTrue(delta['delta'])
+                    self.assertEqual(self.apply(states[since_move][player], delta), game.get_state(player))
+
+    def test_view_returns_delta_or_full_state_for_old_moves(self):
+        with mock.patch.object(Game, 'HISTORY_LENGTH', 3):
+            game_id, game = self.start_game()
+        url = '/game/play/%s/get_state/' % game_id
+        player = self.players[0]
+        state = game.get_state(player)
+        play(game, 2)
+        delta = ujson.loads(self.get(url, player, delta=1, since_move=0).content)
+        self.assertEqual((delta['delta'], delta['since_move']), (True, 0))
+        self.assertEqual(self.apply(state, delta), game.get_state(player))
+
+        play(game, 1)
+        full = ujson.loads(self.get(url, player, delta=1, since_move=0).content)
+        self.assertEqual(full, dict(game.get_state(player), delta=False))
+        self.assertEqual(self.get(url, player, delta=1, since_move='x').status_code, 400)
+
+
+class MetricsViewTest(ApiTestCase):
+    def test_metrics_are_exposed_to_allowed_addresses(self):
+        game_id, game = self.start_game()
+        self.get('/game/play/%s/get_state/' % game_id, game.active_player)
+        response = self.client.get('/game/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        for name in ('durak_view_latency_seconds', 'durak_games', 'durak_state_cache_requests_total',
+                     'durak_token_lookups_total'):
+            self.assertIn('# TYPE %s ' % name, text)
+        self.assertRegex(text, r'durak_view_latency_seconds_count\{view="get_state"\} [1-9]')
+        self.assertEqual(self.client.get('/game/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+
+class LegalCardsViewTest(ApiTestCase):
+    def test_legal_cards_are_listed_on_request(self):
+        attacker, defender = self.players
+        game = rigged_game(['9C', '10H'], ['10C', '8C', '6S'], players=self.players)
+        game_id = self.manager.add_game(game)
+        url = '/game/play/%s/' % game_id
+        self.assertNotIn('legal_cards', ujson.loads(self.get(url + 'get_state/', attacker).content))
+        state = ujson.loads(self.get(url + 'get_state/', attacker, legal=1).content)
+        self.assertEqual(state['legal_cards'], ['9C', '10H'])
+        self.assertEqual(ujson.loads(self.get(url + 'get_state/', defender, legal=1).content)['legal_cards'], [])
+
+        state = ujson.loads(self.get(url + 'take_action/', attacker, action='put', card='9C', legal=1).content)
+        self.assertEqual(state['legal_cards'], [])
+        state = ujson.loads(self.get(url + 'get_state/', defender, legal=1).content)
+        self.assertEqual(state['legal_cards'], ['6S', '10C'])
+
+
+class TakeActionsViewTest(ApiTestCase):
+    def test_response_lists_queued_actions(self):
+        game_id, game = self.start_game()
+        attacker = game.active_player
+        card = next(iter_cards(game.legal_cards(attacker)))
+        response = self.get('/game/play/%s/take_actions/' % game_id, attacker,
+                            actions='put:%s,endturn' % CARD_STRINGS[card])
+        state = ujson.loads(response.content)
+        self.assertTrue(state['action_accepted'])
+        self.assertEqual(state['queued_actions'], ['endturn'])
+        self.assertEqual(state['game_state']['number_of_moves'], 1)
+
+
+class GamePlacementTest(SimpleTestCase):
+    """
+    Coordinator and owner shard talking through a fake transport
+    """
+    SHARDS = ['http://shard0', 'http://shard1']
+
+    def setUp(self):
+        for patcher in (
+                mock.patch.object(action_log_writer, 'directory', ''),
+                mock.patch.object(event_log, 'level', logging.ERROR),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.coordinator = GamePlacement(GameManager(collect_interval=3600), ShardMap(self.SHARDS, 0), 'secret')
+        self.owner = GamePlacement(GameManager(collect_interval=3600), ShardMap(self.SHARDS, 1), 'secret')
+        self.coordinator._post = self.owner._post = self.deliver
+
+    def deliver(self, url: str, data: dict):
+        data = ujson.loads(ujson.dumps(data))
+        if url == 'http://shard1/game/internal/games/start/':
+            self.owner.start_requested_game(data)
+        elif url == 'http://shard0/game/internal/games/over/':
+            self.coordinator.game_over(UUID(data['game_id']), data['winners'] and map(UUID, data['winners']))
+        else:
+            raise URLError('No route to %s' % url)
+
+    def test_games_start_on_owner_shard_and_report_result_back(self):
+        results = {}
+        reported = threading.Event()
+
+        def on_game_over(game_id, players, winners):
+            results[game_id] = (players, winners)
+            reported.set()
+
+        game_ids = [self.coordinator.start_game(PLAYERS, on_game_over=on_game_over) for _ in range(16)]
+        placements = (self.coordinator, self.owner)
+        for game_id in game_ids:
+            self.assertIn(game_id, placements[game_id.int % 2].manager.games)
+            self.assertNotIn(game_id, placements[1 - game_id.int % 2].manager.games)
+
+        game_id = next(game_id for game_id in game_ids if game_id.int % 2)
+        game = self.owner.manager.get_game(game_id)
+        play(game)
+        self.assertTrue(reported.wait(5))
+        self.assertEqual(results, {game_id: (PLAYERS, game.winners)})
+        self.assertNotIn(game_id, self.coordinator.callbacks)
+
+    def test_timed_out_start_is_retried_with_the_same_id(self):
+        start = self.owner.start_requested_game
+        attempts = []
+
+        def start_then_time_out(data):
+            attempts.append(data['game_id'])
+            start(data)
+            if len(attempts) == 1:
+                raise URLError('timed out')
+
+        self.owner.start_requested_game = start_then_time_out
+        with mock.patch.object(GamePlacement, 'START_RETRY_DELAYS', (0,)):
+            game_id = self.coordinator.start_game(PLAYERS, game_id=UUID(int=1))
+        self.assertEqual(attempts, [str(game_id)] * 2)
+        self.assertEqual(list(self.owner.manager.games), [game_id])
+        self.assertEqual(self.coordinator.manager.games, {})
+
+    def test_unconfirmed_start_is_not_moved_to_another_shard(self):
+        self.owner.start_requested_game = mock.Mock(side_effect=URLError('refused'))
+        with mock.patch.object(GamePlacement, 'START_RETRY_DELAYS', (0, 0)):
+            with self.assertRaises(PlacementFailed):
+                self.coordinator.start_game(PLAYERS, on_game_over=lambda *result: None, game_id=UUID(int=1))
+        self.assertEqual(self.owner.start_requested_game.call_count, 3)
+        self.assertEqual(self.coordinator.manager.games, {})
+        self.coordinator.forget(UUID(int=1))
+        self.assertEqual(self.coordinator.callbacks, {})
+
+
+class MatchmakerTest(SimpleTestCase):
+    def setUp(self):
+        for patcher in (
+                mock.patch.object(action_log_writer, 'directory', ''),
+                mock.patch.object(event_log, 'level', logging.ERROR),
+                mock.patch('gameapi.matchmaking.time.monotonic', lambda: self.now),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.now = 0
+        self.manager = GameManager(collect_interval=3600)
+        self.matchmaker = Matchmaker(GamePlacement(self.manager, ShardMap([])), timeout=30)
+
+    def test_waiting_player_learns_game_from_next_join(self):
+        first, second = PLAYERS
+        self.assertIsNone(self.matchmaker.join(first))
+        self.assertIsNone(self.matchmaker.join(first))
+        game_id = self.matchmaker.join(second)
+        self.assertEqual(self.matchmaker.join(first), game_id)
+        self.assertEqual(set(self.manager.get_game(game_id).players), set(PLAYERS))
+        self.assertEqual(self.matchmaker.matched, {})
+        self.assertEqual(self.matchmaker.waiting, {})
+        # Next join queues the player again
+        self.assertIsNone(self.matchmaker.join(first))
+
+    def test_players_are_paired_with_nearest_bucket(self):
+        self.matchmaker.ratings = {UUID(int=index): rating for index, rating in enumerate([1500, 1820, 1790, 1510])}
+        low, high, near_high, near_low = self.matchmaker.ratings
+        self.assertIsNone(self.matchmaker.join(low))
+        # Buckets 15 and 18 are too far apart
+        self.assertIsNone(self.matchmaker.join(high))
+        # Bucket 17 is next to 18 only
+        game_id = self.matchmaker.join(near_high)
+        self.assertEqual(set(self.manager.get_game(game_id).players), {high, near_high})
+        game_id = self.matchmaker.join(near_low)
+        self.assertEqual(set(self.manager.get_game(game_id).players), {low, near_low})
+        self.assertEqual(self.matchmaker.bucket_keys, [])
+
+    def test_players_go_back_to_queue_when_game_can_not_be_started(self):
+        first, second = PLAYERS
+        self.matchmaker.join(first)
+        with mock.patch.object(self.matchmaker.placement, 'start_game', side_effect=PlacementFailed()):
+            self.assertIsNone(self.matchmaker.join(second))
+        self.assertEqual(set(self.matchmaker.waiting), {first, second})
+        self.assertEqual(self.matchmaker.matched, {})
+
+    def test_players_not_pinging_are_dropped(self):
+        first, second, third = [UUID(int=index) for index in range(1, 4)]
+        self.matchmaker.join(first)
+        self.now = 31
+        self.assertIsNone(self.matchmaker.join(second))
+        self.assertEqual(list(self.matchmaker.waiting), [second])
+
+        self.now = 40
+        game_id = self.matchmaker.join(third)
+        self.assertIn(second, self.matchmaker.matched)
+        self.now = 71
+        self.assertIsNone(self.matchmaker.join(second))
+        self.assertEqual(self.matchmaker.matched, {})
+        # Expired match is still listed among games of the player
+        self.assertEqual(list(self.manager.list_games(second)), [game_id])
+
+    def test_ratings_are_updated_when_game_is_over(self):
+        first, second = PLAYERS
+        self.matchmaker.join(first)
+        game = self.manager.get_game(self.matchmaker.join(second))
+        play(game)
+        ratings = [self.matchmaker.get_rating(player) for player in PLAYERS]
+        self.assertAlmostEqual(sum(ratings), 2 * Matchmaker.INITIAL_RATING)
+        if len(game.winners or ()) == 1:
+            winner = PLAYERS.index(next(iter(game.winners)))
+            self.assertEqual(ratings[winner], Matchmaker.INITIAL_RATING + Matchmaker.K_FACTOR / 2)
+        else:
+            self.assertEqual(ratings, [Matchmaker.INITIAL_RATING] * 2)
+
+
+class QueuedExecutor(object):
+    """
+    Runs submitted calls only when asked to, in the calling thread
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.calls.append((fn, args, kwargs))
+
+    def run_all(self):
+        while self.calls:
+            fn, args, kwargs = self.calls.pop(0)
+            fn(*args, **kwargs)
+
+
+class TournamentTest(SimpleTestCase):
+    def setUp(self):
+        for patcher in (
+                mock.patch.object(action_log_writer, 'directory', ''),
+                mock.patch.object(event_log, 'level', logging.ERROR),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.manager = GameManager(collect_interval=3600)
+        self.placement = GamePlacement(self.manager, ShardMap([]))
+        self.executor = QueuedExecutor()
+
+    def create(self, count: int, **kwargs) -> Tournament:
+        players = {UUID(int=index): 'player%d' % index for index in range(1, count + 1)}
+        return Tournament(players, self.placement, series_length=2, executor_=self.executor, **kwargs).start()
+
+    def play_running_game(self, tournament: Tournament):
+        self.executor.run_all()
+        game_id = next(iter(tournament.running))
+        game = self.manager.get_game(game_id)
+        self.assertEqual(set(game.players), set(tournament.running[game_id].players))
+        play(game)
+        self.assertNotIn(game_id, tournament.running)
+
+    def play_all(self, tournament: Tournament):
+        games = 0
+        while tournament.running:
+            self.play_running_game(tournament)
+            games += 1
+        return games
+
+    def test_round_robin_plays_every_pair(self):
+        tournament = self.create(4, max_concurrent_series=1)
+        self.assertEqual(tournament.rounds_scheduled, 3)
+        self.assertEqual((len(tournament.running), len(tournament.pending)), (1, 5))
+        self.play_running_game(tournament)
+        # Second game of the same series
+        self.assertEqual(len(tournament.running), 1)
+        self.assertEqual(tournament.finished, [])
+
+        self.assertEqual(self.play_all(tournament) + 1, 12)
+        self.assertTrue(tournament.is_over)
+        pairs = {frozenset(series.players) for series in tournament.finished}
+        self.assertEqual(len(pairs), 6)
+        standings = tournament.get_standings()
+        self.assertEqual(standings['status'], 'over')
+        self.assertEqual([standing['series_played'] for standing in standings['standings']], [3] * 4)
+        self.assertEqual(sum(standing['points'] for standing in standings['standings']), 6)
+
+    def test_series_run_concurrently_when_players_are_free(self):
+        tournament = self.create(4)
+        self.assertEqual((len(tournament.running), len(tournament.pending)), (2, 4))
+        running = [set(series.players) for series in tournament.running.values()]
+        self.assertEqual(running[0] & running[1], set())
+
+    def test_next_swiss_round_is_scheduled_when_round_is_over(self):
+        tournament = self.create(3, format_=Tournament.SWISS, swiss_rounds=2)
+        self.assertEqual((tournament.rounds_scheduled, len(tournament.running)), (1, 1))
+        first_pair = frozenset(next(iter(tournament.running.values())).players)
+
+        self.assertEqual(self.play_all(tournament), 4)
+        self.assertEqual(tournament.rounds_scheduled, 2)
+        self.assertTrue(tournament.is_over)
+        self.assertNotEqual(frozenset(tournament.finished[1].players), first_pair)
+        self.assertEqual(len(tournament.byes), 2)
+
+    def test_next_game_is_not_started_by_listener_of_finished_one(self):
+        tournament = self.create(2)
+        self.executor.run_all()
+        game_id = next(iter(tournament.running))
+        with mock.patch.object(self.placement, 'start_game', wraps=self.placement.start_game) as start_game:
+            play(self.manager.get_game(game_id))
+            start_game.assert_not_called()
+            self.assertEqual(len(tournament.running), 1)
+            next_game_id = next(iter(tournament.running))
+            self.assertNotIn(next_game_id, self.manager.games)
+
+            self.executor.run_all()
+            start_game.assert_called_once()
+        self.assertIn(next_game_id, self.manager.games)
+
+    def test_unconfirmed_start_is_retried_with_same_id(self):
+        tournament = self.create(2)
+        game_id = next(iter(tournament.running))
+        outcomes = [PlacementFailed(), self.placement.start_game]
+
+        def start_game(*args, **kwargs):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome(*args, **kwargs)
+
+        with mock.patch.object(self.placement, 'start_game', side_effect=start_game) as retried, \
+                mock.patch('gameapi.tournament.time.sleep') as sleep:
+            self.executor.run_all()
+        self.assertEqual([call[1]['game_id'] for call in retried.call_args_list], [game_id] * 2)
+        sleep.assert_called_once_with(1)
+        self.assertIn(game_id, self.manager.games)
+
+
+class ShardViewsTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+                mock.patch.object(game_placement, 'manager', self.manager),
+                mock.patch.object(game_placement, 'secret', 'secret'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, path, data, secret='secret'):
+        headers = {'HTTP_' + SECRET_HEADER.upper().replace('-', '_'): secret}
+        return self.client.post(path, ujson.dumps(data), content_type='application/json', **headers)
+
+    def test_only_shards_can_start_games(self):
+        game_id = UUID(int=42)
+        data = {'game_id': str(game_id), 'players': list(map(str, self.players))}
+        self.assertEqual(self.post('/game/internal/games/start/', data, secret='wrong').status_code, 403)
+        self.assertEqual(self.manager.games, {})
+
+        response = self.post('/game/internal/games/start/', data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(self.manager.get_game(game_id).players), set(self.players))
+        response = self.get('/game/my_games_list/', self.players[0])
+        self.assertEqual(ujson.loads(response.content), [str(game_id)])
+
+    def test_result_of_unknown_game_is_rejected(self):
+        data = {'game_id': str(UUID(int=42)), 'winners': [str(self.players[0])]}
+        self.assertEqual(self.post('/game/internal/games/over/', data).status_code, 404)
+
+    def test_requests_are_redirected_to_owner_and_coordinator(self):
+        with mock.patch('gameapi.sharding.shard_map', ShardMap(['http://a', 'http://b'], 1)):
+            response = self.get('/game/play/%s/get_state/' % UUID(int=2), self.players[0])
+            self.assertEqual(response.status_code, 307)
+            self.assertEqual(response['Location'], 'http://a/game/play/%s/get_state/?token=%s' % (
+                UUID(int=2), self.players[0]))
+
+            response = self.get('/game/matchmaking/join/', self.players[0])
+            self.assertEqual(response.status_code, 307)
+            self.assertEqual(response['Location'], 'http://a/game/matchmaking/join/?token=%s' % self.players[0])
+
+    def test_games_of_other_shards_are_listed_with_shard_secret(self):
+        game_id = UUID(int=42)
+        self.manager.add_game(Game().start(self.players), game_id)
+        response = self.post('/game/internal/games/list/', {'player': str(self.players[0])}, secret='wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.post('/game/internal/games/list/', {'player': str(self.players[0]), 'status': 'finished'})
+        self.assertEqual(ujson.loads(response.content), [])
+
+        requests = []
+
+        def urlopen(request, timeout):
+            requests.append(request)
+            response = self.post(urlparse(request.full_url).path, ujson.loads(request.data),
+                                 secret=request.get_header(SECRET_HEADER.capitalize()))
+            return io.BytesIO(response.content)
+
+        shards = ShardMap(['http://a', 'http://b'], 1)
+        with mock.patch('gameapi.sharding.shard_map', shards), mock.patch('gameapi.views.shard_map', shards), \
+                mock.patch('gameapi.sharding.urlopen', side_effect=urlopen), \
+                mock.patch.object(token_access_log, 'max_pending', 1), \
+                mock.patch.object(token_access_log, 'record') as record:
+            response = self.get('/game/my_games_list/', self.players[0])
+        # Local game is listed again by the fake peer
+        self.assertEqual(ujson.loads(response.content), [str(game_id)] * 2)
+        self.assertEqual([request.full_url for request in requests], ['http://a/game/internal/games/list/'])
+        # The peer does not record the access of the player again
+        record.assert_called_once()
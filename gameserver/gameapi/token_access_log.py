@@ -0,0 +1,120 @@
+"""
+Batched writes of ``TokenAccessLog``
+
+``record`` only appends token id and time to an in-memory buffer. A background
+thread writes the buffer with one ``bulk_create`` when ``batch_size`` records are
+collected or every ``interval`` seconds. When the database lags behind and
+``max_pending`` records are waiting, new records are dropped and counted instead
+of slowing requests down.
+"""
+import atexit
+import logging
+import threading
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from gameapi import metrics
+from gameapi.models import Token, TokenAccessLog
+
+logger = logging.getLogger(__name__)
+
+
+class TokenAccessLogWriter(object):
+    _instance = None
+
+    def __init__(self, batch_size: int = 500, interval: float = 1.0, max_pending: int = 20000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        # (token id, access time)
+        self._pending: List[Tuple[int, object]] = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._batch_ready = threading.Event()
+        self._writer: threading.Thread = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                batch_size=getattr(settings, 'TOKEN_ACCESS_LOG_BATCH_SIZE', 500),
+                interval=getattr(settings, 'TOKEN_ACCESS_LOG_INTERVAL', 1.0),
+                max_pending=getattr(settings, 'TOKEN_ACCESS_LOG_MAX_PENDING', 20000),
+            )
+        return cls._instance
+
+    @property
+    def enabled(self):
+        return self.max_pending > 0
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def record(self, token: Token):
+        if self._writer is None:
+            self._start_writer()
+        with self._pending_lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append((token.pk, timezone.now()))
+            if len(self._pending) >= self.batch_size:
+                self._batch_ready.set()
+
+    def _start_writer(self):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_periodically, name='token-access-log-writer',
+                                                daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _write_periodically(self):
+        while True:
+            self._batch_ready.wait(self.interval)
+            self._batch_ready.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write token access log')
+            finally:
+                # Do not keep the thread's connection open between batches
+                connection.close()
+
+    def flush(self):
+        """
+        Write pending records, a batch the database rejects is dropped and counted
+        """
+        with self._write_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                TokenAccessLog.objects.bulk_create(
+                    [TokenAccessLog(token_id=token_id, access_time=access_time) for token_id, access_time in pending],
+                    batch_size=self.batch_size,
+                )
+            except DatabaseError:
+                with self._pending_lock:
+                    self.dropped += len(pending)
+                logger.exception('Dropped %d token access records', len(pending))
+                return
+            self.written += len(pending)
+
+
+token_access_log = TokenAccessLogWriter.get_instance()
+metrics.registry.register(metrics.CallbackCounter(
+    'durak_token_access_log_total', 'Token access records by result',
+    lambda: {('written',): token_access_log.written, ('dropped',): token_access_log.dropped}, ['result'],
+))
+metrics.registry.register(metrics.Gauge(
+    'durak_token_access_log_pending', 'Token access records waiting to be written',
+    lambda: token_access_log.pending,
+))
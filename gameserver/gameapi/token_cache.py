@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from typing import Iterable, Optional, OrderedDict, Tuple
+from uuid import UUID
+
+from django.conf import settings
+from django.db import transaction
+
+from gameapi import metrics
+from gameapi.models import Token
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache(object):
+    """
+    In-process LRU cache of resolved tokens with time based expiry.
+
+    Maps token UUID to the ``Token`` instance (with ``owner`` already fetched),
+    so repeated polling requests do not go to the database.
+    """
+    _instance = None
+
+    def __init__(self, max_size: int = 10000, ttl: float = 10.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # token -> (expiry time, token), least recently used first
+        self._entries: OrderedDict[UUID, Tuple[float, Token]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                max_size=getattr(settings, 'TOKEN_CACHE_MAX_SIZE', 10000),
+                ttl=getattr(settings, 'TOKEN_CACHE_TTL', 10.0),
+            )
+        return cls._instance
+
+    def get(self, token: UUID) -> Token:
+        """
+        Resolve token through the cache
+
+        :raises Token.DoesNotExist: if token is not registered
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                expires_at, cached = entry
+                if expires_at > now:
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return cached
+                del self._entries[token]
+            self.misses += 1
+
+        resolved = Token.objects.select_related('owner').get(token=token)
+        self.put(resolved)
+        return resolved
+
+    def put(self, token: Token):
+        with self._lock:
+            self._entries[token.token] = (time.monotonic() + self.ttl, token)
+            self._entries.move_to_end(token.token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, token: UUID):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_many(self, tokens: Iterable[UUID]):
+        with self._lock:
+            for token in tokens:
+                self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def parse_token(token_str: str) -> Optional[UUID]:
+    try:
+        return UUID(token_str)
+    except (TypeError, ValueError):
+        return None
+
+
+def invalidate_cached_token(sender, instance: Token, **kwargs):
+    """
+    ``post_save``/``post_delete`` receiver, drops the token once the change is committed
+    so a concurrent request can not cache the old row again
+    """
+    logger.debug('Invalidating cached token id=%s', instance.pk)
+    token = instance.token
+    transaction.on_commit(lambda: TokenCache.get_instance().invalidate(token))
+
+
+token_cache = TokenCache.get_instance()
+metrics.registry.register(metrics.CallbackCounter(
+    'durak_token_lookups_total', 'Token lookups by token cache result',
+    lambda: {('hit',): token_cache.hits, ('miss',): token_cache.misses}, ['result'],
+))
+metrics.registry.register(metrics.Gauge(
+    'durak_token_cache_size', 'Tokens in token cache', lambda: token_cache.stats()['size'],
+))
@@ -0,0 +1,85 @@
+"""
+Issuing tokens
+
+Every issuance invalidates previous valid tokens of the same players with one
+``UPDATE`` and creates the new tokens with one ``INSERT``. ``UPDATE`` does not send
+``post_save``, so invalidated tokens are dropped from ``token_cache`` here once the
+transaction commits: dropped earlier, a concurrent request could cache them again
+as still valid. Other processes notice within ``TOKEN_CACHE_TTL``.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from gameapi.models import Token
+from gameapi.token_cache import token_cache
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits number of query parameters
+BATCH_SIZE = 500
+
+
+def invalidate_tokens(owner_ids: List[int]) -> int:
+    """
+    Invalidate all valid tokens of **`owner_ids`**, returns number of invalidated tokens
+    """
+    invalidated = 0
+    for start in range(0, len(owner_ids), BATCH_SIZE):
+        tokens = Token.objects.filter(owner_id__in=owner_ids[start:start + BATCH_SIZE], valid=True)
+        uuids = list(tokens.values_list('token', flat=True))
+        invalidated += tokens.update(valid=False, invalidated_at=timezone.now())
+        transaction.on_commit(lambda uuids=uuids: token_cache.invalidate_many(uuids))
+    return invalidated
+
+
+def issue_tokens(users: Iterable[User]) -> Dict[User, Token]:
+    """
+    Issue new token for each of **`users`**, previous tokens stop working
+    """
+    users = list(users)
+    with transaction.atomic():
+        invalidated = invalidate_tokens([user.pk for user in users])
+        created = Token.objects.bulk_create([Token(owner=user) for user in users], batch_size=BATCH_SIZE)
+        # Read back by the unique token to get primary keys, bulk_create does not set them on every backend
+        tokens = {}
+        for start in range(0, len(created), BATCH_SIZE):
+            tokens.update((token.token, token) for token in Token.objects.select_related('owner').filter(
+                token__in=[token.token for token in created[start:start + BATCH_SIZE]]
+            ))
+    logger.info('Issued %d tokens, invalidated %d', len(tokens), invalidated)
+    return {user: tokens[token.token] for user, token in zip(users, created)}
+
+
+def issue_token(user: User) -> Token:
+    return issue_tokens([user])[user]
+
+
+def provision_players(passwords: Dict[str, Optional[str]]) -> Tuple[Dict[str, Token], Set[str]]:
+    """
+    Create missing players and issue tokens for all of them in one transaction.
+    Returns login -> token and logins of created players, existing players keep their passwords.
+
+    :param passwords: login -> password, ``None`` for players who only get a token
+    """
+    logins = list(passwords)
+    with transaction.atomic():
+        existing = set()
+        for start in range(0, len(logins), BATCH_SIZE):
+            existing.update(User.objects.filter(username__in=logins[start:start + BATCH_SIZE])
+                            .values_list('username', flat=True))
+        User.objects.bulk_create([
+            User(username=login, password=make_password(passwords[login]))
+            for login in logins if login not in existing
+        ], batch_size=BATCH_SIZE)
+        # bulk_create does not set primary keys on every backend, so the players are read back
+        users = []
+        for start in range(0, len(logins), BATCH_SIZE):
+            users.extend(User.objects.filter(username__in=logins[start:start + BATCH_SIZE]))
+        tokens = issue_tokens(users)
+    logger.info('Provisioned %d players, %d of them new', len(logins), len(logins) - len(existing))
+    return {user.username: token for user, token in tokens.items()}, set(logins) - existing
@@ -0,0 +1,311 @@
+"""
+Tournaments of game series
+
+Tournament pairs its players into series of ``series_length`` games (round robin
+or Swiss system) and plays as many series at once as possible: a series starts
+as soon as both its players are free and fewer than ``max_concurrent_series``
+series are running. Next game of a series is started when the previous one ends,
+winners of the previous game are passed to ``Game.start`` as ``last_winners``.
+Standings are updated on every game end. Games are started on the shards owning them
+(see gameapi.placement) by ``executor`` threads, never from the listener of the game that
+just ended, tournaments themselves live on the coordinator.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID, uuid4
+
+from gameapi.placement import GamePlacement, PlacementFailed, game_placement
+
+logger = logging.getLogger(__name__)
+
+SERIES_LENGTH = 10
+
+# Starts games of all tournaments, threads are spawned on first use
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='tournament-games')
+
+
+class Standing(object):
+    __slots__ = ('player', 'name', 'points', 'series_played', 'wins', 'losses', 'draws')
+
+    def __init__(self, player: UUID, name: str):
+        self.player = player
+        self.name = name
+        # 1 for a won series, 0.5 for a drawn one
+        self.points = 0.0
+        self.series_played = 0
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'points': self.points,
+            'series_played': self.series_played,
+            'wins': self.wins,
+            'losses': self.losses,
+            'draws': self.draws,
+        }
+
+
+class Series(object):
+    def __init__(self, players: Tuple[UUID, UUID], length: int):
+        self.players = players
+        self.length = length
+        self.games_played = 0
+        self.wins: Dict[UUID, int] = {player: 0 for player in players}
+        self.last_winners: Set[UUID] = set()
+        self.game_ids: List[UUID] = []
+
+    @property
+    def is_over(self):
+        return self.games_played >= self.length
+
+    def winner(self) -> Optional[UUID]:
+        first, second = self.players
+        if self.wins[first] == self.wins[second]:
+            return None
+        return first if self.wins[first] > self.wins[second] else second
+
+    def as_dict(self):
+        return {
+            'players': [str(player) for player in self.players],
+            'games_played': self.games_played,
+            'wins': [self.wins[player] for player in self.players],
+            'game_ids': [str(game_id) for game_id in self.game_ids],
+        }
+
+
+def round_robin_rounds(players: List[UUID]) -> List[List[Tuple[UUID, UUID]]]:
+    """
+    Circle method: every player meets every other player once, one series per player per round
+    """
+    players = list(players)
+    if len(players) % 2:
+        players.append(None)
+    rounds = []
+    for _ in range(len(players) - 1):
+        half = len(players) // 2
+        pairs = [(players[i], players[-i - 1]) for i in range(half)]
+        rounds.append([pair for pair in pairs if None not in pair])
+        players = [players[0], players[-1]] + players[1:-1]
+    return rounds
+
+
+class Tournament(object):
+    ROUND_ROBIN = 'round_robin'
+    SWISS = 'swiss'
+    FORMATS = (ROUND_ROBIN, SWISS)
+
+    # Longest delay in seconds between attempts to start a game on its unreachable owner shard
+    MAX_START_RETRY_DELAY = 60
+
+    def __init__(self, players: Dict[UUID, str], placement: GamePlacement, format_: str = ROUND_ROBIN,
+                 series_length: int = SERIES_LENGTH, max_concurrent_series: int = None, swiss_rounds: int = None,
+                 executor_: Executor = None):
+        """
+        :param players: player token -> name shown in standings
+        :param executor_: starts games, module-level ``executor`` if None
+        """
+        if format_ not in self.FORMATS:
+            raise ValueError('Unknown tournament format %s' % format_)
+        if len(players) < 2:
+            raise ValueError('Tournament needs at least two players')
+        self.id = uuid4()
+        self.placement = placement
+        self.executor = executor_ or executor
+        self.format = format_
+        self.series_length = series_length
+        self.max_concurrent_series = max_concurrent_series
+        self.standings: Dict[UUID, Standing] = {player: Standing(player, name) for player, name in players.items()}
+        self.swiss_rounds = swiss_rounds or max(1, (len(players) - 1).bit_length())
+        self.rounds_scheduled = 0
+        self.pending: List[Series] = []
+        self.running: Dict[UUID, Series] = {}
+        self.finished: List[Series] = []
+        self.busy_players: Set[UUID] = set()
+        self.played_pairs: Set[frozenset] = set()
+        self.byes: Set[UUID] = set()
+        self._lock = threading.RLock()
+
+    @property
+    def is_over(self):
+        rounds_left = self.format == self.SWISS and self.rounds_scheduled < self.swiss_rounds
+        return not self.pending and not self.running and not rounds_left
+
+    def start(self):
+        with self._lock:
+            if self.format == self.ROUND_ROBIN:
+                for round_ in round_robin_rounds(sorted(self.standings)):
+                    self._schedule_round(round_)
+            else:
+                self._schedule_swiss_round()
+            self._fill()
+        return self
+
+    def _schedule_round(self, pairs: List[Tuple[UUID, UUID]]):
+        self.rounds_scheduled += 1
+        for pair in pairs:
+            self.played_pairs.add(frozenset(pair))
+            self.pending.append(Series(pair, self.series_length))
+
+    def _schedule_swiss_round(self):
+        """
+        Pair players with closest points who have not played each other yet
+        """
+        order = sorted(self.standings.values(), key=lambda standing: (-standing.points, -standing.wins))
+        unpaired = [standing.player for standing in order]
+        if len(unpaired) % 2:
+            # Lowest ranked player who has not had a bye yet sits this round out
+            bye = next((player for player in reversed(unpaired) if player not in self.byes), unpaired[-1])
+            unpaired.remove(bye)
+            self.byes.add(bye)
+        pairs = []
+        while len(unpaired) > 1:
+            player = unpaired.pop(0)
+            opponent = next(
+                (other for other in unpaired if frozenset((player, other)) not in self.played_pairs),
+                unpaired[0],
+            )
+            unpaired.remove(opponent)
+            pairs.append((player, opponent))
+        self._schedule_round(pairs)
+
+    def _schedule_more(self):
+        if self.format == self.SWISS and self.rounds_scheduled < self.swiss_rounds:
+            self._schedule_swiss_round()
+            return True
+        return False
+
+    def _fill(self):
+        """
+        Start pending series whose players are free
+        """
+        if not self.pending and not self.running:
+            self._schedule_more()
+        still_pending = []
+        for series in self.pending:
+            can_start = (
+                    (self.max_concurrent_series is None or len(self.running) < self.max_concurrent_series) and
+                    not self.busy_players.intersection(series.players)
+            )
+            if not can_start:
+                still_pending.append(series)
+                continue
+            self.busy_players.update(series.players)
+            self._start_game(series)
+        self.pending = still_pending
+
+    def _start_game(self, series: Series):
+        """
+        Register next game of **`series`** and start it in the background: called with the
+        tournament lock held, from the listener of the previous game too
+        """
+        game_id = self.placement.new_game_id()
+        series.game_ids.append(game_id)
+        self.running[game_id] = series
+        self.executor.submit(self._place_game, game_id, list(series.players), set(series.last_winners))
+
+    def _place_game(self, game_id: UUID, players: List[UUID], last_winners: Set[UUID]):
+        delay = 1
+        while True:
+            try:
+                # Same id every time, the owner shard starts the game once
+                self.placement.start_game(players, last_winners, on_game_over=self.game_over, game_id=game_id)
+                logger.info('Tournament %s: game of %s started as %s', self.id, players, game_id)
+                return
+            except PlacementFailed as error:
+                logger.warning('Tournament %s: retrying start of game %s in %ds: %s', self.id, game_id, delay, error)
+            except Exception:
+                logger.exception('Tournament %s: could not start game %s', self.id, game_id)
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, self.MAX_START_RETRY_DELAY)
+
+    def game_over(self, game_id: UUID, players: List[UUID], winners: Optional[Set[UUID]]):
+        with self._lock:
+            series = self.running.pop(game_id)
+            series.games_played += 1
+            series.last_winners = set(winners or ())
+            for player in series.players:
+                standing = self.standings[player]
+                if not winners:
+                    standing.draws += 1
+                elif player in winners:
+                    standing.wins += 1
+                    series.wins[player] += 1
+                else:
+                    standing.losses += 1
+            if series.is_over:
+                self._finish_series(series)
+            else:
+                self._start_game(series)
+
+    def _finish_series(self, series: Series):
+        self.finished.append(series)
+        self.busy_players.difference_update(series.players)
+        winner = series.winner()
+        for player in series.players:
+            standing = self.standings[player]
+            standing.series_played += 1
+            if winner is None:
+                standing.points += 0.5
+            elif winner == player:
+                standing.points += 1
+        logger.info('Tournament %s: series %s finished %s', self.id, series.players, series.wins)
+        self._fill()
+
+    def get_standings(self):
+        with self._lock:
+            table = sorted(
+                self.standings.values(),
+                key=lambda standing: (-standing.points, -standing.wins, standing.losses, standing.name),
+            )
+            return {
+                'tournament_id': str(self.id),
+                'format': self.format,
+                'status': 'over' if self.is_over else 'play',
+                'standings': [standing.as_dict() for standing in table],
+                'running_series': [series.as_dict() for series in self.running.values()],
+                'pending_series': len(self.pending),
+                'finished_series': len(self.finished),
+            }
+
+
+class DoesNotExist(Exception):
+    pass
+
+
+class TournamentManager(object):
+    DoesNotExist = DoesNotExist
+    _instance = None
+
+    def __init__(self, placement: GamePlacement):
+        self.placement = placement
+        self.tournaments: Dict[UUID, Tournament] = {}
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(game_placement)
+        return cls._instance
+
+    def create(self, players: Dict[UUID, str], **kwargs) -> Tournament:
+        tournament = Tournament(players, self.placement, **kwargs)
+        self.tournaments[tournament.id] = tournament
+        return tournament.start()
+
+    def get(self, tournament_id: UUID) -> Tournament:
+        """
+        :raises DoesNotExist: if there is no such tournament
+        """
+        try:
+            return self.tournaments[tournament_id]
+        except KeyError:
+            raise DoesNotExist('Tournament with id "%s" doesnt exist' % tournament_id)
+
+
+tournament_manager = TournamentManager.get_instance()
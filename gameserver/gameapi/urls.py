@@ -5,6 +5,23 @@ import gameapi.views
 urlpatterns = [
     path('my_games_list/', gameapi.views.get_games_list, name='my_games_list'),
 
+    path('matchmaking/join/', gameapi.views.join_matchmaking, name='join_matchmaking'),
+    path('matchmaking/leave/', gameapi.views.leave_matchmaking, name='leave_matchmaking'),
+
+    path('tournament/create/', gameapi.views.create_tournament, name='create_tournament'),
+    path('tournament/<uuid:tournament_id>/standings/', gameapi.views.get_tournament_standings,
+         name='tournament_standings'),
+
     path('play/<uuid:game_id>/get_state/', gameapi.views.get_state, name='get_state'),
-    path('play/<uuid:game_id>/take_action/', gameapi.views.take_action, name='take_action')
+    path('play/<uuid:game_id>/take_action/', gameapi.views.take_action, name='take_action'),
+    path('play/<uuid:game_id>/take_actions/', gameapi.views.take_actions, name='take_actions'),
+
+    path('stats/my/', gameapi.views.get_my_stats, name='my_stats'),
+    path('stats/players/', gameapi.views.get_players_stats, name='players_stats'),
+
+    path('metrics/', gameapi.views.get_metrics, name='metrics'),
+
+    path('internal/games/start/', gameapi.views.start_shard_game, name='start_shard_game'),
+    path('internal/games/list/', gameapi.views.list_shard_games, name='list_shard_games'),
+    path('internal/games/over/', gameapi.views.report_shard_game_over, name='report_shard_game_over'),
 ]
@@ -1,17 +1,41 @@
 import logging
+import threading
 import ujson
 from uuid import UUID
 
-from django.core.exceptions import ValidationError
-from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.http import (
+    HttpRequest, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound
+)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
+from gameapi import metrics
 from gameapi.games_manager import DoesNotExist, game_manager
-from gameapi.models import Card, Game, Token
+from gameapi.models import CARD_STRINGS, NUMBER_OF_CARDS, Card, Game, Token
+from gameapi.matchmaking import matchmaker
+from gameapi.placement import SECRET_HEADER, game_placement
+from gameapi.player_stats import player_stats
+from gameapi.sharding import coordinator_only, fetch_remote_games, shard_map
+from gameapi.state_cache import state_cache
+from gameapi.token_access_log import token_access_log
+from gameapi.tournament import Tournament, tournament_manager
+from gameapi.tokens import BATCH_SIZE, issue_token
+from gameapi.token_cache import parse_token, token_cache
 
 # Create your views here.
 
 logger = logging.getLogger(__name__)
 
+# Longest take_actions batch, more than a hand can hold makes no sense
+MAX_QUEUED_ACTIONS = NUMBER_OF_CARDS
+
+long_poll_slots = threading.BoundedSemaphore(getattr(settings, 'LONG_POLL_MAX_WAITERS', 4))
+long_polls_rejected = metrics.registry.register(metrics.Counter(
+    'durak_long_polls_rejected_total', 'Long polls answered with 429 because all waiting slots were taken',
+))
+
 
 def token_auth(fn):
     def token_auth_wrapper(request, *args, **kwargs):
@@ -25,8 +49,9 @@ def token_auth(fn):
                 return HttpResponseBadRequest('Token  invalid')
         except Token.DoesNotExist:
             return HttpResponseBadRequest('Token  invalid')
+        if token_access_log.enabled:
+            token_access_log.record(token)
         kwargs.update({'token': token})
-        logger.debug('token_auth: Calling with arguments: %s %s', args, kwargs)
         return fn(request, *args, **kwargs)
 
     return token_auth_wrapper
@@ -59,71 +84,322 @@ def check_game_id(game_id: UUID):
 
 
 def check_token_exists(token: str):
-    try:
-        return Token.objects.get(token=token)
-    except ValidationError:
+    token_uuid = parse_token(token)
+    if token_uuid is None:
         return None
+    token = token_cache.get(token_uuid)
+    return token if token.valid else None
 
 
 def check_token_in_game(game: Game, token: Token):
     return token in game.players
 
 
+@metrics.timed_view('my_games_list')
 @token_auth
 def get_games_list(request: HttpRequest, token: Token = None):
-    logger.debug('/my_games_list handler %s %s', request, token)
     if token is None:
         return HttpResponseBadRequest()
-    games = list(map(str, game_manager.list_games(token.token)))
-    logger.debug('Games: %s', games)
+    status = request.GET.get('status')
+    if status not in (None, game_manager.ACTIVE, game_manager.FINISHED):
+        return HttpResponseBadRequest('Unknown status filter')
+    games = list(map(str, game_manager.list_games(token.token, status)))
+    if shard_map.enabled and game_placement.secret:
+        games.extend(fetch_remote_games(str(token.token), status, game_placement.secret))
     return HttpResponse(
         content=ujson.dumps(games)
     )
 
 
+@coordinator_only
+@token_auth
+def join_matchmaking(request: HttpRequest, token: Token = None):
+    game_id = matchmaker.join(token.token)
+    if game_id is None:
+        return HttpResponse(content=ujson.dumps({'status': 'waiting'}))
+    return HttpResponse(content=ujson.dumps({'status': 'matched', 'game_id': str(game_id)}))
+
+
+@coordinator_only
+@token_auth
+def leave_matchmaking(request: HttpRequest, token: Token = None):
+    matchmaker.leave(token.token)
+    return HttpResponse(content=ujson.dumps({'status': 'left'}))
+
+
+@coordinator_only
+@token_auth
+def create_tournament(request: HttpRequest, token: Token = None):
+    """
+    Start tournament between players given as comma separated usernames, staff only
+    """
+    if not token.owner.is_staff:
+        return HttpResponseForbidden('Only staff can create tournaments')
+    usernames = {name for name in request.GET.get('players', '').split(',') if name}
+    players = {}
+    for player_token in Token.objects.filter(
+            owner__username__in=usernames, valid=True
+    ).select_related('owner').order_by('issued_at'):
+        # Latest issued valid token of every player wins
+        players[player_token.owner.username] = player_token.token
+    missing = usernames - set(players)
+    if missing:
+        return HttpResponseBadRequest('No valid tokens for players: %s' % ', '.join(sorted(missing)))
+    try:
+        tournament = tournament_manager.create(
+            {player: username for username, player in players.items()},
+            format_=request.GET.get('format', Tournament.ROUND_ROBIN),
+            series_length=int(request.GET.get('series_length', 10)),
+            max_concurrent_series=int(request.GET['max_concurrent']) if 'max_concurrent' in request.GET else None,
+            swiss_rounds=int(request.GET['rounds']) if 'rounds' in request.GET else None,
+        )
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    return HttpResponse(content=ujson.dumps(tournament.get_standings()))
+
+
+@coordinator_only
+def get_tournament_standings(request: HttpRequest, tournament_id: UUID):
+    try:
+        tournament = tournament_manager.get(tournament_id)
+    except tournament_manager.DoesNotExist:
+        return HttpResponseNotFound('Tournament does not exist')
+    return HttpResponse(content=ujson.dumps(tournament.get_standings()))
+
+
+@token_auth
+def get_my_stats(request: HttpRequest, token: Token = None):
+    """
+    Profile of the player: results, moves per game, rejected actions and decision time
+    """
+    return HttpResponse(content=ujson.dumps(player_stats.get(token.token)))
+
+
+@token_auth
+def get_players_stats(request: HttpRequest, token: Token = None):
+    """
+    Profiles of all players who played on this server, staff only
+    """
+    if not token.owner.is_staff:
+        return HttpResponseForbidden('Only staff can see stats of all players')
+    stats = player_stats.get_all()
+    players = list(stats)
+    names = {}
+    for start in range(0, len(players), BATCH_SIZE):
+        names.update(Token.objects.filter(token__in=players[start:start + BATCH_SIZE])
+                     .values_list('token', 'owner__username'))
+    return HttpResponse(content=ujson.dumps(sorted(
+        (dict(profile, name=names.get(player), token=str(player)) for player, profile in stats.items()),
+        key=lambda profile: (profile['name'] or '', profile['token']),
+    )))
+
+
+@metrics.timed_view('get_state')
 @token_auth
 @game_auth
 def get_state(request: HttpRequest, game: Game = None, token: Token = None):
-    logger.debug('/get_state handler')
     if game is None or token is None:
         return HttpResponseBadRequest()
-    state = game.get_state(token.token)
-    logger.debug(state)
+    if 'wait' in request.GET:
+        try:
+            wait = min(float(request.GET['wait']), settings.LONG_POLL_MAX_WAIT)
+            since_move = int(request.GET.get('since_move', game.number_of_moves))
+        except ValueError:
+            return HttpResponseBadRequest('Incorrect wait or since_move')
+        if wait > 0 and not game.has_news_for(token.token, since_move):
+            if not long_poll_slots.acquire(blocking=False):
+                long_polls_rejected.inc()
+                response = HttpResponse('Too many waiting requests, retry later', status=429)
+                response['Retry-After'] = '1'
+                return response
+            try:
+                game.wait_for_change(token.token, since_move, wait)
+            finally:
+                long_poll_slots.release()
+    with_legal_cards = wants_legal_cards(request)
+    if 'delta' in request.GET and 'since_move' in request.GET:
+        try:
+            state = game.get_state_delta(token.token, int(request.GET['since_move']), with_legal_cards)
+        except ValueError:
+            return HttpResponseBadRequest('Incorrect since_move')
+    else:
+        return HttpResponse(content=state_cache.get(game, token.token, with_legal_cards))
     return HttpResponse(
         content=ujson.dumps(state),
     )
 
 
+@metrics.timed_view('take_action')
+@token_auth
 @game_auth
 def take_action(request: HttpRequest, game: Game, token: Token):
-    logger.debug('/take_action handler')
     if 'action' not in request.GET:
         return HttpResponseBadRequest('No action provided')
     action_str = request.GET['action']
     card_str = request.GET.get(key='card', default=None)
 
+    new_state = perform_action(game, token, action_str, card_str, wants_legal_cards(request))
+    return HttpResponse(content=ujson.dumps(new_state))
+
+
+@metrics.timed_view('take_actions')
+@token_auth
+@game_auth
+def take_actions(request: HttpRequest, game: Game, token: Token):
+    """
+    Take the first of comma separated ``action[:card]`` list now and queue the rest,
+    see ``Game.take_actions``
+    """
+    if 'actions' not in request.GET:
+        return HttpResponseBadRequest('No actions provided')
+    try:
+        actions = [
+            (Game.Action(action_str), Card.from_string(card_str).to_index() if card_str else None)
+            for action_str, _, card_str in (item.partition(':') for item in request.GET['actions'].split(','))
+        ]
+    except ValueError:
+        return HttpResponseBadRequest('Incorrect actions')
+    if len(actions) > MAX_QUEUED_ACTIONS:
+        return HttpResponseBadRequest('At most %d actions can be sent at once' % MAX_QUEUED_ACTIONS)
+
+    action_accepted = True
+    try:
+        game.take_actions(token.token, actions)
+    except (Game.ActionNotAllowed, Game.ActionInvalid):
+        action_accepted = False
+
+    with game.lock:
+        new_state = game.get_state(token.token, with_legal_cards=wants_legal_cards(request))
+        queued = list(game.queued_actions.get(token.token, ()))
+    new_state.update({
+        'action_accepted': action_accepted,
+        'queued_actions': [
+            action.value if card is None else '%s:%s' % (action.value, CARD_STRINGS[card]) for action, card in queued
+        ],
+    })
+    return HttpResponse(content=ujson.dumps(new_state))
+
+
+def get_token(request: HttpRequest):
+    """
+    Issue new token for ``login`` and ``password``, previous tokens of the player stop working
+    """
+    login = request.GET.get('login')
+    password = request.GET.get('password')
+    if not login or not password:
+        return HttpResponseBadRequest('No login or password provided')
+    user = authenticate(request, username=login, password=password)
+    if user is None:
+        return HttpResponseForbidden('Wrong login or password')
+    token = issue_token(user)
+    return HttpResponse(content=ujson.dumps({'token': str(token.token)}))
+
+
+def get_metrics(request: HttpRequest):
+    """
+    Prometheus scrape endpoint, served only to ``METRICS_ALLOWED_IPS``
+    """
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        return HttpResponseForbidden()
+    return HttpResponse(content=metrics.registry.render(), content_type='text/plain; version=0.0.4')
+
+
+def shard_auth(fn):
+    """
+    Let through only requests of other shards, parsing JSON body into ``data`` kwarg
+    """
+
+    def wrapper(request: HttpRequest, *args, **kwargs):
+        if not game_placement.is_authorized(request.META.get('HTTP_' + SECRET_HEADER.upper().replace('-', '_'))):
+            return HttpResponseForbidden('Wrong shard secret')
+        try:
+            kwargs['data'] = ujson.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest('Malformed JSON')
+        return fn(request, *args, **kwargs)
+
+    return wrapper
+
+
+@csrf_exempt
+@require_POST
+@shard_auth
+def start_shard_game(request: HttpRequest, data: dict = None):
+    """
+    Start game formed on the coordinator (see gameapi.placement)
+    """
+    try:
+        game_id = UUID(data['game_id'])
+    except (KeyError, TypeError, ValueError):
+        return HttpResponseBadRequest('Malformed game_id')
+    if not shard_map.is_local(game_id):
+        return HttpResponseBadRequest('Game is owned by another shard')
+    try:
+        game_placement.start_requested_game(data)
+    except (KeyError, TypeError, ValueError) as error:
+        return HttpResponseBadRequest('Malformed game: %s' % error)
+    return HttpResponse(content=ujson.dumps({'game_id': str(game_id)}))
+
+
+@csrf_exempt
+@require_POST
+@shard_auth
+def list_shard_games(request: HttpRequest, data: dict = None):
+    """
+    Ids of games of a player on this shard, for my_games_list of another shard
+    """
+    try:
+        player = UUID(data['player'])
+    except (KeyError, TypeError, ValueError):
+        return HttpResponseBadRequest('Malformed player')
+    status = data.get('status')
+    if status not in (None, game_manager.ACTIVE, game_manager.FINISHED):
+        return HttpResponseBadRequest('Unknown status filter')
+    return HttpResponse(content=ujson.dumps(list(map(str, game_manager.list_games(player, status)))))
+
+
+@coordinator_only
+@csrf_exempt
+@require_POST
+@shard_auth
+def report_shard_game_over(request: HttpRequest, data: dict = None):
+    """
+    Result of game started on another shard (see gameapi.placement)
+    """
+    try:
+        game_id = UUID(data['game_id'])
+        winners = None if data.get('winners') is None else [UUID(player) for player in data['winners']]
+    except (KeyError, TypeError, ValueError):
+        return HttpResponseBadRequest('Malformed result')
+    if not game_placement.game_over(game_id, winners):
+        return HttpResponseNotFound('No game like that was started here')
+    return HttpResponse(content=ujson.dumps({'status': 'ok'}))
+
+
+def wants_legal_cards(request: HttpRequest):
+    return request.GET.get('legal') not in (None, '', '0')
+
+
+def perform_action(game: Game, token: Token, action_str: str, card_str: str = None, with_legal_cards=False):
+    """
+    Apply player's action to the game and return resulting state for the player
+
+    Shared by HTTP and WebSocket transports.
+
+    :raises ValueError: if action or card can not be parsed
+    """
     uuid = token.token
     action = Game.Action(action_str)
     card = Card.from_string(card_str) if card_str else None
     action_accepted = True
     try:
         game.take_action(uuid, action, card)
-    except Game.ActionNotAllowed:
-        logger.warning(
-            'Action not allowed  %s %s',
-            action, token,
-        )
-        action_accepted = False
-    except Game.ActionInvalid:
-        logger.warning(
-            'Action invalid %s %s',
-            action, token,
-        )
+    except (Game.ActionNotAllowed, Game.ActionInvalid):
+        # Rejections are counted and logged as events by the game
         action_accepted = False
 
-    new_state = game.get_state(uuid)
+    new_state = game.get_state(uuid, with_legal_cards=with_legal_cards)
     new_state.update({
         'action_accepted': action_accepted,
     })
-    logger.debug(new_state)
-    return HttpResponse(content=ujson.dumps(new_state))
+    return new_state
@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import logging
+import re
+import ujson
+from urllib.parse import parse_qs
+from uuid import UUID
+
+from gameapi.games_manager import DoesNotExist, game_manager
+from gameapi.long_poll import LongPoll, wants_to_wait
+from gameapi.models import Game, Token
+from gameapi.sharding import shard_map
+from gameapi.token_access_log import token_access_log
+from gameapi.views import check_token_exists, check_token_in_game, perform_action
+
+logger = logging.getLogger(__name__)
+
+GAME_SOCKET_PATH = re.compile(r'^/game/play/(?P<game_id>[0-9a-fA-F-]{36})/ws/?$')
+
+# Application specific close codes (4000-4999 are reserved for applications)
+CLOSE_BAD_REQUEST = 4400
+CLOSE_NOT_FOUND = 4404
+# Game is owned by another shard, client should connect to it directly
+CLOSE_WRONG_SHARD = 4421
+
+
+class GameSocketApplication(object):
+    """
+    ASGI application serving game WebSockets and long polls of ``get_state``
+    and delegating everything else to **`http_application`**.
+
+    Client connects to ``/game/play/<game-id>/ws/?token=token`` and receives
+    game state (same structure as ``get_state``) after every move made in the game.
+    Actions are sent as text frames ``{"action": "put", "card": "9H"}`` and are
+    answered with the new state including ``action_accepted``.
+    """
+
+    def __init__(self, http_application=None):
+        self.http_application = http_application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            match = GAME_SOCKET_PATH.match(scope['path'])
+            if match is None:
+                await receive()
+                await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+                return
+            await GameSocket(scope, receive, send, UUID(match.group('game_id'))).run()
+        elif self.http_application is not None and wants_to_wait(scope):
+            await LongPoll(scope, receive, send, self.http_application).run()
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif self.http_application is not None:
+            await self.http_application(scope, receive, send)
+        else:
+            raise ValueError('Unsupported scope type %s' % scope['type'])
+
+    @staticmethod
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+class GameSocket(object):
+    def __init__(self, scope, receive, send, game_id: UUID):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.game_id = game_id
+        self.loop = asyncio.get_event_loop()
+        self.game_changed = asyncio.Event()
+        self.game: Game = None
+        self.token: Token = None
+        self.last_sent_move = None
+        self.with_legal_cards = False
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        close_code = await self.authenticate()
+        if close_code is not None:
+            await self.send({'type': 'websocket.close', 'code': close_code})
+            return
+        await self.send({'type': 'websocket.accept'})
+
+        # Subscribing and reading the state take the game lock, it is held for whole moves
+        await self.loop.run_in_executor(None, self.game.subscribe, self.on_game_changed)
+        try:
+            await self.send_state(await self.read_state())
+            await self.serve()
+        finally:
+            await self.loop.run_in_executor(None, self.game.unsubscribe, self.on_game_changed)
+
+    async def authenticate(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        token_str = query.get('token', [None])[0]
+        self.with_legal_cards = query.get('legal', [''])[0] not in ('', '0')
+        if token_str is None:
+            return CLOSE_BAD_REQUEST
+        try:
+            # Token lookup may hit the database, keep it off the event loop
+            self.token = await self.loop.run_in_executor(None, check_token_exists, token_str)
+        except Token.DoesNotExist:
+            return CLOSE_BAD_REQUEST
+        if self.token is None:
+            return CLOSE_BAD_REQUEST
+        if token_access_log.enabled:
+            token_access_log.record(self.token)
+        if not shard_map.is_local(self.game_id):
+            return CLOSE_WRONG_SHARD
+        try:
+            # Game may be loaded from snapshots or the archive
+            self.game = await self.loop.run_in_executor(None, game_manager.get_game, self.game_id)
+        except DoesNotExist:
+            return CLOSE_NOT_FOUND
+        if not check_token_in_game(self.game, self.token.token):
+            logger.warning('Token is not part of this game. (%s not in %s)', self.token, self.game.players)
+            return CLOSE_BAD_REQUEST
+        return None
+
+    def on_game_changed(self, game: Game, token, action, card):
+        # Called from whichever thread performed the action
+        self.loop.call_soon_threadsafe(self.game_changed.set)
+
+    async def serve(self):
+        receiving = asyncio.ensure_future(self.receive())
+        changed = asyncio.ensure_future(self.game_changed.wait())
+        try:
+            while True:
+                done, _ = await asyncio.wait({receiving, changed}, return_when=asyncio.FIRST_COMPLETED)
+                if changed in done:
+                    self.game_changed.clear()
+                    if self.game.number_of_moves != self.last_sent_move:
+                        await self.send_state(await self.read_state())
+                    changed = asyncio.ensure_future(self.game_changed.wait())
+                if receiving in done:
+                    message = receiving.result()
+                    if message['type'] == 'websocket.disconnect':
+                        return
+                    if message['type'] == 'websocket.receive':
+                        await self.handle_message(message)
+                    receiving = asyncio.ensure_future(self.receive())
+        finally:
+            receiving.cancel()
+            changed.cancel()
+
+    async def read_state(self):
+        return await self.loop.run_in_executor(
+            None, functools.partial(self.game.get_state, self.token.token, with_legal_cards=self.with_legal_cards),
+        )
+
+    async def handle_message(self, message):
+        try:
+            request = ujson.loads(message.get('text') or message.get('bytes') or '')
+            # Game listeners (action log, snapshots, tournaments) may do I/O, keep them off the event loop
+            new_state = await self.loop.run_in_executor(
+                None, perform_action, self.game, self.token, request['action'], request.get('card'),
+                self.with_legal_cards,
+            )
+        except (ValueError, KeyError, TypeError, AttributeError):
+            await self.send_json({'error': 'Incorrect action message'})
+            return
+        await self.send_state(new_state)
+
+    async def send_state(self, state):
+        self.last_sent_move = state['game_state']['number_of_moves']
+        await self.send_json(state)
+
+    async def send_json(self, data):
+        await self.send({'type': 'websocket.send', 'text': ujson.dumps(data)})
@@ -0,0 +1,28 @@
+"""
+ASGI config for gameserver project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Game WebSockets (``/game/play/<game-id>/ws/``) and waiting of ``get_state?wait=...``
+long polls are served on the event loop, plain HTTP requests are passed to the WSGI
+application running in a thread pool.
+
+Run with an ASGI server, e.g.::
+
+    uvicorn gameserver.asgi:application --host 0.0.0.0 --port 80
+"""
+
+import os
+
+import django
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gameserver.settings')
+
+django.setup()
+
+from gameapi.websocket import GameSocketApplication  # noqa: E402 (needs configured Django)
+
+application = GameSocketApplication(
+    http_application=WsgiToAsgi(get_wsgi_application()),
+)
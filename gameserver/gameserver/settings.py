@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'gameapi.sharding.ShardRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'gameserver.urls'
@@ -82,6 +83,94 @@ DATABASES = {
     }
 }
 
+# In-process cache of resolved API tokens (see gameapi.token_cache)
+# Changes are dropped from the cache of the process making them on commit, other processes
+# (shards) and queryset .update() outside gameapi.tokens keep serving the old token for up to TTL seconds
+
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', 10))
+TOKEN_CACHE_MAX_SIZE = int(os.getenv('TOKEN_CACHE_MAX_SIZE', 10000))
+
+# Upper bound in seconds for get_state?wait=... long polling requests
+
+LONG_POLL_MAX_WAIT = float(os.getenv('LONG_POLL_MAX_WAIT', 30))
+
+# Under asgi.py long polls wait on the event loop and are not limited. Served by
+# wsgi.py alone, every waiting long poll holds a thread of the WSGI server, polls
+# beyond LONG_POLL_MAX_WAITERS are answered with 429 so they can not starve moves
+# and other requests
+
+LONG_POLL_MAX_WAITERS = int(os.getenv('LONG_POLL_MAX_WAITERS', max(1, min(32, (os.cpu_count() or 1) + 4) // 2)))
+
+# Finished games are archived to the database and evicted from memory after
+# FINISHED_GAME_GRACE_PERIOD seconds, or earlier when more than MAX_RESIDENT_GAMES are in memory
+
+FINISHED_GAME_GRACE_PERIOD = float(os.getenv('FINISHED_GAME_GRACE_PERIOD', 300))
+MAX_RESIDENT_GAMES = int(os.getenv('MAX_RESIDENT_GAMES', 10000))
+# Evicted games are listed in my_games_list until there are more than MAX_LISTED_FINISHED_GAMES
+# of them, then the oldest ones are listed no more (they can still be loaded by id)
+MAX_LISTED_FINISHED_GAMES = int(os.getenv('MAX_LISTED_FINISHED_GAMES', 100000))
+
+# Sharding of games between server processes (see gameapi.sharding).
+# Every process gets the same comma separated list of base URLs of all processes
+# and its own index in it, e.g. GAME_SHARDS=http://10.0.0.1:8001,http://10.0.0.1:8002 GAME_SHARD_INDEX=1
+
+GAME_SHARDS = [shard for shard in os.getenv('GAME_SHARDS', '').split(',') if shard]
+GAME_SHARD_INDEX = int(os.getenv('GAME_SHARD_INDEX', 0))
+# Shared secret of all processes: the first one starts matchmaking and tournament games
+# on the processes owning them (see gameapi.placement), my_games_list collects games
+# of all processes. Empty keeps all of them on the first one and lists local games only
+GAME_SHARD_SECRET = os.getenv('GAME_SHARD_SECRET', '')
+
+# Binary logs of all player actions, one file per game (see gameapi.action_log).
+# Empty ACTION_LOG_DIR disables logging
+
+ACTION_LOG_DIR = os.getenv('ACTION_LOG_DIR', os.path.join(BASE_DIR, 'action_logs'))
+ACTION_LOG_FLUSH_INTERVAL = float(os.getenv('ACTION_LOG_FLUSH_INTERVAL', 1))
+
+# Snapshots of running games (see gameapi.snapshots) written every GAME_SNAPSHOT_INTERVAL seconds
+# to a local SQLite file, one file per server process. Empty GAME_SNAPSHOT_DB disables them.
+# {shard} in the path is replaced with .shard<GAME_SHARD_INDEX> when games are sharded (and with
+# nothing otherwise), so shards started from the same tree do not index each other's games
+
+GAME_SNAPSHOT_DB = os.getenv('GAME_SNAPSHOT_DB', os.path.join(BASE_DIR, 'game_snapshots{shard}.sqlite3')).replace(
+    '{shard}', '.shard%d' % GAME_SHARD_INDEX if len(GAME_SHARDS) > 1 else '',
+)
+GAME_SNAPSHOT_INTERVAL = float(os.getenv('GAME_SNAPSHOT_INTERVAL', 5))
+
+# Number of test games between the first two valid tokens started on the first request
+# (or with manage.py seed_games)
+
+SEED_GAMES = int(os.getenv('SEED_GAMES', 0))
+
+# Matchmaking queue (see gameapi.matchmaking): players with ratings within the same
+# or neighbouring buckets are paired, players not pinging for MATCHMAKING_TIMEOUT seconds are dropped
+
+MATCHMAKING_BUCKET_WIDTH = int(os.getenv('MATCHMAKING_BUCKET_WIDTH', 100))
+MATCHMAKING_MAX_BUCKET_DISTANCE = int(os.getenv('MATCHMAKING_MAX_BUCKET_DISTANCE', 1))
+MATCHMAKING_TIMEOUT = float(os.getenv('MATCHMAKING_TIMEOUT', 30))
+
+# Structured event log (see gameapi.events) written as JSON lines to the gameapi.events logger.
+# Events below EVENT_LOG_LEVEL are not built at all, EVENT_LOG_SAMPLING sets share of written
+# events per category (move, action_rejected, game), e.g. EVENT_LOG_SAMPLING=move:0.01
+
+EVENT_LOG_LEVEL = os.getenv('EVENT_LOG_LEVEL', 'INFO')
+EVENT_LOG_SAMPLING = os.getenv('EVENT_LOG_SAMPLING', '')
+EVENT_LOG_QUEUE_SIZE = int(os.getenv('EVENT_LOG_QUEUE_SIZE', 10000))
+
+# Prometheus metrics (see gameapi.metrics) are served on /game/metrics/
+# only to these comma separated client addresses
+
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+# Requests with a token are recorded in TokenAccessLog by a background thread (see
+# gameapi.token_access_log) in batches of TOKEN_ACCESS_LOG_BATCH_SIZE rows or every
+# TOKEN_ACCESS_LOG_INTERVAL seconds. Records beyond TOKEN_ACCESS_LOG_MAX_PENDING waiting
+# for the database are dropped and counted, 0 disables access logging
+
+TOKEN_ACCESS_LOG_BATCH_SIZE = int(os.getenv('TOKEN_ACCESS_LOG_BATCH_SIZE', 500))
+TOKEN_ACCESS_LOG_INTERVAL = float(os.getenv('TOKEN_ACCESS_LOG_INTERVAL', 1.0))
+TOKEN_ACCESS_LOG_MAX_PENDING = int(os.getenv('TOKEN_ACCESS_LOG_MAX_PENDING', 20000))
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -16,10 +16,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+import gameapi.views
 import gameserver.views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', gameserver.views.main),
+    path('login/get-token/', gameapi.views.get_token, name='get_token'),
     path('game/', include('gameapi.urls'))
 ]